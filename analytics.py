@@ -0,0 +1,346 @@
+"""Zbiorcze statystyki kosztów i zużycia ze wszystkich konwersacji.
+
+Odpowiedź na pytanie "ile wydaliśmy w tym tygodniu, na jakim modelu, na
+jakie tagi" wymagałaby parsowania wszystkich konwersacji. Zamiast tego
+magazyn (storage.py) przy każdym zapisie dokłada nowe odpowiedzi asystenta
+do sum w osobnej bazie SQLite (domyślnie db/analytics.sqlite3):
+
+- usage – (dzień, model, konwersacja) -> zapytania, tokeny promptu
+  (w tym z cache API), tokeny odpowiedzi, koszt w USD, suma i maksimum
+  czasu odpowiedzi oraz suma czasu do pierwszego tokenu,
+- daily – te same sumy per (dzień, model); z niej idą podsumowania i podział
+  na dni i modele bez filtra tagu (kilkaset wierszy zamiast dziesiątek tysięcy),
+- conversations – nazwa i liczba już policzonych wiadomości (dzięki niej
+  ponowny zapis całej konwersacji nie liczy jej drugi raz),
+- conversation_tags – aktualne tagi; podział na tagi to złączenie z usage.
+
+Zapytania podsumowania historii (summary.py) trafiają tu przez
+record_usage – nie są wiadomościami, więc nie ruszają licznika policzonych.
+
+Zapytania (summary, breakdown) czytają tylko te sumy – wierszy jest tyle,
+ile par dzień × model × konwersacja, a nie wiadomości. Koszt w PLN
+przeliczamy przy odczycie kursem USD_TO_PLN.
+
+Wydatki zostają w statystykach także po obcięciu historii albo usunięciu
+konwersacji – za te zapytania już zapłaciliśmy. Z tego samego powodu nie
+liczymy odpowiedzi z importu (archive.py oznacza je "imported"). Dzień odpowiedzi to jej
+"created_at" (starsze wiadomości go nie mają – wtedy dzień zapisu, a przy
+odbudowie dzień ostatniej zmiany konwersacji). Odbudowa od zera:
+    python manage.py rebuild-analytics
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+import costs
+from config import MODEL, USD_TO_PLN
+
+DIMENSIONS = ("day", "model", "conversation", "tag")
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    conversation_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    interrupted INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    timed INTEGER NOT NULL DEFAULT 0,
+    latency_sum_s REAL NOT NULL DEFAULT 0,
+    latency_max_s REAL NOT NULL DEFAULT 0,
+    ttft_sum_s REAL NOT NULL DEFAULT 0,
+    -- konwersacja na początku klucza: podział na konwersacje i tagi czyta wiersze po kolei
+    PRIMARY KEY (conversation_id, day, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    interrupted INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    timed INTEGER NOT NULL DEFAULT 0,
+    latency_sum_s REAL NOT NULL DEFAULT 0,
+    latency_max_s REAL NOT NULL DEFAULT 0,
+    ttft_sum_s REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    counted INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS conversation_tags (
+    tag TEXT NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversation_tags_by_conversation ON conversation_tags (conversation_id);
+"""
+
+_COLUMNS = (
+    "requests", "interrupted", "prompt_tokens", "cached_tokens", "completion_tokens",
+    "cost_usd", "timed", "latency_sum_s", "ttft_sum_s",
+)
+_SUMS = ", ".join(f"SUM(u.{c})" for c in _COLUMNS) + ", MAX(u.latency_max_s)"
+
+
+def _today():
+    return date.today().isoformat()
+
+
+def rollup(messages, default_day=None, default_model=MODEL):
+    """Sumy odpowiedzi asystenta z `messages` pogrupowane po (dzień, model)."""
+    groups = {}
+    for message in messages:
+        usage = message.get("usage")
+        # odpowiedź z cache nie była zapytaniem do API, a zaimportowana jest już policzona
+        # (albo zapłacona poza tą bazą) – import własnego eksportu liczyłby ją drugi raz
+        if not usage or message.get("cached") or message.get("imported"):
+            continue
+        day = (message.get("created_at") or default_day or _today())[:10]
+        model = message.get("model", default_model)
+        row = groups.setdefault((day, model), dict.fromkeys(_COLUMNS, 0) | {"latency_max_s": 0})
+        row["requests"] += 1
+        row["interrupted"] += bool(message.get("interrupted"))
+        row["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        row["cached_tokens"] += usage.get("cached_tokens", 0)
+        row["completion_tokens"] += usage.get("completion_tokens", 0)
+        row["cost_usd"] += costs.message_cost(message, default_model)
+        total_s = (message.get("timing") or {}).get("total_s")
+        if total_s is not None:
+            row["timed"] += 1
+            row["latency_sum_s"] += total_s
+            row["latency_max_s"] = max(row["latency_max_s"], total_s)
+            row["ttft_sum_s"] += message["timing"].get("ttft_s") or 0
+    return groups
+
+
+def _result(key, values):
+    (requests, interrupted, prompt_tokens, cached_tokens, completion_tokens,
+     cost_usd, timed, latency_sum_s, ttft_sum_s, latency_max_s) = values
+    result = {
+        "requests": requests or 0,
+        "interrupted": interrupted or 0,
+        "prompt_tokens": prompt_tokens or 0,
+        "cached_tokens": cached_tokens or 0,
+        "completion_tokens": completion_tokens or 0,
+        "cost_usd": cost_usd or 0.0,
+        "cost_pln": (cost_usd or 0.0) * USD_TO_PLN,
+        "avg_latency_s": latency_sum_s / timed if timed else None,
+        "max_latency_s": latency_max_s if timed else None,
+        "avg_ttft_s": ttft_sum_s / timed if timed else None,
+    }
+    if key is not None:
+        result = {"key": key, **result}
+    return result
+
+
+def period(days=None, since=None, until=None):
+    """Zakres dni (since, until) włącznie; `days` – ostatnie N dni z dzisiejszym."""
+    if days:
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+    return since, until
+
+
+class AnalyticsStore:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # nowy plik – magazyn powinien policzyć istniejące konwersacje
+        self.created = not self.path.exists()
+        self._local = threading.local()
+        self._conn().executescript(ANALYTICS_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    #
+    # aktualizacja
+    #
+    def _add(self, conn, conversation_id, groups):
+        update = (
+            ", ".join(f"{c} = {c} + excluded.{c}" for c in _COLUMNS)
+            + ", latency_max_s = MAX(latency_max_s, excluded.latency_max_s)"
+        )
+        values = [(*key, *(row[c] for c in _COLUMNS), row["latency_max_s"]) for key, row in groups.items()]
+        conn.executemany(
+            f"INSERT INTO usage (conversation_id, day, model, {', '.join(_COLUMNS)}, latency_max_s) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in _COLUMNS)}, ?) "
+            f"ON CONFLICT (conversation_id, day, model) DO UPDATE SET {update}",
+            [(conversation_id, *value) for value in values],
+        )
+        conn.executemany(
+            f"INSERT INTO daily (day, model, {', '.join(_COLUMNS)}, latency_max_s) "
+            f"VALUES (?, ?, {', '.join('?' for _ in _COLUMNS)}, ?) "
+            f"ON CONFLICT (day, model) DO UPDATE SET {update}",
+            values,
+        )
+
+    def _set_meta(self, conn, conversation_id, name=None, tags=None):
+        conn.execute("INSERT OR IGNORE INTO conversations (conversation_id) VALUES (?)", (conversation_id,))
+        if name is not None:
+            conn.execute("UPDATE conversations SET name = ? WHERE conversation_id = ?", (name, conversation_id))
+        if tags is not None:
+            conn.execute("DELETE FROM conversation_tags WHERE conversation_id = ?", (conversation_id,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO conversation_tags (tag, conversation_id) VALUES (?, ?)",
+                [(tag, conversation_id) for tag in tags],
+            )
+
+    def _record(self, conn, conversation_id, start, messages, keep=None, default_day=None):
+        self._set_meta(conn, conversation_id)
+        (counted,) = conn.execute(
+            "SELECT counted FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if keep is not None:
+            # obcięta historia – nowe wiadomości na tych pozycjach trzeba policzyć
+            counted = min(counted, keep)
+        end = start + len(messages)
+        if end > counted:
+            self._add(conn, conversation_id, rollup(messages[max(counted - start, 0):], default_day))
+            counted = end
+        conn.execute("UPDATE conversations SET counted = ? WHERE conversation_id = ?", (counted, conversation_id))
+
+    def record_conversation(self, conversation, default_day=None):
+        """Cała konwersacja (zapis albo import) – liczone są tylko jeszcze niepoliczone wiadomości.
+
+        Wiadomości z importu (oznaczone w archive.py jako "imported") nie
+        trafiają do sum, tylko przesuwają licznik policzonych.
+        """
+        messages = conversation.get("messages", [])
+        with self._transaction() as conn:
+            # krótsza historia niż policzona – obcięta; kolejne wiadomości na tych pozycjach są nowe
+            self._record(conn, conversation["id"], 0, messages, keep=len(messages), default_day=default_day)
+            self._set_meta(conn, conversation["id"], conversation.get("name", ""), conversation.get("tags", []))
+
+    def record_messages(self, conversation_id, start, messages, keep=None):
+        """Wiadomości dopisane od pozycji `start` (po ewentualnym obcięciu do `keep`)."""
+        with self._transaction() as conn:
+            self._record(conn, conversation_id, start, messages, keep)
+
+    def record_usage(self, conversation_id, calls):
+        """Zapytania spoza listy wiadomości (np. podsumowanie historii) – bez licznika policzonych."""
+        with self._transaction() as conn:
+            self._set_meta(conn, conversation_id)
+            self._add(conn, conversation_id, rollup(calls))
+
+    def update_meta(self, conversation_id, name=None, tags=None):
+        with self._transaction() as conn:
+            self._set_meta(conn, conversation_id, name, tags)
+
+    def rebuild(self, conversations):
+        """Liczy wszystko od zera z par (konwersacja, domyślny dzień); zwraca liczbę konwersacji."""
+        count = 0
+        with self._transaction() as conn:
+            for table in ("usage", "daily", "conversations", "conversation_tags"):
+                conn.execute(f"DELETE FROM {table}")
+            for conversation, default_day in conversations:
+                self._record(conn, conversation["id"], 0, conversation.get("messages", []), default_day=default_day)
+                self._set_meta(conn, conversation["id"], conversation.get("name", ""), conversation.get("tags", []))
+                # podsumowania historii mają tylko łączne zużycie – jako jedno zapytanie z dnia konwersacji
+                summary_call = costs.summary_usage_message(conversation.get("summary"))
+                if summary_call:
+                    self._add(conn, conversation["id"], rollup([summary_call], default_day))
+                count += 1
+        self.created = False
+        return count
+
+    #
+    # zapytania
+    #
+    def _where(self, since, until, model=None, tag=None):
+        clauses, params = [], []
+        if since:
+            clauses.append("u.day >= ?")
+            params.append(since)
+        if until:
+            clauses.append("u.day <= ?")
+            params.append(until)
+        if model:
+            clauses.append("u.model = ?")
+            params.append(model)
+        if tag:
+            clauses.append("u.conversation_id IN (SELECT conversation_id FROM conversation_tags WHERE tag = ?)")
+            params.append(tag)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def summary(self, since=None, until=None, model=None, tag=None):
+        """Sumy w zakresie dni (daty ISO, włącznie)."""
+        where, params = self._where(since, until, model, tag)
+        table = "usage" if tag else "daily"
+        row = self._conn().execute(f"SELECT {_SUMS} FROM {table} u{where}", params).fetchone()
+        return _result(None, row)
+
+    def breakdown(self, by, since=None, until=None, model=None, tag=None, limit=None):
+        """Sumy pogrupowane po `by` ("day", "model", "conversation" albo "tag").
+
+        Dni są posortowane chronologicznie, reszta od najdroższych. Przy
+        podziale na tagi konwersacja z kilkoma tagami liczy się w każdym.
+        """
+        if by not in DIMENSIONS:
+            raise ValueError(f"nieznany wymiar: {by!r} (dostępne: {', '.join(DIMENSIONS)})")
+        where, params = self._where(since, until, model, tag)
+        if by == "tag":
+            key, source = "t.tag", "usage u JOIN conversation_tags t ON t.conversation_id = u.conversation_id"
+        elif by == "conversation":
+            key, source = "u.conversation_id", "usage u"
+        else:
+            key, source = f"u.{by}", "usage u" if tag else "daily u"
+        order = "u.day" if by == "day" else "SUM(u.cost_usd) DESC"
+        sql = f"SELECT {key}, {_SUMS} FROM {source}{where} GROUP BY {key} ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        if by == "conversation":
+            # nazwy dokładamy dopiero do zgrupowanych (i przyciętych do `limit`) wierszy
+            sql = (f"SELECT g.*, c.name FROM ({sql}) g "
+                   "LEFT JOIN conversations c ON c.conversation_id = g.conversation_id")
+            rows = [
+                {**_result(row[0], row[1:-1]), "name": row[-1] or ""} for row in self._conn().execute(sql, params)
+            ]
+            return sorted(rows, key=lambda row: -row["cost_usd"])
+        return [_result(row[0], row[1:]) for row in self._conn().execute(sql, params)]
+
+    def models(self):
+        return [row[0] for row in self._conn().execute("SELECT DISTINCT model FROM daily ORDER BY model")]
+
+    def tags(self):
+        return [row[0] for row in self._conn().execute("SELECT DISTINCT tag FROM conversation_tags ORDER BY tag")]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_analytics(path):
+    """Baza statystyk w pliku `path` (jedna instancja na proces)."""
+    key = str(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = AnalyticsStore(path)
+        return store
@@ -1,23 +1,49 @@
-import json
+import time
+import uuid
 from pathlib import Path
 import streamlit as st
-from openai import OpenAI
 from datetime import datetime
 
+import archive
+import chatbot
+import clients
+import cold_storage
+import conversation_cache
+import costs
+import generation
+import metrics
+import ratelimit
+import rendering
+import storage
+import response_cache
+import retrieval
+import summary as history_summary
+import tokens
+from config import (
+    DEFAULT_PERSONALITY,
+    MODEL,
+    USD_TO_PLN,
+    EXPORTS_PATH,
+    STORAGE_BACKEND,
+    STREAM_REPLIES,
+    GENERATION_POLL_INTERVAL,
+    MAX_CONCURRENT_GENERATIONS,
+    SUMMARIZE_HISTORY,
+    RETRIEVAL,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL,
+    RENDER_WINDOW,
+    RENDER_PAGE_SIZE,
+    SEARCH_RESULTS_LIMIT,
+    COLD_AFTER_DAYS,
+)
 
-model_pricings = {
-    "gpt-4o": {
-        "input_tokens": 5.00 / 1_000_000,  # per token
-        "output_tokens": 15.00 / 1_000_000,  # per token
-    },
-    "gpt-4o-mini": {
-        "input_tokens": 0.150 / 1_000_000,  # per token
-        "output_tokens": 0.600 / 1_000_000,  # per token
-    }
-}
-MODEL = "gpt-4o-mini"
-USD_TO_PLN = 4.05
-PRICING = model_pricings[MODEL]
+# spany tego rerunu; panel diagnostyki pokazuje poprzedni (kompletny) rerun
+st.session_state["last_rerun_spans"] = st.session_state.get("rerun_spans", [])
+st.session_state["rerun_spans"] = metrics.begin_rerun()
+metrics.start_server()
 
 # Pole do ręcznego wprowadzenia klucza API
 api_key = st.sidebar.text_input("Wpisz swój OpenAI API Key:", type="password")
@@ -26,102 +52,105 @@ if not api_key:
     st.error("Musisz podać swój OpenAI API Key, aby korzystać z aplikacji.")
     st.stop()
 
-openai_client = OpenAI(api_key=api_key)
+# klient (i jego pool połączeń) jest współdzielony między rerunami
+openai_client = clients.get_openai_client(api_key)
 
 #
 # CHATBOT
 #
-def prepare_conversation_context(messages, max_tokens=4000):
-    """Przygotowuje kontekst konwersacji z inteligentnym obcinaniem historii."""
-    token_count = 0
-    context = []
-    
-    # Zawsze dodaj ostatnią wiadomość użytkownika
-    if messages:
-        context.append(messages[-1])
-        
-    # Dodawaj wcześniejsze wiadomości, dopóki nie przekroczysz limitu tokenów
-    for msg in reversed(messages[:-1]):
-        estimated_tokens = len(msg["content"].split()) * 1.3  # przybliżona liczba tokenów
-        if token_count + estimated_tokens > max_tokens:
-            break
-        context.insert(0, msg)
-        token_count += estimated_tokens
-        
-    return context
-
-def chatbot_reply(user_prompt, memory):
-    # dodaj system message
-    messages = [
-        {
-            "role": "system",
-            "content": st.session_state["chatbot_personality"],
-        },
-    ]
-    
-    # Użyj inteligentnego zarządzania kontekstem zamiast sztywnej liczby wiadomości
-    context = prepare_conversation_context(memory)
-    
-    # dodaj wszystkie wiadomości z kontekstu
-    for message in context:
-        messages.append({"role": message["role"], "content": message["content"]})
-    
-    # dodaj wiadomość użytkownika jeśli nie jest już w kontekście
-    if memory and memory[-1]["role"] == "user" and memory[-1]["content"] == user_prompt:
-        pass  # już jest w kontekście
-    else:
-        messages.append({"role": "user", "content": user_prompt})
+def _build_messages(user_prompt, memory):
+    return chatbot.build_messages(
+        st.session_state["chatbot_personality"],
+        user_prompt,
+        memory,
+        MODEL,
+        summary=st.session_state.get("summary") if SUMMARIZE_HISTORY else None,
+        retrieval_index=retrieval.get_index(st.session_state["id"]) if RETRIEVAL else None,
+    )
 
-    response = openai_client.chat.completions.create(
-        model=MODEL,
-        messages=messages
+
+def _response_cache(use_cache):
+    if not (RESPONSE_CACHE and use_cache):
+        return None
+    return response_cache.get_response_cache(
+        RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL
     )
-    usage = {}
-    if response.usage:
-        usage = {
-            "completion_tokens": response.usage.completion_tokens,
-            "prompt_tokens": response.usage.prompt_tokens,
-            "total_tokens": response.usage.total_tokens,
-        }
 
-    return {
+
+def _cached_reply(cache, messages):
+    started = time.perf_counter()
+    reply = cache.get(MODEL, messages)
+    if reply:
+        elapsed = time.perf_counter() - started
+        reply["timing"] = {"ttft_s": elapsed, "total_s": elapsed}
+    return reply
+
+
+def _assistant_message(reply):
+    message = {
         "role": "assistant",
-        "content": response.choices[0].message.content,
-        "usage": usage,
+        "content": reply["content"],
+        "model": MODEL,
+        "usage": reply["usage"],
+        "timing": reply["timing"],
     }
+    if reply.get("cached"):
+        message["cached"] = True
+    tokens.message_tokens(message, MODEL)
+    return message
+
+
+def _persist_reply(db, cache, messages):
+    # wywoływane w wątku roboczym – bez dostępu do st.session_state
+    def on_finish(job):
+        if job.message is None:
+            return None
+        if cache and job.status == generation.DONE:
+            cache.put(MODEL, messages, job.message)
+        return db.append_messages(job.conversation_id, [job.message])
+    return on_finish
+
+
+def start_chatbot_reply(user_prompt, memory, use_cache=True):
+    """Zwraca gotową odpowiedź z cache albo uchwyt zadania generującego ją w tle."""
+    with metrics.span("context_build"):
+        messages = _build_messages(user_prompt, memory)
+    cache = _response_cache(use_cache)
+    if cache:
+        cached = _cached_reply(cache, messages)
+        if cached:
+            return cached
+
+    return generation.start_generation(
+        openai_client,
+        st.session_state["id"],
+        MODEL,
+        messages,
+        on_finish=_persist_reply(get_storage(), cache, messages),
+        session=get_namespace(),
+    )
 
 #
 # CONVERSATION HISTORY AND DATABASE
 #
-DEFAULT_PERSONALITY = """
-Jesteś ekspertem w Pythonie, NLP oraz w tworzeniu aplikacji opartych na AI. Pomagasz mi w stworzeniu aplikacji o 
-runach nordyckich, która będzie miała następujące funkcje:
-Losowanie runy dnia – wraz z interpretacją, radami i wartościowymi opisami.
-Losowanie układu run – np. krzyż celtycki, układ partnerski.
-Model AI – który będzie interpretował układy run na podstawie źródeł oraz intencji wpisanej przez użytkownika.
-Dodatkowo chcę oddzielić dane (opisy run) od kodu i zarządzać nimi w osobnym pliku, np. JSON lub module Pythona. 
-Kod powinien być czysty, dobrze udokumentowany i łatwy do rozwijania.
-Proszę, abyś:
-Doradzał mi najlepsze praktyki w zarządzaniu danymi i organizacji kodu.
-Pomógł mi napisać funkcje do pobierania, losowania i interpretacji run.
-Wspierał mnie w implementacji prostego modelu NLP do interpretacji układów run.
-Sugestie i poprawki kodu podawał w czytelnej formie i tłumaczył, dlaczego warto je zastosować.
-Jeśli coś można zrobić lepiej, proponuj optymalne rozwiązania. Bądź konkretny, precyzyjny i pomagaj mi rozwijać 
-moje umiejętności w kodowaniu. Możesz zadawać pytania, jeśli coś wymaga doprecyzowania.
-""".strip()
-
-DB_PATH = Path("db")
-DB_CONVERSATIONS_PATH = DB_PATH / "conversations"
-EXPORTS_PATH = Path("exports")
-# db/
-# ├── current.json
-# ├── conversations/
-# │   ├── 1.json
-# │   ├── 2.json
-# │   └── ...
-# ├── exports/
-# │   ├── sokrates_conv_1_20250410_123045.json
-# │   └── ...
+def get_storage():
+    return storage.get_storage(STORAGE_BACKEND)
+
+
+def get_namespace():
+    """Przestrzeń nazw użytkownika/sesji dla wskaźnika aktualnej konwersacji.
+
+    Trzymamy ją w parametrze ?user= adresu, więc przetrwa odświeżenie strony,
+    a różne karty/osoby nie przełączają sobie nawzajem konwersacji.
+    """
+    if "namespace" not in st.session_state:
+        namespace = st.query_params.get("user")
+        if not namespace:
+            namespace = uuid.uuid4().hex[:12]
+            st.query_params["user"] = namespace
+        st.session_state["namespace"] = namespace
+    return st.session_state["namespace"]
+
 
 def load_conversation_to_state(conversation):
     st.session_state["id"] = conversation["id"]
@@ -129,40 +158,53 @@ def load_conversation_to_state(conversation):
     st.session_state["messages"] = conversation["messages"]
     st.session_state["chatbot_personality"] = conversation["chatbot_personality"]
     st.session_state["tags"] = conversation.get("tags", [])
+    st.session_state["summary"] = conversation.get("summary")
+    st.session_state["totals"] = conversation.get("totals")
+    if st.session_state["totals"] is None:
+        # starsza konwersacja bez sum – liczymy je raz i zapisujemy w metadanych
+        st.session_state["totals"] = costs.conversation_totals(conversation["messages"], conversation.get("summary"))
+        get_storage().update_conversation(conversation["id"], totals=st.session_state["totals"])
+    # ile wiadomości jest już zapisanych na dysku – kolejne tylko dopisujemy
+    st.session_state["persisted_message_count"] = len(conversation["messages"])
+
+
+def _load_or_restore(db, conversation_id):
+    """Konwersacja z magazynu; zarchiwizowana jest najpierw przywracana, usunięta to None."""
+    try:
+        # z cache procesu, jeśli nie zmieniła się od ostatniego odczytu
+        return conversation_cache.get_cache(db).load(conversation_id)
+    except FileNotFoundError:
+        pass
+    try:
+        # restore_conversation sprawdza archiwum jeszcze raz pod blokadą konwersacji
+        return db.restore_conversation(conversation_id) if db.is_archived(conversation_id) else None
+    except FileNotFoundError:
+        # usunięta przez inną sesję w trakcie przywracania
+        return None
 
 
 def load_current_conversation():
-    if not DB_PATH.exists():
-        DB_PATH.mkdir()
-        DB_CONVERSATIONS_PATH.mkdir()
-        conversation_id = 1
+    db = get_storage()
+    # sprawdzamy, która konwersacja jest aktualna
+    conversation_id = db.get_current_id(get_namespace())
+    conversation = None
+    if conversation_id is not None:
+        conversation = _load_or_restore(db, conversation_id)
+
+    if conversation is None:
+        # pusta baza albo aktualna konwersacja została usunięta w innej sesji
+        conversation_id = db.allocate_id()
         conversation = {
             "id": conversation_id,
-            "name": "Runiewski 1",
+            "name": f"Runiewski {conversation_id}",
             "chatbot_personality": DEFAULT_PERSONALITY,
             "messages": [],
             "tags": []
         }
 
-        # tworzymy nową konwersację
-        with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-            f.write(json.dumps(conversation))
-
-        # która od razu staje się aktualną
-        with open(DB_PATH / "current.json", "w") as f:
-            f.write(json.dumps({
-                "current_conversation_id": conversation_id,
-            }))
-
-    else:
-        # sprawdzamy, która konwersacja jest aktualna
-        with open(DB_PATH / "current.json", "r") as f:
-            data = json.loads(f.read())
-            conversation_id = data["current_conversation_id"]
-
-        # wczytujemy konwersację
-        with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-            conversation = json.loads(f.read())
+        # tworzymy nową konwersację, która od razu staje się aktualną
+        db.save_conversation(conversation)
+        db.set_current_id(conversation_id, get_namespace())
 
     load_conversation_to_state(conversation)
 
@@ -171,64 +213,108 @@ def save_current_conversation_messages():
     conversation_id = st.session_state["id"]
     new_messages = st.session_state["messages"]
 
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
+    persisted = st.session_state.get("persisted_message_count", 0)
+    keep = None
+    if len(new_messages) < persisted:
+        # historia została skrócona w tej sesji – obcinamy też zapis
+        keep = persisted = len(new_messages)
 
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-        f.write(json.dumps({
-            **conversation,
-            "messages": new_messages,
-        }))
+    # zapisujemy tylko wiadomości, których jeszcze nie ma w magazynie; bez
+    # `keep` nie obetniemy wiadomości dopisanych w międzyczasie przez inną sesję,
+    # a sumy kosztów liczy magazyn pod blokadą konwersacji
+    with metrics.span("save"):
+        result = get_storage().append_messages(conversation_id, new_messages[persisted:], keep=keep)
+    st.session_state["persisted_message_count"] = len(new_messages)
+    st.session_state["totals"] = result["totals"]
+
+
+def add_assistant_message(message):
+    st.session_state["messages"].append(message)
+    save_current_conversation_messages()
+    _schedule_summary()
+
+
+def _schedule_summary():
+    if SUMMARIZE_HISTORY:
+        # rozszerzenie podsumowania idzie w tle, wynik trafi do metadanych konwersacji
+        history_summary.schedule_summary(
+            openai_client,
+            get_storage(),
+            st.session_state["id"],
+            st.session_state.get("summary"),
+            st.session_state["messages"],
+            MODEL,
+        )
+
+
+def finish_generation(job):
+    """Przenosi wynik zakończonego zadania do stanu sesji."""
+    del st.session_state["generation"]
+    if job.error is not None:
+        st.session_state["generation_error"] = str(job.error)
+    if job.message is None or job.conversation_id != st.session_state["id"]:
+        # odpowiedź do innej konwersacji jest już zapisana w magazynie
+        return
+
+    if job.result is None:
+        # zapis w wątku roboczym się nie udał – ponawiamy go tutaj
+        st.session_state["messages"].append(job.message)
+        save_current_conversation_messages()
+    elif len(st.session_state["messages"]) + 1 == job.result["message_count"]:
+        st.session_state["messages"].append(job.message)
+        st.session_state["persisted_message_count"] = job.result["message_count"]
+        st.session_state["totals"] = job.result["totals"]
+    else:
+        # rerun między zapisem a końcem zadania (np. klik w pasku bocznym) wczytał już
+        # odpowiedź z magazynu albo inna sesja coś dopisała – bierzemy stan z magazynu
+        conversation = _load_or_restore(get_storage(), job.conversation_id)
+        if conversation is not None:
+            load_conversation_to_state(conversation)
+    _schedule_summary()
+
+
+def await_generation(job, placeholder):
+    """Odświeża treść generowanej odpowiedzi aż do końca zadania."""
+    shown = None
+    with metrics.span("api_wait"):
+        while not job.wait(GENERATION_POLL_INTERVAL):
+            if job.status == generation.QUEUED:
+                text = "_Czekam w kolejce…_"
+            elif job.status == generation.THROTTLED:
+                text = "_Czekam na limit zapytań API…_"
+            elif STREAM_REPLIES and job.parts:
+                text = job.text + " ▌"
+            else:
+                text = "_Generuję odpowiedź…_"
+            if text != shown:
+                placeholder.markdown(text)
+                shown = text
+    finish_generation(job)
+    st.rerun()
 
 
 def save_current_conversation_name():
     conversation_id = st.session_state["id"]
     new_conversation_name = st.session_state["new_conversation_name"]
 
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
-
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-        f.write(json.dumps({
-            **conversation,
-            "name": new_conversation_name,
-        }))
+    get_storage().update_conversation(conversation_id, name=new_conversation_name)
 
 
 def save_current_conversation_personality():
     conversation_id = st.session_state["id"]
     new_chatbot_personality = st.session_state["new_chatbot_personality"]
 
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
-
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-        f.write(json.dumps({
-            **conversation,
-            "chatbot_personality": new_chatbot_personality,
-        }))
+    get_storage().update_conversation(conversation_id, chatbot_personality=new_chatbot_personality)
 
 
 def update_conversation_tags(conversation_id, tags):
     """Aktualizuje tagi dla danej konwersacji."""
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
-    
-    conversation["tags"] = tags
-    
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-        f.write(json.dumps(conversation))
+    get_storage().update_conversation(conversation_id, tags=tags)
 
 
 def create_new_conversation():
-    # poszukajmy ID dla naszej kolejnej konwersacji
-    conversation_ids = []
-    for p in DB_CONVERSATIONS_PATH.glob("*.json"):
-        conversation_ids.append(int(p.stem))
-
-    # conversation_ids zawiera wszystkie ID konwersacji
-    # następna konwersacja będzie miała ID o 1 większe niż największe ID z listy
-    conversation_id = max(conversation_ids) + 1 if conversation_ids else 1
+    db = get_storage()
+    conversation_id = db.allocate_id()
     personality = DEFAULT_PERSONALITY
     if "chatbot_personality" in st.session_state and st.session_state["chatbot_personality"]:
         personality = st.session_state["chatbot_personality"]
@@ -241,82 +327,145 @@ def create_new_conversation():
         "tags": []
     }
 
-    # tworzymy nową konwersację
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "w") as f:
-        f.write(json.dumps(conversation))
-
-    # która od razu staje się aktualną
-    with open(DB_PATH / "current.json", "w") as f:
-        f.write(json.dumps({
-            "current_conversation_id": conversation_id,
-        }))
+    # tworzymy nową konwersację, która od razu staje się aktualną
+    db.save_conversation(conversation)
+    db.set_current_id(conversation_id, get_namespace())
 
     load_conversation_to_state(conversation)
+    st.session_state["render_window"] = RENDER_WINDOW
     st.rerun()
 
 
 def switch_conversation(conversation_id):
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
+    # konwersację wczyta rerun (load_current_conversation) – zwykle już z cache po prefetchu
+    get_storage().set_current_id(conversation_id, get_namespace())
+    st.session_state["render_window"] = RENDER_WINDOW
+    st.rerun()
 
-    with open(DB_PATH / "current.json", "w") as f:
-        f.write(json.dumps({
-            "current_conversation_id": conversation_id,
-        }))
 
-    load_conversation_to_state(conversation)
+def _forget_conversation(db, conversation_id):
+    # wpisy w pamięci procesu nie są już potrzebne
+    conversation_cache.get_cache(db).invalidate(conversation_id)
+    retrieval.forget(conversation_id)
+
+
+def delete_conversation(conversation_id):
+    db = get_storage()
+    db.delete_conversation(conversation_id)
+    _forget_conversation(db, conversation_id)
+    st.session_state.pop("confirm_delete", None)
     st.rerun()
 
 
+def archive_conversation(conversation_id):
+    db = get_storage()
+    db.archive_conversation(conversation_id)
+    _forget_conversation(db, conversation_id)
+    st.rerun()
+
+
+def restore_conversation(conversation_id):
+    get_storage().restore_conversation(conversation_id)
+    switch_conversation(conversation_id)
+
+
+def delete_button(conversation_id, key_prefix):
+    """Przycisk "Usuń" z potwierdzeniem drugim kliknięciem."""
+    if st.session_state.get("confirm_delete") == conversation_id:
+        if st.button("Na pewno?", key=f"{key_prefix}_confirm_{conversation_id}", type="primary"):
+            delete_conversation(conversation_id)
+    elif st.button("Usuń", key=f"{key_prefix}_{conversation_id}"):
+        st.session_state["confirm_delete"] = conversation_id
+        st.rerun()
+
+
 def list_conversations():
-    conversations = []
-    for p in DB_CONVERSATIONS_PATH.glob("*.json"):
-        with open(p, "r") as f:
-            conversation = json.loads(f.read())
-            conversations.append({
-                "id": conversation["id"],
-                "name": conversation["name"],
-                "tags": conversation.get("tags", [])
-            })
-
-    return conversations
-
-
-def export_conversation(conversation_id):
-    """Eksportuje konwersację do pliku JSON."""
-    if not EXPORTS_PATH.exists():
-        EXPORTS_PATH.mkdir()
-        
-    with open(DB_CONVERSATIONS_PATH / f"{conversation_id}.json", "r") as f:
-        conversation = json.loads(f.read())
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    export_path = EXPORTS_PATH / f"sokrates_conv_{conversation_id}_{timestamp}.json"
-    
-    with open(export_path, "w") as f:
-        f.write(json.dumps(conversation, indent=2))
-        
-    return export_path
+    with metrics.span("sidebar_listing"):
+        return get_storage().list_conversations()
 
 
-def import_conversation(file_path):
-    """Importuje konwersację z pliku JSON."""
-    with open(file_path, "r") as f:
-        conversation = json.loads(f.read())
-    
-    # Znajdź nowy ID dla importowanej konwersacji
-    conversation_ids = []
-    for p in DB_CONVERSATIONS_PATH.glob("*.json"):
-        conversation_ids.append(int(p.stem))
-    
-    new_id = max(conversation_ids) + 1 if conversation_ids else 1
-    conversation["id"] = new_id
-    conversation["name"] = f"{conversation['name']} (import)"
-    
-    with open(DB_CONVERSATIONS_PATH / f"{new_id}.json", "w") as f:
-        f.write(json.dumps(conversation))
-        
-    return new_id
+def export_conversations(conversation_ids, label):
+    """Eksportuje konwersacje do archiwum .ndjson.gz w katalogu eksportów."""
+    EXPORTS_PATH.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    export_path = EXPORTS_PATH / f"chatapp_{label}_{timestamp}.ndjson.gz"
+
+    bar = st.progress(0.0, text="Eksport…")
+    stats = archive.export_archive_file(
+        get_storage(),
+        export_path,
+        conversation_ids,
+        progress=lambda done, total: bar.progress(done / total, text=f"Eksport: {done}/{total}"),
+    )
+    bar.empty()
+    return export_path, stats
+
+
+def import_conversations(uploaded_file):
+    """Importuje archiwum (albo stary plik JSON) prosto z przesłanego bufora."""
+    bar = st.progress(0.0, text="Import…")
+
+    def progress(read_bytes, total_bytes, stats):
+        fraction = min(read_bytes / total_bytes, 1.0) if total_bytes else 0.0
+        bar.progress(fraction, text=f"Import: {stats['conversations']} konwersacji, {stats['messages']} wiadomości")
+
+    try:
+        return archive.import_file(get_storage(), uploaded_file, uploaded_file.size, progress)
+    finally:
+        bar.empty()
+
+
+def _format_seconds(value):
+    if value is None:
+        return "–"
+    if value == float("inf"):
+        return "> 60 s"
+    return f"{value * 1000:.0f} ms" if value < 1 else f"{value:.1f} s"
+
+
+def show_diagnostics():
+    """Panel diagnostyki: spany poprzedniego rerunu, opóźnienia API, liczniki."""
+    with st.expander("Diagnostyka"):
+        spans = st.session_state.get("last_rerun_spans") or []
+        if spans:
+            st.caption("Poprzedni rerun")
+            st.text("\n".join(f"{name:<18} {ms:8.1f} ms" for name, ms in spans))
+
+        snapshot = metrics.snapshot()
+        api_lines = []
+        for (name, labels), h in sorted(snapshot["histograms"].items()):
+            if not name.startswith("chatapp_api_") or not h["count"]:
+                continue
+            model = dict(labels).get("model", "")
+            if name == "chatapp_api_tokens_per_second":
+                api_lines.append(f"{model} tokeny/s: średnio {h['sum'] / h['count']:.0f}")
+            else:
+                label = name.removeprefix("chatapp_api_").removesuffix("_seconds")
+                api_lines.append(
+                    f"{model} {label}: p50 {_format_seconds(h['p50'])}, "
+                    f"p95 {_format_seconds(h['p95'])} (n={h['count']})"
+                )
+        if api_lines:
+            st.caption("Zapytania do API (kwantyle z kubełków histogramu)")
+            st.text("\n".join(api_lines))
+
+        cache_stats = conversation_cache.get_cache(get_storage()).stats()
+        if cache_stats["hit_ratio"] is not None:
+            st.caption("Cache konwersacji")
+            st.text(
+                f"trafienia {cache_stats['hit_ratio']:.0%} ({cache_stats['hits']}/"
+                f"{cache_stats['hits'] + cache_stats['misses']}), wpisy {cache_stats['entries']}, "
+                f"{cache_stats['bytes'] / 1e6:.1f}/{cache_stats['max_bytes'] / 1e6:.0f} MB, "
+                f"prefetch {cache_stats['prefetched']}"
+            )
+
+        counters = [
+            f"{name.removeprefix('chatapp_')}{''.join(f' {v}' for _, v in labels)}: {value:g}"
+            for (name, labels), value in sorted({**snapshot["counters"], **snapshot["gauges"]}.items())
+        ]
+        if counters:
+            st.caption("Liczniki")
+            st.text("\n".join(counters))
 
 
 def set_theme():
@@ -490,8 +639,10 @@ def set_theme():
 #
 # MAIN PROGRAM
 #
-set_theme()
-load_current_conversation()
+with metrics.span("set_theme"):
+    set_theme()
+with metrics.span("conversation_load"):
+    load_current_conversation()
 
 st.markdown(
     """
@@ -502,24 +653,58 @@ st.markdown(
     unsafe_allow_html=True
 )
 
-for message in st.session_state["messages"]:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-prompt = st.chat_input("O co chcesz spytać?")
+# renderujemy tylko ostatnie wiadomości; starsze doładowujemy porcjami
+render_window = st.session_state.setdefault("render_window", RENDER_WINDOW)
+first_visible = rendering.visible_range(len(st.session_state["messages"]), render_window)
+if first_visible:
+    if st.button(f"Załaduj wcześniejsze wiadomości (ukrytych: {first_visible})"):
+        st.session_state["render_window"] = render_window + RENDER_PAGE_SIZE
+        st.rerun()
+
+if "generation_error" in st.session_state:
+    st.error(f"Błąd generowania odpowiedzi: {st.session_state.pop('generation_error')}")
+
+render_started = time.perf_counter()
+with metrics.span("history_render"):
+    for message in st.session_state["messages"][first_visible:]:
+        with st.chat_message(message["role"]):
+            st.markdown(rendering.render_markdown(message["content"]))
+            if message.get("interrupted"):
+                st.caption("Odpowiedź przerwana")
+            if message.get("attempts") or message.get("model", MODEL) != MODEL:
+                st.caption(f"Model: {message.get('model', MODEL)}, zapytań: {message.get('attempts', 1)}")
+st.session_state["render_ms"] = (time.perf_counter() - render_started) * 1000
+
+job = st.session_state.get("generation")
+prompt = st.chat_input("O co chcesz spytać?", disabled=job is not None)
 if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    st.session_state["messages"].append({"role": "user", "content": prompt})
-
-    with st.chat_message("assistant"):
-        response = chatbot_reply(prompt, memory=st.session_state["messages"])
-        st.markdown(response["content"])
-
-    st.session_state["messages"].append({"role": "assistant", "content": response["content"], "usage": response["usage"]})
+    user_message = {"role": "user", "content": prompt}
+    # liczba tokenów liczona raz i zapisywana razem z wiadomością
+    tokens.message_tokens(user_message, MODEL)
+    st.session_state["messages"].append(user_message)
     save_current_conversation_messages()
 
+    use_cache = not st.session_state.get("bypass_response_cache", False)
+    result = start_chatbot_reply(prompt, st.session_state["messages"], use_cache)
+    if isinstance(result, generation.GenerationJob):
+        # odpowiedź generuje się w tle; czekamy na nią na końcu skryptu
+        job = st.session_state["generation"] = result
+    else:
+        with st.chat_message("assistant"):
+            st.markdown(result["content"])
+        add_assistant_message(_assistant_message(result))
+
+if job is not None:
+    if job.conversation_id == st.session_state["id"]:
+        with st.chat_message("assistant"):
+            reply_placeholder = st.empty()
+    else:
+        reply_placeholder = st.empty()
+    st.button("⏹ Zatrzymaj generowanie", on_click=job.cancel)
+
 with st.sidebar:
     # Dodanie przełącznika motywu
     st.markdown("""
@@ -579,11 +764,8 @@ with st.sidebar:
     """, unsafe_allow_html=True)
 
     st.subheader("Aktualna konwersacja")
-    total_cost = 0
-    for message in st.session_state.get("messages") or []:
-        if "usage" in message:
-            total_cost += message["usage"]["prompt_tokens"] * PRICING["input_tokens"]
-            total_cost += message["usage"]["completion_tokens"] * PRICING["output_tokens"]
+    # sumy utrzymywane przyrostowo przy zapisie wiadomości
+    total_cost = (st.session_state.get("totals") or costs.empty_totals())["cost_usd"]
 
     c0, c1 = st.columns(2)
     with c0:
@@ -592,6 +774,50 @@ with st.sidebar:
     with c1:
         st.metric("Koszt rozmowy (PLN)", f"{total_cost * USD_TO_PLN:.4f}")
 
+    totals = st.session_state.get("totals") or costs.empty_totals()
+    if totals.get("cached_tokens"):
+        st.caption(
+            f"Prompt z cache API: {totals['cached_tokens'] / totals['prompt_tokens']:.0%} tokenów "
+            f"({totals['cached_tokens']} z {totals['prompt_tokens']})"
+        )
+
+    if RESPONSE_CACHE:
+        st.checkbox("Pomiń cache odpowiedzi", key="bypass_response_cache")
+        cache_stats = _response_cache(True).stats()
+        st.caption(
+            f"Cache odpowiedzi: {cache_stats['hits']} trafień, {cache_stats['misses']} chybień, "
+            f"{cache_stats['entries']} wpisów"
+        )
+
+    st.caption(
+        f"Render historii: {st.session_state.get('render_ms', 0):.1f} ms "
+        f"({len(st.session_state['messages']) - first_visible} z {len(st.session_state['messages'])} wiadomości)"
+    )
+
+    st.caption(
+        f"Generowane odpowiedzi w procesie: {generation.active_generations()} "
+        f"(limit {MAX_CONCURRENT_GENERATIONS})"
+    )
+
+    limits = ratelimit.get_limiter(openai_client).stats()
+    if limits["queue_depth"]:
+        st.caption(
+            f"Kolejka do API: {limits['queue_depth']} zapytań "
+            f"(najdłużej czeka {limits['oldest_wait_s']:.1f} s)"
+        )
+    if limits["daily_cost_limit_usd"] is not None:
+        st.caption(f"Dzisiejszy koszt: ${limits['spent_today_usd']:.4f} z ${limits['daily_cost_limit_usd']:.2f}")
+
+    summary = st.session_state.get("summary")
+    if SUMMARIZE_HISTORY and summary:
+        st.caption(
+            f"Podsumowanie obejmuje {summary['covered']} wiadomości "
+            f"– oszczędność ok. {history_summary.tokens_saved(summary)} tokenów na zapytanie"
+        )
+    summary_error = history_summary.last_error(get_storage(), st.session_state["id"])
+    if SUMMARIZE_HISTORY and summary_error:
+        st.caption(f"Ostatnie podsumowanie historii nie powiodło się: {summary_error}")
+
     st.session_state["name"] = st.text_input(
         "Nazwa konwersacji",
         value=st.session_state["name"],
@@ -623,28 +849,81 @@ with st.sidebar:
 
     st.subheader("Eksport/Import konwersacji")
     if st.button("Eksportuj konwersację"):
-        export_path = export_conversation(st.session_state["id"])
-        st.success(f"Konwersacja wyeksportowana do: {export_path}")
-    
-    uploaded_file = st.file_uploader("Wybierz plik konwersacji do importu", type=["json"])
-    if uploaded_file is not None:
-        # Zapisz tymczasowo plik
-        temp_path = Path("temp_import.json")
-        with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
+        export_path, _ = export_conversations([st.session_state["id"]], f"conv_{st.session_state['id']}")
+        st.session_state["export_path"] = str(export_path)
+
+    export_tags = st.multiselect(
+        "Eksport wszystkich – tylko z tagami",
+        sorted({tag for c in list_conversations() for tag in c["tags"]}),
+        key="export_tags",
+    )
+    if st.button("Eksportuj wszystkie"):
+        conversation_ids = archive.select_conversations(get_storage(), export_tags)
+        export_path, stats = export_conversations(conversation_ids, "all")
+        st.session_state["export_path"] = str(export_path)
+        st.success(f"Wyeksportowano {stats['conversations']} konwersacji ({stats['messages']} wiadomości)")
+
+    if "export_path" in st.session_state and Path(st.session_state["export_path"]).exists():
+        export_path = Path(st.session_state["export_path"])
+        st.caption(f"Archiwum: {export_path}")
+        with open(export_path, "rb") as f:
+            st.download_button("Pobierz archiwum", f, file_name=export_path.name, mime="application/gzip")
+
+    uploaded_file = st.file_uploader("Archiwum (.ndjson.gz) lub konwersacja (.json) do importu", type=["gz", "json"])
+    # import dopiero po kliknięciu – plik zostaje w uploaderze między rerunami
+    if uploaded_file is not None and st.button("Importuj"):
         try:
-            new_id = import_conversation(temp_path)
-            st.success(f"Konwersacja zaimportowana z ID: {new_id}")
-            
-            if st.button("Przełącz na zaimportowaną konwersację"):
-                switch_conversation(new_id)
-        except Exception as e:
+            stats = import_conversations(uploaded_file)
+            st.session_state["last_import"] = stats
+        except archive.ArchiveError as e:
             st.error(f"Błąd podczas importu: {e}")
-        finally:
-            # Usuń plik tymczasowy
-            if temp_path.exists():
-                temp_path.unlink()
+
+    stats = st.session_state.get("last_import")
+    if stats:
+        st.success(
+            f"Zaimportowano {stats['conversations']} konwersacji ({stats['messages']} wiadomości)"
+            + (f", pominięto {stats['skipped']}" if stats["skipped"] else "")
+        )
+        if not stats["complete"]:
+            st.warning("Archiwum było ucięte – zaimportowano tylko kompletne konwersacje.")
+        for error in stats["errors"][:10]:
+            st.caption(error)
+        if len(stats["ids"]) == 1 and st.button("Przełącz na zaimportowaną konwersację"):
+            st.session_state.pop("last_import")
+            switch_conversation(stats["ids"][0])
+
+    search = get_storage().search_index
+    if search is not None:
+        st.subheader("Szukaj")
+        query = st.text_input("Szukaj w konwersacjach", key="search_query")
+        tag_counts = dict(search.tag_facets())
+        selected_tags = st.multiselect(
+            "Tagi",
+            list(tag_counts),
+            format_func=lambda tag: f"#{tag} ({tag_counts.get(tag, 0)})",
+            key="search_tags",
+        )
+        if query or selected_tags:
+            search_started = time.perf_counter()
+            with metrics.span("search"):
+                hits = search.search(query, tags=selected_tags, limit=SEARCH_RESULTS_LIMIT)
+            search_ms = (time.perf_counter() - search_started) * 1000
+            st.caption(f"Wyników: {len(hits)} ({search_ms:.0f} ms)")
+            hit_tags = search.tag_facets([hit["id"] for hit in hits])
+            if hit_tags:
+                st.caption("Tagi w wynikach: " + ", ".join(f"#{tag} ({count})" for tag, count in hit_tags))
+            for hit in hits:
+                tags_display = " ".join(f"#{tag}" for tag in hit["tags"])
+                archived = get_storage().is_archived(hit["id"])
+                st.markdown(f"**{hit['name']}** {tags_display}" + (" *(archiwum)*" if archived else ""))
+                if hit["snippet"]:
+                    st.caption(hit["snippet"])
+                if archived:
+                    if st.button("Przywróć", key=f"search_restore_{hit['id']}"):
+                        restore_conversation(hit["id"])
+                elif st.button("Otwórz", key=f"search_open_{hit['id']}",
+                               disabled=hit["id"] == st.session_state["id"]):
+                    switch_conversation(hit["id"])
 
     st.subheader("Konwersacje")
     if st.button("Nowa konwersacja"):
@@ -653,8 +932,12 @@ with st.sidebar:
     # pokazujemy do 15 konwersacji
     conversations = list_conversations()
     sorted_conversations = sorted(conversations, key=lambda x: x["id"], reverse=True)
+    # widoczne konwersacje wczytujemy w tle, żeby "Załaduj" nie czekało na dysk
+    conversation_cache.get_cache(get_storage()).prefetch(
+        [c["id"] for c in sorted_conversations[:15] if c["id"] != st.session_state["id"]]
+    )
     for conversation in sorted_conversations[:15]:
-        col1, col2, col3 = st.columns([7, 2, 2])
+        col1, col2, col3, col4 = st.columns([6, 2, 2, 2])
         
         with col1:
             conv_name = conversation["name"]
@@ -669,8 +952,36 @@ with st.sidebar:
                        disabled=conversation["id"] == st.session_state["id"]):
                 switch_conversation(conversation["id"])
                 
-        with col3:
-            if conversation["id"] != st.session_state["id"]:
-                if st.button("Usuń", key=f"delete_{conversation['id']}"):
-                    # Tutaj można dodać kod usuwania konwersacji
-                    pass
+        if conversation["id"] != st.session_state["id"]:
+            with col3:
+                if st.button("Archiwizuj", key=f"archive_{conversation['id']}"):
+                    archive_conversation(conversation["id"])
+            with col4:
+                delete_button(conversation["id"], "delete")
+
+    cold = get_storage().cold
+    with st.expander("Archiwum"):
+        st.caption(f"Konwersacje nieużywane od {COLD_AFTER_DAYS} dni trafiają tu same." if COLD_AFTER_DAYS
+                   else "Konwersacje trafiają tu tylko po kliknięciu \"Archiwizuj\".")
+        for entry in cold.list_entries(limit=15):
+            col1, col2, col3 = st.columns([7, 2, 2])
+            with col1:
+                st.write(entry["name"])
+                st.caption(f"zarchiwizowana {entry['archived_at'][:10]}, {entry['message_count']} wiadomości")
+            with col2:
+                if st.button("Przywróć", key=f"restore_{entry['id']}"):
+                    restore_conversation(entry["id"])
+            with col3:
+                delete_button(entry["id"], "delete_archived")
+    # archiwizacja nieużywanych konwersacji i kompaktacja archiwum idą w tle, raz na COLD_CHECK_INTERVAL
+    cold_storage.maintain_if_due(get_storage(), keep_ids=[st.session_state["id"]])
+
+    if metrics.ENABLED:
+        show_diagnostics()
+
+metrics.export_if_due()
+
+# czekamy na odpowiedź dopiero po narysowaniu całej strony – sidebar działa
+# w trakcie generowania, a kliknięcie "Zatrzymaj" przerywa ten rerun
+if job is not None:
+    await_generation(job, reply_placeholder)
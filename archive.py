@@ -0,0 +1,365 @@
+"""Eksport i import wielu konwersacji naraz (archiwum .ndjson.gz).
+
+Archiwum to plik NDJSON skompresowany gzipem – jeden rekord JSON na linię:
+
+    {"type": "header", "format": "chatapp-archive", "version": 1, "conversations": 2, ...}
+    {"type": "conversation", "id": 7, "name": "...", "chatbot_personality": "...", "tags": [], "message_count": 2}
+    {"type": "message", "data": {"role": "user", "content": "..."}}
+    {"type": "message", "data": {"role": "assistant", "content": "...", "usage": {...}}}
+    {"type": "conversation", "id": 9, ...}
+    ...
+
+Zapis i odczyt są strumieniowe – w pamięci jest naraz najwyżej jedna
+konwersacja, a import czyta bezpośrednio z przesłanego bufora (bez pliku
+tymczasowego). Każda konwersacja jest walidowana (razem z usage, podsumowaniem i czasami
+odpowiedzi – trafiają do wyceny i do kontekstu modelu); błędne są pomijane
+i trafiają do raportu, poprawne dostają nowe ID przydzielane partiami.
+Sumy kosztów (totals) z archiwum pomijamy i liczymy od nowa z wiadomości.
+
+Import obsługuje też stary format – pojedynczą konwersację jako plik JSON.
+
+Importowane odpowiedzi z kosztem dostają "imported": True – za te
+zapytania zapłaciliśmy już wcześniej, więc statystyki kosztów
+(analytics.py) ich nie liczą, nawet po wielokrotnym imporcie.
+"""
+import gzip
+import io
+from datetime import datetime
+
+import codec
+import costs
+from config import ARCHIVE_COMPRESSLEVEL, IMPORT_ID_BATCH
+
+ARCHIVE_FORMAT = "chatapp-archive"
+ARCHIVE_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+MESSAGE_ROLES = ("system", "user", "assistant")
+# ile błędów zapisujemy w raporcie importu
+MAX_REPORTED_ERRORS = 100
+
+
+def mark_imported(messages):
+    for message in messages:
+        if message.get("usage"):
+            message["imported"] = True
+    return messages
+
+
+class ArchiveError(ValueError):
+    """Archiwum nie da się czytać dalej (zły nagłówek, uszkodzony gzip)."""
+
+
+def select_conversations(db, tags=()):
+    """ID konwersacji do eksportu – wszystkie albo mające wszystkie `tags`."""
+    entries = db.list_conversations()
+    if tags:
+        entries = [e for e in entries if set(tags) <= set(e.get("tags") or [])]
+    return sorted(e["id"] for e in entries)
+
+
+def _line(record):
+    return codec.dumps_line(record)
+
+
+def export_archive(db, fileobj, conversation_ids, progress=None):
+    """Zapisuje konwersacje do archiwum w binarnym `fileobj`; zwraca statystyki.
+
+    `progress(done, total)` jest wołane po każdej konwersacji.
+    """
+    conversation_ids = list(conversation_ids)
+    stats = {"conversations": 0, "messages": 0}
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=ARCHIVE_COMPRESSLEVEL) as gz:
+        gz.write(_line({
+            "type": "header",
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "conversations": len(conversation_ids),
+        }))
+        for conversation_id in conversation_ids:
+            conversation = db.load_conversation(conversation_id)
+            messages = conversation.pop("messages")
+            gz.write(_line({"type": "conversation", **conversation, "message_count": len(messages)}))
+            gz.writelines(_line({"type": "message", "data": m}) for m in messages)
+
+            stats["conversations"] += 1
+            stats["messages"] += len(messages)
+            if progress:
+                progress(stats["conversations"], len(conversation_ids))
+    return stats
+
+
+def export_archive_file(db, path, conversation_ids, progress=None):
+    with open(path, "wb") as f:
+        return export_archive(db, f, conversation_ids, progress)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_usage(usage):
+    """Zwraca opis błędu zużycia tokenów (jak z API) albo None."""
+    if not isinstance(usage, dict):
+        return "usage nie jest obiektem"
+    for key in ("prompt_tokens", "completion_tokens"):
+        if not _is_int(usage.get(key)):
+            return f"usage bez liczby {key}"
+    if not all(_is_int(v) for v in usage.values()):
+        return "usage zawiera nieliczbowe wartości"
+    return None
+
+
+def validate_summary(summary, message_count):
+    """Zwraca opis błędu podsumowania historii (zob. summary.py) albo None."""
+    if not isinstance(summary, dict):
+        return "podsumowanie nie jest obiektem"
+    if not isinstance(summary.get("text"), str):
+        return "podsumowanie bez tekstu"
+    for key in ("covered", "covered_tokens", "tokens"):
+        if not _is_int(summary.get(key)) or summary[key] < 0:
+            return f"podsumowanie bez liczby {key}"
+    if summary["covered"] > message_count:
+        return "podsumowanie obejmuje więcej wiadomości, niż ma konwersacja"
+    if not isinstance(summary.get("model", ""), str):
+        return "model podsumowania nie jest tekstem"
+    if summary.get("usage"):
+        return validate_usage(summary["usage"])
+    return None
+
+
+def validate_conversation(record):
+    """Zwraca opis błędu rekordu konwersacji albo None."""
+    if not isinstance(record.get("id"), int):
+        return "brak liczbowego id"
+    if not isinstance(record.get("name"), str):
+        return "brak nazwy"
+    if not isinstance(record.get("chatbot_personality", ""), str):
+        return "osobowość nie jest tekstem"
+    tags = record.get("tags", [])
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        return "tagi nie są listą tekstów"
+    if not isinstance(record.get("message_count"), int):
+        return "brak message_count"
+    if record.get("summary") is not None:
+        return validate_summary(record["summary"], record["message_count"])
+    return None
+
+
+def validate_message(message):
+    if not isinstance(message, dict):
+        return "wiadomość nie jest obiektem"
+    if message.get("role") not in MESSAGE_ROLES:
+        return f"nieznana rola {message.get('role')!r}"
+    if not isinstance(message.get("content"), str):
+        return "treść nie jest tekstem"
+    if not isinstance(message.get("model", ""), str):
+        return "model nie jest tekstem"
+    if not isinstance(message.get("created_at", ""), str):
+        return "created_at nie jest tekstem"
+    if message.get("usage") and (error := validate_usage(message["usage"])):
+        return error
+    timing = message.get("timing")
+    if timing is not None and not (isinstance(timing, dict) and all(
+            v is None or _is_number(v) for v in timing.values())):
+        return "timing nie jest obiektem z liczbami"
+    return None
+
+
+def _prepare(record, messages, conversation_id, name_suffix):
+    conversation = {k: v for k, v in record.items() if k not in ("type", "message_count", "totals")}
+    conversation["id"] = conversation_id
+    conversation["name"] = f"{conversation['name']}{name_suffix}"
+    conversation.setdefault("chatbot_personality", "")
+    conversation.setdefault("tags", [])
+    conversation["messages"] = mark_imported(messages)
+    # sumy z pliku mogą nie pasować do wiadomości – liczymy je sami
+    conversation["totals"] = costs.conversation_totals(messages, conversation.get("summary"))
+    return conversation
+
+
+def _discard(db, conversation_id):
+    # sprzątanie po nieudanym zapisie – konwersacja mogła trafić do magazynu tylko częściowo
+    try:
+        db.delete_conversation(conversation_id)
+    except Exception:
+        pass
+
+
+class _Importer:
+    def __init__(self, db, expected, id_batch, name_suffix):
+        self.db = db
+        self.expected = expected
+        self.id_batch = id_batch
+        self.name_suffix = name_suffix
+        self.ids = iter(())
+        self.stats = {"conversations": 0, "messages": 0, "skipped": 0, "errors": [], "ids": []}
+        self.pending = None
+        self.pending_messages = []
+        self.pending_error = None
+
+    def error(self, line_no, message):
+        if len(self.stats["errors"]) < MAX_REPORTED_ERRORS:
+            self.stats["errors"].append(f"linia {line_no}: {message}")
+
+    def next_id(self):
+        try:
+            return next(self.ids)
+        except StopIteration:
+            # partia ID na resztę archiwum (według nagłówka), żeby nie zostawiać dziur
+            remaining = (self.expected or 0) - self.stats["conversations"] - self.stats["skipped"]
+            self.ids = iter(self.db.allocate_ids(max(min(self.id_batch, remaining), 1)))
+            return next(self.ids)
+
+    def start(self, line_no, record):
+        self.finish()
+        self.pending = record
+        self.pending_line = line_no
+        self.pending_messages = []
+        self.pending_error = validate_conversation(record)
+
+    def add_message(self, line_no, data):
+        if self.pending is None:
+            self.error(line_no, "wiadomość przed pierwszą konwersacją")
+            return
+        if self.pending_error:
+            return
+        message_error = validate_message(data)
+        if message_error:
+            self.pending_error = f"{message_error} (linia {line_no})"
+            return
+        self.pending_messages.append(data)
+
+    def finish(self):
+        if self.pending is None:
+            return
+        record, messages = self.pending, self.pending_messages
+        self.pending, self.pending_messages = None, []
+
+        error = self.pending_error
+        if error is None and len(messages) != record["message_count"]:
+            error = f"{len(messages)} wiadomości zamiast {record['message_count']}"
+        if error:
+            self.stats["skipped"] += 1
+            self.error(self.pending_line, f"pominięto konwersację {record.get('id')!r}: {error}")
+            return
+
+        conversation = _prepare(record, messages, self.next_id(), self.name_suffix)
+        try:
+            self.db.save_conversation(conversation)
+        except Exception as e:
+            # jeden zły rekord nie przerywa importu – poprzednie konwersacje już są zapisane
+            self.stats["skipped"] += 1
+            self.error(self.pending_line, f"pominięto konwersację {record.get('id')!r}: błąd zapisu ({e!r})")
+            _discard(self.db, conversation["id"])
+            return
+
+        self.stats["conversations"] += 1
+        self.stats["messages"] += len(messages)
+        self.stats["ids"].append(conversation["id"])
+
+
+def import_archive(db, fileobj, total_bytes=None, progress=None, id_batch=IMPORT_ID_BATCH,
+                   name_suffix=" (import)"):
+    """Importuje archiwum z binarnego `fileobj` (plik albo bufor uploadu).
+
+    `progress(read_bytes, total_bytes, stats)` jest wołane po każdej
+    konwersacji. Zwraca statystyki: conversations, messages, skipped,
+    errors (lista opisów), ids (nowe ID) i complete (False, gdy archiwum
+    było ucięte – zaimportowane są wtedy tylko kompletne konwersacje).
+    """
+    reader = io.TextIOWrapper(gzip.GzipFile(fileobj=fileobj, mode="rb"), encoding="utf-8")
+    importer = None
+    line_no = 0
+    try:
+        for line_no, line in enumerate(reader, 1):
+            if not line.strip():
+                continue
+            try:
+                record = codec.loads(line)
+            except ValueError:
+                record = None
+
+            if importer is None:
+                if not (isinstance(record, dict) and record.get("type") == "header"
+                        and record.get("format") == ARCHIVE_FORMAT):
+                    raise ArchiveError("to nie jest archiwum konwersacji (brak nagłówka)")
+                if record.get("version") != ARCHIVE_VERSION:
+                    raise ArchiveError(f"nieobsługiwana wersja archiwum: {record.get('version')}")
+                importer = _Importer(db, record.get("conversations"), id_batch, name_suffix)
+                continue
+
+            if not isinstance(record, dict):
+                importer.error(line_no, "niepoprawny JSON")
+                if importer.pending is not None:
+                    importer.pending_error = importer.pending_error or f"niepoprawny JSON (linia {line_no})"
+            elif record.get("type") == "conversation":
+                importer.start(line_no, record)
+                if progress:
+                    progress(fileobj.tell(), total_bytes, importer.stats)
+            elif record.get("type") == "message":
+                importer.add_message(line_no, record.get("data"))
+            else:
+                importer.error(line_no, f"nieznany typ rekordu {record.get('type')!r}")
+    except (EOFError, OSError, UnicodeDecodeError) as e:
+        if importer is None:
+            raise ArchiveError(f"nie da się odczytać archiwum: {e}") from e
+        # ucięte/uszkodzone archiwum – zostają tylko kompletne konwersacje
+        if importer.pending is not None:
+            importer.stats["skipped"] += 1
+            importer.pending = None
+        importer.error(line_no, f"archiwum jest ucięte lub uszkodzone ({e})")
+        importer.stats["complete"] = False
+
+    if importer is None:
+        raise ArchiveError("puste archiwum")
+    importer.finish()
+    importer.stats.setdefault("complete", True)
+    if progress:
+        progress(fileobj.tell(), total_bytes, importer.stats)
+    return importer.stats
+
+
+def import_legacy_json(db, fileobj, name_suffix=" (import)"):
+    """Import pojedynczej konwersacji w starym formacie (cały plik JSON)."""
+    try:
+        conversation = codec.loads(fileobj.read())
+    except ValueError as e:
+        raise ArchiveError(f"plik nie jest poprawnym JSON-em: {e}") from e
+    if not isinstance(conversation, dict):
+        raise ArchiveError("plik nie zawiera konwersacji")
+    messages = conversation.get("messages", [])
+    # ID i tak nadajemy nowe – stary plik nie musi go mieć
+    error = validate_conversation({**conversation, "id": 0, "message_count": len(messages)})
+    error = error or next((e for e in map(validate_message, messages) if e), None)
+    if error:
+        raise ArchiveError(f"niepoprawna konwersacja: {error}")
+
+    conversation = _prepare(conversation, messages, db.allocate_id(), name_suffix)
+    try:
+        db.save_conversation(conversation)
+    except Exception as e:
+        _discard(db, conversation["id"])
+        raise ArchiveError(f"nie udało się zapisać konwersacji: {e!r}") from e
+    return {
+        "conversations": 1,
+        "messages": len(messages),
+        "skipped": 0,
+        "errors": [],
+        "ids": [conversation["id"]],
+        "complete": True,
+    }
+
+
+def import_file(db, fileobj, total_bytes=None, progress=None):
+    """Rozpoznaje format po pierwszych bajtach: archiwum gzip albo stary JSON."""
+    start = fileobj.tell()
+    magic = fileobj.read(2)
+    fileobj.seek(start)
+    if magic == GZIP_MAGIC:
+        return import_archive(db, fileobj, total_bytes, progress)
+    return import_legacy_json(db, fileobj)
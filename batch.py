@@ -0,0 +1,196 @@
+"""Tryb wsadowy: zestaw pytań przez wybraną osobowość, bez Streamlit.
+
+Wejście to plik JSONL, jeden element na linię:
+
+    {"id": "runa-dnia", "prompt": "Wylosuj runę dnia i zinterpretuj ją."}
+    {"id": "rozmowa-1", "turns": ["Czym jest futhark?", "A który ród run jest najstarszy?"]}
+
+`turns` to scenariusz wieloturowy – kolejne pytania idą z historią
+poprzednich odpowiedzi. Element może nadpisać `personality` i `model`.
+Kontekst budowany jest tak samo jak w aplikacji (chatbot.build_messages),
+a odpowiedzi przechodzą przez generation.generate – z limiterem klucza
+API (ratelimit.py), ponawianiem i modelem awaryjnym (resilience.py).
+
+Wyniki trafiają do pliku JSONL (jedna linia na element: odpowiedzi,
+usage, koszt, czasy) dopisywanego na bieżąco, więc przerwany przebieg
+wznawia się, pomijając elementy już zapisane ze statusem "ok". Z opcją
+`save` każdy element zapisywany jest też jako zwykła konwersacja w db/.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chatbot
+import costs
+import generation
+import tokens
+from config import DEFAULT_PERSONALITY, MODEL
+
+
+class BatchError(ValueError):
+    """Niepoprawny plik wejściowy."""
+
+
+def load_items(path):
+    """Elementy z pliku JSONL jako listy pytań; brakujące `id` to numer linii."""
+    items = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise BatchError(f"linia {line_no}: niepoprawny JSON ({e})") from e
+            if isinstance(record, str):
+                record = {"prompt": record}
+            turns = record.get("turns") or ([record["prompt"]] if record.get("prompt") else None)
+            if not turns or not all(isinstance(t, str) and t.strip() for t in turns):
+                raise BatchError(f"linia {line_no}: brak pola prompt albo turns")
+            item_id = str(record.get("id", line_no))
+            if item_id in seen:
+                raise BatchError(f"linia {line_no}: powtórzone id {item_id!r}")
+            seen.add(item_id)
+            items.append({**record, "id": item_id, "turns": turns})
+    return items
+
+
+def completed_ids(output_path):
+    """ID elementów zakończonych powodzeniem w poprzednich przebiegach."""
+    done = set()
+    try:
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # ucięta ostatnia linia po przerwaniu
+                    continue
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def run_item(client, item, personality, model, session, cancel_event=None):
+    """Przepuszcza wszystkie tury elementu; zwraca (rekord wyniku, wiadomości rozmowy)."""
+    personality = item.get("personality", personality)
+    model = item.get("model", model)
+    memory = []
+    turns = []
+    started = time.perf_counter()
+    record = {"id": item["id"], "model": model, "status": "ok", "turns": turns}
+
+    for prompt in item["turns"]:
+        if cancel_event is not None and cancel_event.is_set():
+            record.update(status="cancelled")
+            break
+        user_message = {"role": "user", "content": prompt}
+        tokens.message_tokens(user_message, model)
+        memory.append(user_message)
+        messages = chatbot.build_messages(personality, prompt, memory, model)
+
+        job = generation.generate(client, item["id"], model, messages, session=session, cancel_event=cancel_event)
+        if job.cancelled:
+            record.update(status="cancelled")
+            break
+        if job.message is None or job.error is not None:
+            record.update(status="error", error=str(job.error or "pusta odpowiedź"))
+            break
+        memory.append(job.message)
+        turns.append({
+            "prompt": prompt,
+            "reply": job.message["content"],
+            "model": job.message["model"],
+            "usage": job.message["usage"],
+            "cost_usd": costs.message_cost(job.message, model),
+            "ttft_s": job.message["timing"].get("ttft_s"),
+            "total_s": job.message["timing"].get("total_s"),
+            "attempts": job.message.get("attempts", 1),
+        })
+
+    totals = costs.compute_totals(memory, model)
+    record.update({
+        "prompt_tokens": totals["prompt_tokens"],
+        "completion_tokens": totals["completion_tokens"],
+        "cost_usd": totals["cost_usd"],
+        "latency_s": time.perf_counter() - started,
+    })
+    return record, memory
+
+
+def save_conversation(db, item, messages, personality, run_name):
+    conversation_id = db.allocate_id()
+    db.save_conversation({
+        "id": conversation_id,
+        "name": f"{run_name}: {item['id']}",
+        "chatbot_personality": item.get("personality", personality),
+        "messages": messages,
+        "tags": ["batch", run_name],
+        "totals": costs.compute_totals(messages),
+    })
+    return conversation_id
+
+
+def run_batch(client, items, output_path, personality=DEFAULT_PERSONALITY, model=MODEL, concurrency=8,
+              db=None, run_name="batch", progress=None):
+    """Przetwarza elementy (pomijając już zrobione) z `concurrency` naraz.
+
+    Każdy element ma w limiterze własną sesję, więc kolejka rozdziela limit
+    sprawiedliwie, a `concurrency` wystarczy ustawić tak, żeby limit był
+    w pełni wykorzystany. `progress(record, done, total)` jest wołane po
+    każdym elemencie. Zwraca podsumowanie przebiegu.
+    """
+    done_ids = completed_ids(output_path)
+    todo = [item for item in items if item["id"] not in done_ids]
+    summary = {
+        "items": len(items),
+        "skipped": len(items) - len(todo),
+        "ok": 0,
+        "errors": 0,
+        "cost_usd": 0.0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "latencies": [],
+    }
+    write_lock = threading.Lock()
+    cancel_event = threading.Event()
+    started = time.perf_counter()
+
+    def process(item):
+        record, messages = run_item(client, item, personality, model, f"batch:{item['id']}", cancel_event)
+        if record["status"] == "cancelled":
+            return record
+        if db is not None and record["status"] == "ok":
+            record["conversation_id"] = save_conversation(db, item, messages, personality, run_name)
+        with write_lock, open(output_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    futures = [pool.submit(process, item) for item in todo]
+    try:
+        for finished, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            if record["status"] == "ok":
+                summary["ok"] += 1
+                summary["latencies"].append(record["latency_s"])
+            elif record["status"] == "error":
+                summary["errors"] += 1
+            summary["cost_usd"] += record["cost_usd"]
+            summary["prompt_tokens"] += record["prompt_tokens"]
+            summary["completion_tokens"] += record["completion_tokens"]
+            if progress:
+                progress(record, finished, len(todo))
+    except KeyboardInterrupt:
+        # zapisane elementy zostają w pliku – kolejne uruchomienie je pominie; zdarzenie przerywa
+        # też zapytania w toku i czekające w limiterze, więc shutdown nie czeka na ich koniec
+        cancel_event.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
+    summary["elapsed_s"] = time.perf_counter() - started
+    return summary
@@ -0,0 +1,132 @@
+"""Statystyki kosztów: zapytania do sum z analytics.py kontra pełny skan.
+
+Tworzy magazyn z N konwersacjami (odpowiedzi rozłożone na --days dni,
+kilka modeli i tagów) i mierzy:
+
+- scan_ms         – koszt per dzień liczony po wczytaniu wszystkich konwersacji
+                    (jedyna droga bez analytics.py),
+- query_ms        – summary i breakdown po dniu, modelu, tagu i konwersacji z sum,
+- append_ms       – zapis jednej wymiany (append_messages) bez statystyk i z nimi,
+- rebuild_ms      – przeliczenie statystyk od zera (manage.py rebuild-analytics).
+
+    python benchmarks/bench_analytics.py --conversations 1000 --messages 40 --backend sqlite
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import analytics  # noqa: E402
+import costs  # noqa: E402
+import storage  # noqa: E402
+
+MODELS = ("gpt-4o-mini", "gpt-4o")
+TAGS = ("runy", "python", "praca", "dom")
+
+
+def make_storage(backend, path, with_analytics):
+    path = Path(path)
+    analytics_path = path / "analytics.sqlite3" if with_analytics else None
+    if backend == "sqlite":
+        return storage.SqliteStorage(path / "chatapp.sqlite3", analytics_path=analytics_path)
+    return storage.JsonStorage(path, analytics_path=analytics_path)
+
+
+def make_exchange(rng, days):
+    day = date.today() - timedelta(days=rng.randrange(days))
+    return [
+        {"role": "user", "content": "pytanie " * rng.randint(5, 40)},
+        {
+            "role": "assistant",
+            "content": "odpowiedź " * rng.randint(20, 200),
+            "model": rng.choice(MODELS),
+            "usage": {"prompt_tokens": rng.randint(200, 4000), "completion_tokens": rng.randint(50, 800)},
+            "timing": {"ttft_s": rng.uniform(0.2, 1.0), "total_s": rng.uniform(1.0, 20.0)},
+            "created_at": f"{day.isoformat()}T12:00:00",
+        },
+    ]
+
+
+def timed_ms(fn, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def full_scan(db):
+    per_day = defaultdict(float)
+    for conversation_id in db.conversation_ids():
+        for message in db.load_conversation(conversation_id)["messages"]:
+            if message.get("usage"):
+                per_day[message["created_at"][:10]] += costs.message_cost(message)
+    return per_day
+
+
+def fill(db, rng, args):
+    for conversation_id in db.allocate_ids(args.conversations):
+        messages = [m for _ in range(args.messages // 2) for m in make_exchange(rng, args.days)]
+        db.save_conversation({
+            "id": conversation_id,
+            "name": f"Rozmowa {conversation_id}",
+            "chatbot_personality": "Jesteś ekspertem w Pythonie.",
+            "tags": rng.sample(TAGS, rng.randint(1, 2)),
+            "messages": messages,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--conversations", type=int, default=1_000)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {"config": vars(args)}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_storage(args.backend, tmp, with_analytics=True)
+        fill(db, rng, args)
+        store = db.analytics
+        since, _ = analytics.period(30)
+
+        scanned = full_scan(db)
+        summed = {row["key"]: row["cost_usd"] for row in store.breakdown("day")}
+        assert all(abs(scanned[day] - summed[day]) < 1e-9 for day in scanned), "sumy różnią się od skanu"
+
+        results["scan_ms"] = timed_ms(lambda: full_scan(db))
+        results["query_ms"] = {
+            "summary": timed_ms(lambda: store.summary(since), args.repeat),
+            **{f"by_{by}": timed_ms(lambda: store.breakdown(by, since), args.repeat)
+               for by in analytics.DIMENSIONS},
+            "by_conversation_top20": timed_ms(lambda: store.breakdown("conversation", limit=20), args.repeat),
+        }
+        results["usage_rows"] = store._conn().execute("SELECT COUNT(*) FROM usage").fetchone()[0]
+        results["rebuild_ms"] = timed_ms(db.rebuild_analytics)
+
+        conversation_id = db.conversation_ids()[0]
+        plain = make_storage(args.backend, tmp, with_analytics=False)
+        results["append_ms"] = {
+            "without_analytics": timed_ms(
+                lambda: plain.append_messages(conversation_id, make_exchange(rng, args.days)), args.repeat),
+            "with_analytics": timed_ms(
+                lambda: db.append_messages(conversation_id, make_exchange(rng, args.days)), args.repeat),
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Przepustowość eksportu i importu archiwum na dużej syntetycznej bazie.
+
+Tworzy w katalogu tymczasowym bazę z N konwersacjami po M wiadomości,
+eksportuje ją do .ndjson.gz, importuje do pustej bazy i sprawdza, że
+wszystko wróciło. Z --memory mierzy też szczyt pamięci (tracemalloc,
+wolniej) – przy strumieniowaniu nie rośnie on z liczbą konwersacji.
+
+    python benchmarks/bench_archive.py --conversations 2000 --messages 50
+    python benchmarks/bench_archive.py --backend sqlite --memory
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import archive  # noqa: E402
+import storage  # noqa: E402
+
+WORDS = "runa dnia losowanie układ python funkcja klasa moduł plik json odpowiedź pytanie rozmowa kod".split()
+
+
+def make_storage(backend, path):
+    if backend == "sqlite":
+        return storage.SqliteStorage(Path(path) / "chatapp.sqlite3")
+    return storage.JsonStorage(path)
+
+
+def populate(db, conversations, messages, rng):
+    ids = db.allocate_ids(conversations)
+    for conversation_id in ids:
+        db.save_conversation({
+            "id": conversation_id,
+            "name": f"Rozmowa {conversation_id}",
+            "chatbot_personality": "Jesteś pomocnym asystentem.",
+            "tags": rng.sample(["runy", "python", "praca"], rng.randint(0, 2)),
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": " ".join(rng.choices(WORDS, k=rng.randint(20, 200))),
+                }
+                for i in range(messages)
+            ],
+        })
+
+
+def measure(fn, memory):
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--conversations", type=int, default=1_000)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--memory", action="store_true", help="mierz szczyt pamięci (tracemalloc)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        source = make_storage(args.backend, Path(path) / "source")
+        populate(source, args.conversations, args.messages, random.Random(args.seed))
+        archive_path = Path(path) / "backup.ndjson.gz"
+
+        ids = archive.select_conversations(source)
+        export_stats, export_s, export_peak = measure(
+            lambda: archive.export_archive_file(source, archive_path, ids), args.memory
+        )
+        archive_mb = archive_path.stat().st_size / 1e6
+
+        target = make_storage(args.backend, Path(path) / "target")
+
+        def run_import():
+            with open(archive_path, "rb") as f:
+                return archive.import_archive(target, f, archive_path.stat().st_size)
+
+        import_stats, import_s, import_peak = measure(run_import, args.memory)
+
+        imported = sum(len(target.load_conversation(i)["messages"]) for i in import_stats["ids"])
+        results = {
+            "backend": args.backend,
+            "conversations": args.conversations,
+            "messages": export_stats["messages"],
+            "archive_mb": archive_mb,
+            "export_s": export_s,
+            "export_conversations_per_s": export_stats["conversations"] / export_s,
+            "export_messages_per_s": export_stats["messages"] / export_s,
+            "import_s": import_s,
+            "import_conversations_per_s": import_stats["conversations"] / import_s,
+            "import_messages_per_s": import_stats["messages"] / import_s,
+            "export_peak_mb": export_peak,
+            "import_peak_mb": import_peak,
+            "round_trip_ok": import_stats["conversations"] == len(ids) and imported == export_stats["messages"],
+            "import_errors": import_stats["errors"][:10],
+        }
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        if not results["round_trip_ok"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Kodeki plików konwersacji: czas zapisu, czas odczytu i rozmiar na dysku.
+
+Generuje konwersacje podobne do prawdziwych (odpowiedzi z blokami kodu,
+usage, timing) i porównuje kombinacje JSON (json / orjson) × kompresja
+(brak / gzip / zstd) – dostępne w tym środowisku:
+
+- codec – samo kodowanie całej konwersacji (dumps + compress) i odczyt
+  (decompress + loads),
+- storage – JsonStorage w trybie logu: zapis konwersacji, dopisanie pary
+  wiadomości (jedna ramka) i wczytanie całości, plus rozmiar katalogu.
+
+    python benchmarks/bench_codec.py --conversations 50 --messages 200
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import codec  # noqa: E402
+import storage  # noqa: E402
+
+WORDS = (
+    "runa dnia losowanie układ krzyż celtycki interpretacja python funkcja klasa moduł plik json "
+    "słownik lista kod test błąd wyjątek dane opis model odpowiedź pytanie rozmowa aplikacja żółć"
+).split()
+CODE = '''```python
+def losuj_rune(runy, seed=None):
+    """Zwraca losową runę wraz z interpretacją."""
+    rng = random.Random(seed)
+    runa = rng.choice(runy)
+    return {"nazwa": runa["nazwa"], "opis": runa["opis"], "odwrócona": rng.random() < 0.5}
+```'''
+
+
+def make_message(rng, role):
+    if role == "user":
+        return {"role": "user", "content": " ".join(rng.choices(WORDS, k=rng.randint(5, 60)))}
+    parts = [" ".join(rng.choices(WORDS, k=rng.randint(30, 150)))]
+    parts += [CODE] * rng.randint(0, 3)
+    return {
+        "role": "assistant",
+        "content": "\n\n".join(parts),
+        "model": "gpt-4o-mini",
+        "usage": {"prompt_tokens": rng.randint(500, 9000), "completion_tokens": rng.randint(50, 900),
+                  "total_tokens": 0},
+        "timing": {"ttft_s": rng.random(), "total_s": 2 + rng.random() * 10},
+    }
+
+
+def make_conversation(rng, conversation_id, messages):
+    return {
+        "id": conversation_id,
+        "name": f"Rozmowa {conversation_id}",
+        "chatbot_personality": "Jesteś ekspertem w Pythonie.",
+        "tags": ["runy"],
+        "messages": [make_message(rng, "user" if i % 2 == 0 else "assistant") for i in range(messages)],
+    }
+
+
+def variants():
+    backends = ["json"] + (["orjson"] if codec.orjson is not None else [])
+    methods = [None, "gzip"] + (["zstd"] if codec.zstandard is not None else [])
+    return [(backend, method) for backend in backends for method in methods]
+
+
+def use(backend, method):
+    codec.USE_ORJSON = backend == "orjson"
+    codec.COMPRESSION = method
+
+
+def timed_ms(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_codec(conversations, repeat):
+    dumped = {}
+    results = {}
+    for backend, method in variants():
+        use(backend, method)
+        write = [timed_ms(lambda: [dumped.__setitem__(c["id"], codec.encode(codec.dumps(c))) for c in conversations])
+                 for _ in range(repeat)]
+        read = [timed_ms(lambda: [codec.loads(codec.decompress(d)) for d in dumped.values()]) for _ in range(repeat)]
+        results[f"{backend}/{method or 'brak'}"] = {
+            "write_ms": statistics.median(write),
+            "read_ms": statistics.median(read),
+            "bytes": sum(len(d) for d in dumped.values()),
+        }
+    return results
+
+
+def dir_size(path):
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def bench_storage(conversations, rng):
+    results = {}
+    for backend, method in variants():
+        use(backend, method)
+        with tempfile.TemporaryDirectory() as tmp:
+            db = storage.JsonStorage(tmp)
+            ids = list(db.allocate_ids(len(conversations)))
+            save = timed_ms(lambda: [db.save_conversation({**c, "id": i}) for c, i in zip(conversations, ids)])
+            pair = [make_message(rng, "user"), make_message(rng, "assistant")]
+            append = timed_ms(lambda: [db.append_messages(i, pair) for i in ids])
+            load = timed_ms(lambda: [db.load_conversation(i) for i in ids])
+            size = dir_size(Path(tmp) / "conversations")
+            loaded = db.load_conversation(ids[0])
+            assert loaded["messages"] == conversations[0]["messages"] + pair
+        results[f"{backend}/{method or 'brak'}"] = {
+            "save_ms": save,
+            "append_ms": append,
+            "load_ms": load,
+            "bytes_on_disk": size,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conversations = [make_conversation(rng, i, args.messages) for i in range(1, args.conversations + 1)]
+    default = (codec.USE_ORJSON, codec.COMPRESSION)
+    try:
+        results = {
+            "config": vars(args),
+            "codec": bench_codec(conversations, args.repeat),
+            "storage": bench_storage(conversations, rng),
+        }
+    finally:
+        codec.USE_ORJSON, codec.COMPRESSION = default
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
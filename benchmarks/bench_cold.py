@@ -0,0 +1,110 @@
+"""Archiwum konwersacji: koszt listy i przydziału ID przed i po archiwizacji.
+
+Tworzy magazyn JSON z N konwersacjami, mierzy operacje zależne od liczby
+konwersacji (lista w sidebarze, przydział ID, odbudowa indeksu listy ze
+skanu katalogu), archiwizuje --cold-ratio z nich i mierzy to samo jeszcze
+raz. Dodatkowo: czas archiwizacji, przywrócenia jednej konwersacji,
+usunięcia i kompaktacji archiwum oraz rozmiar danych na dysku.
+
+    python benchmarks/bench_cold.py --conversations 2000 --messages 40 --cold-ratio 0.9
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import conversation_index  # noqa: E402
+import storage  # noqa: E402
+
+WORDS = (
+    "runa dnia losowanie układ krzyż celtycki interpretacja python funkcja klasa moduł plik json "
+    "słownik lista kod test błąd wyjątek dane opis model odpowiedź pytanie rozmowa aplikacja"
+).split()
+
+
+def make_conversation(rng, conversation_id, messages):
+    return {
+        "id": conversation_id,
+        "name": f"Rozmowa {conversation_id}",
+        "chatbot_personality": "Jesteś ekspertem w Pythonie.",
+        "tags": ["runy"],
+        "messages": [
+            {"role": "user" if i % 2 == 0 else "assistant",
+             "content": " ".join(rng.choices(WORDS, k=rng.randint(10, 150)))}
+            for i in range(messages)
+        ],
+    }
+
+
+def timed_ms(fn, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def dir_size(path):
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def hot_path(db, repeat):
+    return {
+        "list_conversations_ms": timed_ms(db.list_conversations, repeat),
+        "allocate_id_ms": timed_ms(db.allocate_id, repeat),
+        "rebuild_index_ms": timed_ms(lambda: conversation_index.rebuild_index(db.db_path)),
+        "hot_conversations": len(db.list_conversations()),
+        "conversations_dir_bytes": dir_size(db.conversations_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=2_000)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--cold-ratio", type=float, default=0.9)
+    parser.add_argument("--compact-min-live", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = storage.JsonStorage(tmp)
+        ids = list(db.allocate_ids(args.conversations))
+        for conversation_id in ids:
+            db.save_conversation(make_conversation(rng, conversation_id, args.messages))
+        before = hot_path(db, args.repeat)
+
+        cold_ids = ids[:int(len(ids) * args.cold_ratio)]
+        archive_ms = timed_ms(lambda: [db.archive_conversation(i) for i in cold_ids])
+        after = hot_path(db, args.repeat)
+
+        sample = rng.sample(cold_ids, min(50, len(cold_ids)))
+        restore = [timed_ms(lambda: db.restore_conversation(i)) for i in sample]
+        delete = [timed_ms(lambda: db.delete_conversation(i)) for i in rng.sample(cold_ids, len(cold_ids) // 4)]
+        stats_before = db.cold.stats()
+        compact_ms = timed_ms(lambda: db.cold.compact(args.compact_min_live))
+        results = {
+            "config": vars(args),
+            "before_archiving": before,
+            "after_archiving": after,
+            "archive_ms_per_conversation": archive_ms / max(len(cold_ids), 1),
+            "restore_ms": statistics.median(restore),
+            "delete_ms": statistics.median(delete),
+            "compact_ms": compact_ms,
+            "cold_before_compaction": stats_before,
+            "cold_after_compaction": db.cold.stats(),
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Pokazuje ponowne użycie połączeń HTTP przez klienta z cache.
+
+Wysyła N zapytań do lokalnego serwera: raz tworząc klienta przy każdym
+zapytaniu (jak przy każdym rerunie przed zmianą), raz przez
+clients.get_openai_client. Serwer liczy otwarte połączenia TCP.
+
+    python benchmarks/bench_connections.py --requests 50
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+
+import clients  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Cześć!"}]
+
+
+def run(server, make_client, n):
+    before = server.connections
+    started = time.perf_counter()
+    for _ in range(n):
+        client = make_client()
+        client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": n,
+        "connections_opened": server.connections - before,
+        "avg_request_ms": elapsed / n * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    server = StubServer(first_token_delay=0.0).start()
+    try:
+        results = {
+            "new_client_per_request": run(
+                server, lambda: OpenAI(api_key="stub", base_url=server.base_url), args.requests
+            ),
+            "cached_client": run(
+                server, lambda: clients.get_openai_client("stub", base_url=server.base_url), args.requests
+            ),
+        }
+        print(json.dumps(results, indent=2))
+    finally:
+        clients.close_all()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Stabilność prefiksu promptu i trafienia w cache promptów przy długiej rozmowie.
+
+Prowadzi tę samą długą rozmowę z lokalnym serwerem testowym
+(stub_openai.py, z symulacją cache promptów) w obu trybach obcinania
+historii (chatbot.build_messages, CONTEXT_TRUNCATION):
+
+- sliding – najdłuższy mieszczący się sufiks historii,
+- blocks – obcinanie całymi blokami od początku.
+
+Tura jest "stabilna", gdy poprzednie zapytanie jest prefiksem bieżącego
+(bajt w bajt) – tylko wtedy API może wziąć je z cache. Skrypt kończy się
+błędem, gdy w trybie blocks stabilnych tur jest mniej niż --min-stable.
+
+    python benchmarks/bench_prompt_cache.py --turns 60 --budget 6000 --block-tokens 3000
+"""
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+
+import chatbot  # noqa: E402
+import costs  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+WORDS = (
+    "runa dnia losowanie układ krzyż celtycki interpretacja python funkcja klasa moduł plik json "
+    "słownik lista kod test błąd wyjątek dane opis model odpowiedź pytanie rozmowa aplikacja"
+).split()
+PERSONALITY = "Jesteś ekspertem w Pythonie i pomagasz w tworzeniu aplikacji o runach nordyckich. " * 20
+
+
+def run_mode(truncation, args):
+    rng = random.Random(args.seed)
+    server = StubServer(first_token_delay=0, chunk_delay=0, reply=" ".join(rng.choices(WORDS, k=150))).start()
+    client = OpenAI(base_url=server.base_url, api_key="stub", max_retries=0)
+    memory = []
+    previous = None
+    stable = 0
+    prompt_tokens = cached_tokens = cost = 0
+    context_sizes = []
+    try:
+        for turn in range(args.turns):
+            prompt = " ".join(rng.choices(WORDS, k=rng.randint(20, 200)))
+            memory.append({"role": "user", "content": prompt})
+            messages = chatbot.build_messages(
+                PERSONALITY, prompt, memory, args.model,
+                max_prompt_tokens=args.budget, truncation=truncation, block_tokens=args.block_tokens,
+            )
+            if previous is not None and messages[:len(previous)] == previous:
+                stable += 1
+            previous = messages
+            context_sizes.append(len(messages))
+
+            reply = {}
+            for _ in chatbot.stream_reply(client, args.model, messages, reply):
+                pass
+            reply["model"] = args.model
+            memory.append(reply)
+            prompt_tokens += reply["usage"]["prompt_tokens"]
+            cached_tokens += reply["usage"].get("cached_tokens", 0)
+            cost += costs.message_cost(reply)
+    finally:
+        client.close()
+        server.stop()
+    return {
+        "stable_turns": stable / max(args.turns - 1, 1),
+        "cached_token_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "cost_usd": cost,
+        "avg_context_messages": sum(context_sizes) / len(context_sizes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=60)
+    parser.add_argument("--budget", type=int, default=6_000, help="limit tokenów promptu (MAX_PROMPT_TOKENS)")
+    # domyślny CONTEXT_BLOCK_TOKENS jest dobrany do okna 128k – tu budżet jest mały
+    parser.add_argument("--block-tokens", type=int, default=3_000)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--min-stable", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {"config": vars(args), "modes": {mode: run_mode(mode, args) for mode in ("sliding", "blocks")}}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    stable = results["modes"]["blocks"]["stable_turns"]
+    if stable < args.min_stable:
+        print(f"BŁĄD: stabilny prefiks tylko w {stable:.0%} tur (oczekiwane >= {args.min_stable:.0%})",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
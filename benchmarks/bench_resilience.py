@@ -0,0 +1,141 @@
+"""Ogon opóźnień i odsetek udanych odpowiedzi przy awariach API.
+
+Uruchamia lokalny serwer testowy (stub_openai.py) wstrzykujący błędy
+i spóźnione odpowiedzi, po czym wysyła tę samą serię zapytań z różnymi
+politykami (resilience.RetryPolicy):
+
+- bez polityki – jedna próba, bez hedgingu i modelu awaryjnego,
+- ponawianie – limity czasu, backoff, model awaryjny,
+- ponawianie + hedging – dodatkowo zapytanie zapasowe po percentylu.
+
+    python benchmarks/bench_resilience.py --requests 200 --error-rate 0.1 --slow-rate 0.05
+    python benchmarks/bench_resilience.py --failing-model gpt-4o   # awaria modelu -> fallback
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+
+import resilience  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Wylosuj runę dnia."}]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def run_request(client, model, policy):
+    reply = {}
+    started = time.perf_counter()
+    try:
+        for _ in resilience.stream_reply(client, model, MESSAGES, reply, policy=policy):
+            pass
+    except Exception as e:
+        return {"ok": False, "total_s": time.perf_counter() - started, "error": type(e).__name__}
+    return {
+        "ok": True,
+        "ttft_s": reply["timing"]["ttft_s"],
+        "total_s": reply["timing"]["total_s"],
+        "attempts": reply["attempts"],
+        "hedged": reply["hedged"],
+        "model": reply["model"],
+    }
+
+
+def run_scenario(server, model, policy, args):
+    client = OpenAI(base_url=server.base_url, api_key="stub", max_retries=0)
+    # rozgrzewka – hedging potrzebuje historii czasów do pierwszego tokenu
+    for _ in range(args.warmup):
+        run_request(client, model, policy)
+    server.config.rng.seed(args.seed)
+    requests_before = len(server.requests)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: run_request(client, model, policy), range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r["ok"]]
+    ttft = [r["ttft_s"] for r in ok]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    models = {}
+    for r in ok:
+        models[r["model"]] = models.get(r["model"], 0) + 1
+    return {
+        "success_rate": len(ok) / len(results),
+        "ttft_p50_s": percentile(ttft, 0.50),
+        "ttft_p95_s": percentile(ttft, 0.95),
+        "ttft_p99_s": percentile(ttft, 0.99),
+        "ttft_mean_s": statistics.mean(ttft) if ttft else None,
+        "api_requests_per_reply": (len(server.requests) - requests_before) / len(results),
+        "hedged_wins": sum(1 for r in ok if r["hedged"]),
+        "models": models,
+        "errors": errors,
+        "wall_s": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-delay", type=float, default=3.0)
+    parser.add_argument("--failing-model", action="append", default=[])
+    parser.add_argument("--first-token-timeout", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubServer(
+        first_token_delay=args.first_token_delay,
+        chunk_delay=0.001,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+        failing_models=args.failing_model,
+        seed=args.seed,
+    ).start()
+
+    common = {"first_token_timeout": args.first_token_timeout, "backoff_base": 0.05, "backoff_max": 0.5}
+    policies = {
+        "bez polityki": resilience.RetryPolicy(
+            max_attempts=1, hedge=False, fallback_models={}, first_token_timeout=args.slow_delay * 2
+        ),
+        "ponawianie": resilience.RetryPolicy(hedge=False, **common),
+        "ponawianie + hedging": resilience.RetryPolicy(hedge=True, hedge_min_samples=10, **common),
+    }
+    try:
+        results = {
+            "config": vars(args),
+            "scenarios": {name: run_scenario(server, args.model, policy, args) for name, policy in policies.items()},
+        }
+    finally:
+        server.stop()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
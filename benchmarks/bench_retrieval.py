@@ -0,0 +1,147 @@
+"""Przywoływanie starszych wiadomości: budowa indeksu, zapytania, trafność.
+
+Dla rozmów o zadanej liczbie wiadomości (domyślnie 1000, 5000 i 10000)
+mierzy na retrieval.MessageIndex:
+
+- build_ms    – zbudowanie indeksu całej rozmowy od zera (pierwsze pytanie po starcie),
+- append_ms   – dołożenie jednej nowej wiadomości (sync po każdym zapisie),
+- query_ms    – zapytanie o wiadomości sprzed okna ostatnich wiadomości,
+- build_messages_ms – chatbot.build_messages z przywoływaniem i bez,
+- recall_at_k – jak często wiadomość z początku rozmowy, o którą pytamy
+                (unikalny identyfikator + opis), jest wśród top-k.
+
+    python benchmarks/bench_retrieval.py --sizes 1000,5000,10000 --queries 200
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import chatbot  # noqa: E402
+import retrieval  # noqa: E402
+
+WORDS = (
+    "runa runy dnia losowanie układ krzyż celtycki partnerski interpretacja intencja python funkcja "
+    "klasa moduł plik json słownik lista kod test błąd wyjątek dane opis źródło model odpowiedź "
+    "pytanie rozmowa aplikacja streamlit sidebar przycisk konwersacja tag koszt tokeny cache indeks"
+).split()
+TOPIC_WORDS = (
+    "walidacja schemat migracja kolejka wątek blokada serializacja kompresja szyfrowanie podpis "
+    "paginacja sortowanie filtr agregacja histogram percentyl limit ponowienie timeout strumień "
+    "szablon motyw ikona tłumaczenie kalendarz strefa waluta raport wykres eksport import"
+).split()
+PERSONALITY = "Jesteś ekspertem w Pythonie."
+MODEL = "gpt-4o-mini"
+
+
+def make_conversation(rng, size, topics):
+    """Losowa rozmowa; tematy (identyfikator + opis) padają w pierwszych 20% wiadomości."""
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant",
+         "content": " ".join(rng.choices(WORDS, k=rng.randint(10, 40 if i % 2 == 0 else 150)))}
+        for i in range(size)
+    ]
+    planted = {}
+    for topic in range(topics):
+        position = rng.randrange(1, size // 5, 2)
+        while position in planted.values():
+            position = rng.randrange(1, size // 5, 2)
+        identifier = f"przetworz_{topic}"
+        description = rng.sample(TOPIC_WORDS, 3)
+        messages[position]["content"] += (
+            f"\n\n```python\ndef {identifier}(dane):\n    ...\n```\nFunkcja {identifier} robi "
+            + " i ".join(description)
+        )
+        planted[(identifier, tuple(description))] = position
+    return messages, planted
+
+
+def timed_ms(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        "max": samples[-1],
+    }
+
+
+def bench_size(size, args, rng):
+    messages, planted = make_conversation(rng, size, args.queries)
+    # pytania dotyczą wiadomości sprzed okna ostatnich wiadomości
+    before = size - args.window
+
+    index = retrieval.MessageIndex()
+    _, build = timed_ms(lambda: index.sync(messages))
+
+    append = []
+    for _ in range(args.appends):
+        messages.append({"role": "user", "content": " ".join(rng.choices(WORDS, k=30))})
+        append.append(timed_ms(lambda: index.sync(messages))[1])
+
+    query = []
+    found = 0
+    for (identifier, description), position in planted.items():
+        question = f"Przypomnij, co robiła {identifier} – chodziło o {description[0]}?"
+        hits, elapsed = timed_ms(lambda: index.search(question, args.top_k, before=before))
+        query.append(elapsed)
+        found += position in [p for p, _ in hits]
+
+    budget = args.budget
+    plain = [timed_ms(lambda: chatbot.build_messages(
+        PERSONALITY, "Przypomnij funkcję przetworz_0", messages, MODEL, max_prompt_tokens=budget))[1]
+        for _ in range(args.repeat)]
+    recalled = [timed_ms(lambda: chatbot.build_messages(
+        PERSONALITY, "Przypomnij funkcję przetworz_0", messages, MODEL, max_prompt_tokens=budget,
+        retrieval_index=index, top_k=args.top_k))[1]
+        for _ in range(args.repeat)]
+
+    return {
+        "messages": len(messages),
+        "postings": index.postings,
+        "index_bytes": index.nbytes,
+        "build_ms": build,
+        "append_ms": percentiles(append),
+        "query_ms": percentiles(query),
+        "build_messages_ms": {
+            "without_retrieval": statistics.median(plain),
+            "with_retrieval": statistics.median(recalled),
+        },
+        "recall_at_k": found / len(planted),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,5000,10000")
+    parser.add_argument("--queries", type=int, default=100, help="pytań (tematów z początku rozmowy) na rozmowę")
+    parser.add_argument("--appends", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=6)
+    parser.add_argument("--window", type=int, default=100, help="ile ostatnich wiadomości jest w oknie")
+    parser.add_argument("--budget", type=int, default=16_000, help="limit tokenów promptu (MAX_PROMPT_TOKENS)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if retrieval.np is None:
+        sys.exit("Przywoływanie wymaga numpy (pip install numpy).")
+    rng = random.Random(args.seed)
+    results = {
+        "config": vars(args),
+        "sizes": {size: bench_size(int(size), args, rng) for size in args.sizes.split(",")},
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
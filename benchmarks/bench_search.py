@@ -0,0 +1,109 @@
+"""Czas zapytań wyszukiwarki na syntetycznym zbiorze konwersacji.
+
+Buduje indeks (search_index.SearchIndex) w katalogu tymczasowym z N
+losowych konwersacji, mierzy czas budowy, przyrostowego dopisania
+wiadomości i zapytań (słowa częste, rzadkie, kilka słów, tag).
+
+    python benchmarks/bench_search.py --conversations 20000 --messages 20
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import search_index  # noqa: E402
+
+WORDS = (
+    "runa runy runę runami dnia losowanie układ krzyż celtycki partnerski interpretacja intencja "
+    "python funkcja klasa moduł plik json słownik lista kod test błąd wyjątek dane opis źródło "
+    "model odpowiedź pytanie rozmowa rozmowy żółw żółwie kot pies dom praca projekt aplikacja "
+    "streamlit sidebar przycisk konwersacja konwersacje tag tagi koszt tokeny cache indeks"
+).split()
+RARE_WORDS = [f"unikat{i}" for i in range(200)]
+TAGS = ["runy", "python", "nlp", "praca", "dom", "pomysły", "błędy", "ui", "dane", "testy"]
+
+
+def make_conversation(rng, conversation_id, messages):
+    content = []
+    for _ in range(messages):
+        words = rng.choices(WORDS, k=rng.randint(10, 60))
+        if rng.random() < 0.01:
+            words.append(rng.choice(RARE_WORDS))
+        content.append(" ".join(words))
+    return {
+        "id": conversation_id,
+        "name": f"Rozmowa {conversation_id} " + " ".join(rng.choices(WORDS, k=2)),
+        "tags": rng.sample(TAGS, rng.randint(0, 3)),
+        "messages": [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": text}
+            for i, text in enumerate(content)
+        ],
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conversations", type=int, default=5_000)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as path:
+        index = search_index.SearchIndex(Path(path) / "search.sqlite3")
+
+        started = time.perf_counter()
+        index.rebuild(make_conversation(rng, i, args.messages) for i in range(1, args.conversations + 1))
+        build_s = time.perf_counter() - started
+
+        new_messages = make_conversation(rng, 1, 2)["messages"]
+        _, append_ms = timed(lambda: index.add_messages(1, args.messages, new_messages), args.repeat)
+        _, meta_ms = timed(lambda: index.update_meta(1, name="Zmieniona nazwa", tags=["runy", "ui"]), args.repeat)
+
+        queries = {
+            "częste słowo": ("rozmowa", ()),
+            "rzadkie słowo": ("unikat7", ()),
+            "dwa słowa": ("żółwie python", ()),
+            "słowo + tag": ("runy", ("python",)),
+            "tylko tag": ("", ("nlp",)),
+        }
+        results = {
+            "conversations": args.conversations,
+            "messages_per_conversation": args.messages,
+            "build_s": build_s,
+            "index_mb": (Path(path) / "search.sqlite3").stat().st_size / 1e6,
+            "append_2_messages_ms": statistics.median(append_ms),
+            "update_meta_ms": statistics.median(meta_ms),
+            "queries": {},
+        }
+        for label, (query, tags) in queries.items():
+            hits, samples = timed(lambda: index.search(query, tags=tags), args.repeat)
+            results["queries"][label] = {
+                "hits": len(hits),
+                "median_ms": statistics.median(samples),
+                "max_ms": max(samples),
+            }
+        _, facet_ms = timed(index.tag_facets, args.repeat)
+        results["tag_facets_ms"] = statistics.median(facet_ms)
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
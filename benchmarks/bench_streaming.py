@@ -0,0 +1,54 @@
+"""Porównuje czas do pierwszego tokenu z streamingiem i bez.
+
+    python benchmarks/bench_streaming.py --first-token-delay 0.3 --chunk-delay 0.02
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import OpenAI  # noqa: E402
+
+import chatbot  # noqa: E402
+from stub_openai import StubServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--first-token-delay", type=float, default=0.3)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = StubServer(first_token_delay=args.first_token_delay, chunk_delay=args.chunk_delay).start()
+    try:
+        client = OpenAI(base_url=server.base_url, api_key="stub")
+        messages = chatbot.build_messages("Jesteś pomocnym asystentem.", "Cześć!", [], "gpt-4o-mini")
+
+        results = {"blocking": [], "streaming": []}
+        for _ in range(args.runs):
+            reply = chatbot.complete(client, "gpt-4o-mini", messages)
+            results["blocking"].append(reply["timing"])
+
+            reply = {}
+            for _chunk in chatbot.stream_reply(client, "gpt-4o-mini", messages, reply):
+                pass
+            assert reply["usage"], "brak usage w ostatnim chunku streamu"
+            results["streaming"].append(reply["timing"])
+
+        summary = {
+            mode: {
+                "ttft_s": sum(t["ttft_s"] for t in timings) / len(timings),
+                "total_s": sum(t["total_s"] for t in timings) / len(timings),
+            }
+            for mode, timings in results.items()
+        }
+        print(json.dumps(summary, indent=2))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""Benchmark gorących ścieżek magazynu i kontekstu na syntetycznych bazach.
+
+Generuje bazy konwersacji o zadanym rozmiarze (presety niżej), mierzy
+operacje, które aplikacja wykonuje przy każdej interakcji, i wypisuje
+wyniki jako JSON – do porównania między commitami:
+
+    python benchmarks/harness.py --preset small,medium --output before.json
+    ... zmiany ...
+    python benchmarks/harness.py --preset small,medium --compare before.json
+
+Mierzone operacje (odpowiedniki funkcji z app.py, bez Streamlit):
+
+- list_conversations        – lista w sidebarze,
+- load_current_conversation – wskaźnik sesji + wczytanie największej konwersacji
+                              (przez cache konwersacji; _uncached – prosto z magazynu),
+- switch_conversation       – zmiana wskaźnika + wczytanie losowej konwersacji
+                              (_prefetched – jednej z 15 wczytanych wcześniej w tle),
+- save_current_conversation_messages – dopisanie pary wiadomości,
+- prepare_conversation_context / build_messages – kontekst największej rozmowy,
+- create_new_conversation   – nowe ID, zapis pustej konwersacji, wskaźnik,
+- import_conversation       – import archiwum z jedną konwersacją (100 wiadomości),
+- e2e_turn                  – pełna tura: zapis promptu, kontekst, odpowiedź ze
+                              stub serwera (benchmarks/stub_openai.py) w tle, zapis.
+
+Wygenerowane bazy są trzymane w --data-dir i używane ponownie; każdy
+przebieg pracuje na ich kopii, więc wyniki są porównywalne.
+"""
+import argparse
+import io
+import json
+import math
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import archive  # noqa: E402
+import chatbot  # noqa: E402
+import conversation_cache  # noqa: E402
+import storage  # noqa: E402
+import tokens  # noqa: E402
+from config import MODEL, SEARCH_INDEX  # noqa: E402
+
+# liczba konwersacji, zakres typowej długości, długość największej konwersacji
+PRESETS = {
+    "tiny": (10, (10, 50), 200),
+    "small": (10, (10, 100), 1_000),
+    "medium": (1_000, (10, 200), 5_000),
+    "large": (50_000, (10, 100), 5_000),
+}
+WORDS = (
+    "runa dnia losowanie układ krzyż celtycki interpretacja python funkcja klasa moduł plik json "
+    "słownik lista kod test błąd wyjątek dane opis model odpowiedź pytanie rozmowa aplikacja"
+).split()
+PERSONALITY = "Jesteś ekspertem w Pythonie i pomagasz w tworzeniu aplikacji."
+NAMESPACE = "bench"
+
+
+def make_storage(backend, path):
+    path = Path(path)
+    search_path = path / "search.sqlite3" if SEARCH_INDEX else None
+    if backend == "sqlite":
+        return storage.SqliteStorage(path / "chatapp.sqlite3", search_path=search_path)
+    return storage.JsonStorage(path, search_path=search_path)
+
+
+def make_message(rng, role):
+    message = {"role": role, "content": " ".join(rng.choices(WORDS, k=rng.randint(5, 120)))}
+    if role == "assistant":
+        message["model"] = MODEL
+        message["usage"] = {"prompt_tokens": 500, "completion_tokens": 150, "total_tokens": 650}
+    tokens.message_tokens(message, MODEL)
+    return message
+
+
+def make_conversation(rng, conversation_id, message_count):
+    return {
+        "id": conversation_id,
+        "name": f"Runiewski {conversation_id}",
+        "chatbot_personality": PERSONALITY,
+        "tags": rng.sample(["runy", "python", "praca", "dom"], rng.randint(0, 2)),
+        "messages": [make_message(rng, "user" if i % 2 == 0 else "assistant") for i in range(message_count)],
+    }
+
+
+def log_uniform(rng, low, high):
+    return int(math.exp(rng.uniform(math.log(low), math.log(high))))
+
+
+def generate_dataset(backend, preset, path, seed):
+    """Tworzy bazę: konwersacja 1 jest największa, reszta ma typową długość."""
+    conversations, (low, high), largest = PRESETS[preset]
+    rng = random.Random(seed)
+    db = make_storage(backend, path)
+    total = 0
+    for conversation_id in db.allocate_ids(conversations):
+        count = largest if conversation_id == 1 else log_uniform(rng, low, high)
+        db.save_conversation(make_conversation(rng, conversation_id, count))
+        total += count
+        if conversation_id % 1000 == 0:
+            print(f"  {preset}/{backend}: {conversation_id}/{conversations}", file=sys.stderr)
+    db.set_current_id(1)
+    (Path(path) / "dataset.json").write_text(json.dumps({"conversations": conversations, "messages": total}))
+
+
+def dataset_path(data_dir, backend, preset, seed):
+    path = Path(data_dir) / f"{backend}_{preset}_{seed}"
+    if not (path / "dataset.json").exists():
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"Generuję bazę {path}...", file=sys.stderr)
+        generate_dataset(backend, preset, path, seed)
+    return path
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(samples),
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "min_ms": ordered[0],
+        "max_ms": ordered[-1],
+    }
+
+
+def make_import_archive(rng):
+    source = io.BytesIO()
+
+    class _Single:
+        # minimalny "magazyn" z jedną konwersacją – tylko do zbudowania archiwum
+        conversation = make_conversation(rng, 1, 100)
+
+        def load_conversation(self, conversation_id):
+            return {**self.conversation, "messages": list(self.conversation["messages"])}
+
+    archive.export_archive(_Single(), source, [1])
+    return source.getvalue()
+
+
+def e2e_turn(db, client, generation, conversation):
+    """Jedna tura rozmowy tak jak w app.py: prompt -> odpowiedź w tle -> zapis."""
+    user_message = {"role": "user", "content": "Jak wylosować runę dnia?"}
+    tokens.message_tokens(user_message, MODEL)
+    conversation["messages"].append(user_message)
+    db.append_messages(conversation["id"], [user_message])
+
+    messages = chatbot.build_messages(PERSONALITY, user_message["content"], conversation["messages"], MODEL)
+    job = generation.start_generation(
+        client,
+        conversation["id"],
+        MODEL,
+        messages,
+        on_finish=lambda job: db.append_messages(job.conversation_id, [job.message]),
+    )
+    job.wait()
+    if job.error:
+        raise job.error
+    conversation["messages"].append(job.message)
+    return job.message["timing"]
+
+
+def run_dataset(backend, preset, source_path, repeat, stub_config, seed):
+    rng = random.Random(seed + 1)
+    results = []
+    dataset = json.loads((source_path / "dataset.json").read_text())
+
+    def record(op, samples, **extra):
+        results.append({
+            "backend": backend,
+            "preset": preset,
+            "conversations": dataset["conversations"],
+            "messages": dataset["messages"],
+            "op": op,
+            **summarize(samples),
+            **extra,
+        })
+
+    with tempfile.TemporaryDirectory() as work:
+        path = Path(work) / "db"
+        shutil.copytree(source_path, path)
+        db = make_storage(backend, path)
+        ids = db.conversation_ids()
+
+        record("list_conversations", timed(db.list_conversations, repeat))
+
+        cache = conversation_cache.ConversationCache(db)
+
+        def load_current():
+            return cache.load(db.get_current_id(NAMESPACE))
+        record("load_current_conversation", timed(load_current, repeat))
+        record("load_current_conversation_uncached",
+               timed(lambda: db.load_conversation(db.get_current_id(NAMESPACE)), repeat))
+
+        def switch(choices):
+            conversation_id = rng.choice(choices)
+            db.set_current_id(conversation_id, NAMESPACE)
+            cache.load(conversation_id)
+        record("switch_conversation", timed(lambda: switch(ids), repeat))
+
+        # jak w sidebarze: 15 widocznych konwersacji wczytanych w tle przed kliknięciem
+        visible = ids[-15:]
+        cache.prefetch(visible)
+        deadline = time.monotonic() + 60
+        while cache.stats()["prefetched"] < len(visible) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        record("switch_conversation_prefetched", timed(lambda: switch(visible), repeat))
+        db.set_current_id(1, NAMESPACE)
+
+        largest = db.load_conversation(1)
+        budget = chatbot.context_budget(MODEL)
+        record(
+            "prepare_conversation_context",
+            timed(lambda: chatbot.prepare_conversation_context(largest["messages"], budget, MODEL), repeat),
+        )
+        record(
+            "build_messages",
+            timed(lambda: chatbot.build_messages(PERSONALITY, "Cześć!", largest["messages"], MODEL), repeat),
+        )
+
+        def save_messages():
+            db.append_messages(1, [make_message(rng, "user"), make_message(rng, "assistant")])
+        record("save_current_conversation_messages", timed(save_messages, repeat))
+
+        def create_new():
+            conversation_id = db.allocate_id()
+            db.save_conversation({
+                "id": conversation_id,
+                "name": f"Runiewski {conversation_id}",
+                "chatbot_personality": PERSONALITY,
+                "messages": [],
+                "tags": [],
+            })
+            db.set_current_id(conversation_id, NAMESPACE)
+        record("create_new_conversation", timed(create_new, repeat))
+
+        archive_bytes = make_import_archive(rng)
+        record(
+            "import_conversation",
+            timed(lambda: archive.import_file(db, io.BytesIO(archive_bytes)), repeat),
+        )
+
+        results.append(run_e2e(db, backend, preset, dataset, repeat, stub_config))
+    return results
+
+
+def run_e2e(db, backend, preset, dataset, repeat, stub_config):
+    row = {"backend": backend, "preset": preset, "conversations": dataset["conversations"],
+           "messages": dataset["messages"], "op": "e2e_turn"}
+    try:
+        from openai import OpenAI
+        import generation
+        import ratelimit
+        from stub_openai import StubServer
+    except ImportError as e:
+        return {**row, "skipped": f"brak zależności: {e.name}"}
+
+    server = StubServer(**stub_config).start()
+    try:
+        client = OpenAI(base_url=server.base_url, api_key="stub")
+        # stub nie ma limitów – kolejka limitera (TPM przy długiej historii) zafałszowałaby narzut
+        ratelimit.get_limiter(client).configure(rpm=None, tpm=None)
+        conversation = db.load_conversation(1)
+        timings = []
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            timings.append(e2e_turn(db, client, generation, conversation))
+            samples.append((time.perf_counter() - started) * 1000)
+        # narzut aplikacji = czas tury minus czas samej odpowiedzi serwera
+        overhead = [s - t["total_s"] * 1000 for s, t in zip(samples, timings)]
+        return {
+            **row,
+            **summarize(samples),
+            "ttft_median_ms": statistics.median(t["ttft_s"] * 1000 for t in timings),
+            "overhead_median_ms": statistics.median(overhead),
+            "stub": stub_config,
+        }
+    finally:
+        client.close()
+        server.stop()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path, threshold):
+    """Wypisuje zmiany median względem poprzedniego wyniku; zwraca liczbę regresji."""
+    previous = json.loads(Path(previous_path).read_text())
+    before = {(r["backend"], r["preset"], r["op"]): r for r in previous["results"] if "median_ms" in r}
+    regressions = 0
+    print(f"{'backend':8} {'preset':8} {'operacja':38} {'przed':>10} {'teraz':>10} {'zmiana':>8}", file=sys.stderr)
+    for row in current["results"]:
+        old = before.get((row["backend"], row["preset"], row["op"]))
+        if old is None or "median_ms" not in row:
+            continue
+        ratio = row["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESJA"
+            regressions += 1
+        print(
+            f"{row['backend']:8} {row['preset']:8} {row['op']:38} "
+            f"{old['median_ms']:10.3f} {row['median_ms']:10.3f} {ratio - 1:+8.0%}{flag}",
+            file=sys.stderr,
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark magazynu i kontekstu")
+    parser.add_argument("--preset", default="small", help=f"lista presetów: {', '.join(PRESETS)}")
+    parser.add_argument("--backend", default="json", help="json, sqlite albo json,sqlite")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=Path(__file__).resolve().parent / ".data")
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="opóźnienie stub serwera (s)")
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--output", help="zapisz wyniki JSON do pliku (domyślnie stdout)")
+    parser.add_argument("--compare", help="plik z poprzednimi wynikami do porównania")
+    parser.add_argument("--threshold", type=float, default=0.2, help="próg regresji mediany (0.2 = +20%%)")
+    args = parser.parse_args()
+
+    presets = [p.strip() for p in args.preset.split(",")]
+    backends = [b.strip() for b in args.backend.split(",")]
+    unknown = [p for p in presets if p not in PRESETS]
+    if unknown:
+        parser.error(f"nieznane presety: {', '.join(unknown)}")
+
+    stub_config = {"first_token_delay": args.first_token_delay, "chunk_delay": args.chunk_delay}
+    results = []
+    for preset in presets:
+        for backend in backends:
+            source = dataset_path(args.data_dir, backend, preset, args.seed)
+            print(f"Mierzę {preset}/{backend}...", file=sys.stderr)
+            results.extend(run_dataset(backend, preset, source, args.repeat, stub_config, args.seed))
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "search_index": SEARCH_INDEX,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Test obciążeniowy równoległych zapisów do magazynu konwersacji.
+
+Każdy "użytkownik" (wątek albo proces) dopisuje wiadomości do wspólnej
+konwersacji i do własnej, zmienia jej nazwę/tagi i ustawia swój wskaźnik
+aktualnej konwersacji. Na końcu sprawdzamy, że nic nie zginęło: liczba
+wiadomości w plikach i w indeksie, sumy kosztów, wskaźniki użytkowników.
+
+    python benchmarks/stress_concurrent_writes.py --users 8 --messages 50
+    python benchmarks/stress_concurrent_writes.py --backend sqlite --processes
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import costs  # noqa: E402
+import storage  # noqa: E402
+
+MODEL = "gpt-4o-mini"
+
+
+def make_storage(backend, path):
+    if backend == "sqlite":
+        return storage.SqliteStorage(Path(path) / "chatapp.sqlite3")
+    return storage.JsonStorage(path)
+
+
+def make_message(user, i):
+    return {
+        "role": "assistant",
+        "content": f"użytkownik {user}, wiadomość {i}",
+        "model": MODEL,
+        "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+    }
+
+
+def user_session(backend, path, user, shared_id, own_id, messages, db=None):
+    db = db or make_storage(backend, path)
+    db.set_current_id(own_id, namespace=f"user{user}")
+    writes = 0
+    for i in range(messages):
+        db.append_messages(shared_id, [make_message(user, i)])
+        db.append_messages(own_id, [make_message(user, i)])
+        writes += 2
+        if i % 10 == 0:
+            db.update_conversation(own_id, name=f"Użytkownik {user} ({i})", tags=[f"u{user}", f"i{i}"])
+            db.update_conversation(shared_id, tags=[f"u{user}"])
+            writes += 2
+    return writes
+
+
+def create_conversation(db, name):
+    conversation_id = db.allocate_id()
+    db.save_conversation({
+        "id": conversation_id,
+        "name": name,
+        "chatbot_personality": "",
+        "messages": [],
+        "tags": [],
+    })
+    return conversation_id
+
+
+def run(backend, users, messages, processes):
+    with tempfile.TemporaryDirectory() as path:
+        db = make_storage(backend, path)
+        shared_id = create_conversation(db, "Wspólna")
+        own_ids = [create_conversation(db, f"Użytkownik {u}") for u in range(users)]
+
+        started = time.perf_counter()
+        if processes:
+            with ProcessPoolExecutor(max_workers=users) as pool:
+                futures = [
+                    pool.submit(user_session, backend, path, u, shared_id, own_ids[u], messages)
+                    for u in range(users)
+                ]
+                writes = sum(f.result() for f in futures)
+        else:
+            # wątki dzielą jedną instancję magazynu – jak sesje Streamlit w procesie
+            with ThreadPoolExecutor(max_workers=users) as pool:
+                futures = [
+                    pool.submit(user_session, backend, path, u, shared_id, own_ids[u], messages, db)
+                    for u in range(users)
+                ]
+                writes = sum(f.result() for f in futures)
+        elapsed = time.perf_counter() - started
+
+        # świeża instancja – bez stanu w pamięci procesu
+        db = make_storage(backend, path)
+        message_cost = costs.message_cost(make_message(0, 0), MODEL)
+        entries = {e["id"]: e for e in db.list_conversations()}
+        errors = []
+
+        expected = {shared_id: users * messages, **{own_id: messages for own_id in own_ids}}
+        for conversation_id, count in expected.items():
+            conversation = db.load_conversation(conversation_id)
+            if len(conversation["messages"]) != count:
+                errors.append(f"{conversation_id}: {len(conversation['messages'])} wiadomości zamiast {count}")
+            if entries[conversation_id]["message_count"] != count:
+                errors.append(f"{conversation_id}: indeks ma {entries[conversation_id]['message_count']} zamiast {count}")
+            cost = conversation["totals"]["cost_usd"]
+            if abs(cost - count * message_cost) > 1e-9:
+                errors.append(f"{conversation_id}: koszt {cost} zamiast {count * message_cost}")
+        for u, own_id in enumerate(own_ids):
+            if db.get_current_id(namespace=f"user{u}") != own_id:
+                errors.append(f"user{u}: zły wskaźnik aktualnej konwersacji")
+
+        return {
+            "backend": backend,
+            "mode": "processes" if processes else "threads",
+            "users": users,
+            "writes": writes,
+            "elapsed_s": elapsed,
+            "writes_per_s": writes / elapsed,
+            "lost_updates": len(errors),
+            "errors": errors[:10],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=("json", "sqlite", "all"), default="all")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--processes", action="store_true", help="użytkownicy jako osobne procesy")
+    args = parser.parse_args()
+
+    backends = ("json", "sqlite") if args.backend == "all" else (args.backend,)
+    results = [run(b, args.users, args.messages, args.processes) for b in backends]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if any(r["lost_updates"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Lokalny serwer udający API OpenAI (/v1/chat/completions).
+
+Obsługuje zwykłe odpowiedzi i streaming SSE (`stream=True`, także
+`stream_options.include_usage`). Opóźnienia są konfigurowalne, więc można
+na nim mierzyć czas do pierwszego tokenu bez płacenia za prawdziwe API.
+
+Wstrzykiwanie awarii: `error_rate` – odsetek zapytań kończonych błędem
+`error_status` (z nagłówkiem Retry-After, jeśli podano `retry_after`),
+`slow_rate` – odsetek zapytań z pierwszym tokenem dopiero po `slow_delay`
+sekundach, `failing_models` – modele zawsze zwracające `error_status`.
+
+Cache promptów (`prompt_cache=True`) działa jak w API: najdłuższy prefiks
+wiadomości widziany już we wcześniejszym zapytaniu (co najmniej
+`prompt_cache_min_tokens`, zaokrąglony w dół do wielokrotności 128) trafia
+do `usage.prompt_tokens_details.cached_tokens`. "Tokenem" stuba jest słowo.
+
+Użycie jako osobny proces:
+    python benchmarks/stub_openai.py --port 8765 --first-token-delay 0.5
+
+albo z kodu:
+    server = StubServer(first_token_delay=0.5).start()
+    client = OpenAI(base_url=server.base_url, api_key="stub")
+    ...
+    server.stop()
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "To jest odpowiedź z lokalnego serwera testowego. " * 8
+
+
+class StubConfig:
+    def __init__(self, reply=DEFAULT_REPLY, first_token_delay=0.2, chunk_delay=0.01, chunk_words=2,
+                 error_rate=0.0, error_status=503, retry_after=None, slow_rate=0.0, slow_delay=5.0,
+                 failing_models=(), seed=None, prompt_cache=True, prompt_cache_min_tokens=1024):
+        self.reply = reply
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.failing_models = tuple(failing_models)
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.prompt_cache = prompt_cache
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        # skróty prefiksów wiadomości z wcześniejszych zapytań
+        self.prefixes = set()
+
+    def fault(self, model):
+        """None, "error" albo "slow" – co zrobić z tym zapytaniem."""
+        if model in self.failing_models:
+            return "error"
+        with self.rng_lock:
+            roll = self.rng.random()
+        if roll < self.error_rate:
+            return "error"
+        if roll < self.error_rate + self.slow_rate:
+            return "slow"
+        return None
+
+
+def _chunks(text, words_per_chunk):
+    words = text.split(" ")
+    for i in range(0, len(words), words_per_chunk):
+        piece = " ".join(words[i:i + words_per_chunk])
+        yield piece if i + words_per_chunk >= len(words) else piece + " "
+
+
+def _cached_tokens(request, config):
+    """Tokeny najdłuższego prefiksu promptu widzianego już wcześniej (i zapamiętanie prefiksów)."""
+    digest = hashlib.sha256()
+    tokens = cached = 0
+    prefixes = []
+    with config.rng_lock:
+        for message in request.get("messages", []):
+            digest.update(json.dumps(message, sort_keys=True).encode())
+            tokens += len(message.get("content", "").split())
+            prefix = digest.copy().hexdigest()
+            if prefix in config.prefixes:
+                cached = tokens
+            prefixes.append(prefix)
+        config.prefixes.update(prefixes)
+    if cached < config.prompt_cache_min_tokens:
+        return 0
+    return cached - cached % 128
+
+
+def _usage(request, config):
+    prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+    completion_tokens = len(config.reply.split())
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if config.prompt_cache:
+        usage["prompt_tokens_details"] = {"cached_tokens": _cached_tokens(request, config)}
+    return usage
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        # jedna instancja handlera na połączenie TCP
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append(request)
+        config = self.server.config
+
+        fault = config.fault(request.get("model"))
+        if fault == "error":
+            self.server.errors += 1
+            self._error(config)
+            return
+        time.sleep(config.slow_delay if fault == "slow" else config.first_token_delay)
+        try:
+            if request.get("stream"):
+                self._stream(request, config)
+            else:
+                self._complete(request, config)
+        except (BrokenPipeError, ConnectionResetError):
+            # klient zamknął połączenie (przerwanie, przegrane zapytanie zapasowe)
+            self.close_connection = True
+
+    def _error(self, config):
+        body = json.dumps({
+            "error": {"message": "stub: wstrzyknięty błąd", "type": "server_error", "code": None},
+        }).encode()
+        self.send_response(config.error_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if config.retry_after is not None:
+            self.send_header("Retry-After", str(config.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _complete(self, request, config):
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": config.reply},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(request, config),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_event(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        event = f"data: {data}\n\n".encode()
+        # chunked transfer encoding – każdy event jako osobny chunk
+        self.wfile.write(f"{len(event):X}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, request, config):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        base = {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+        }
+        for i, piece in enumerate(_chunks(config.reply, config.chunk_words)):
+            if i:
+                time.sleep(config.chunk_delay)
+            delta = {"content": piece}
+            if i == 0:
+                delta["role"] = "assistant"
+            self._send_event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+
+        self._send_event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**base, "choices": [], "usage": _usage(request, config)})
+        self._send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class StubServer:
+    def __init__(self, host="127.0.0.1", port=0, **config):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = StubConfig(**config)
+        self.httpd.requests = []
+        self.httpd.connections = 0
+        self.httpd.errors = 0
+        self.httpd.stats_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer udający API OpenAI")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-delay", type=float, default=5.0)
+    parser.add_argument("--failing-model", action="append", default=[])
+    args = parser.parse_args()
+
+    server = StubServer(
+        port=args.port,
+        first_token_delay=args.first_token_delay,
+        chunk_delay=args.chunk_delay,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+        failing_models=args.failing_model,
+    )
+    print(f"Serwer testowy: {server.base_url}")
+    server.httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Logika rozmowy z modelem – niezależna od Streamlit.
+
+Funkcje przyjmują klienta OpenAI i model jako argumenty, dzięki czemu można
+je uruchomić z CLI albo przeciwko lokalnemu serwerowi testowemu
+(benchmarks/stub_openai.py) przez `OpenAI(base_url=...)`.
+"""
+import time
+
+import metrics
+import retrieval
+import summary as history_summary
+import tokens
+from config import (
+    model_context_windows,
+    MODEL,
+    COMPLETION_TOKENS_RESERVE,
+    MAX_PROMPT_TOKENS,
+    CONTEXT_TRUNCATION,
+    CONTEXT_BLOCK_TOKENS,
+    RETRIEVAL_TOP_K,
+    RETRIEVAL_BUDGET_SHARE,
+)
+
+
+def context_budget(model, max_prompt_tokens=MAX_PROMPT_TOKENS):
+    """Ile tokenów może zająć prompt: okno modelu minus rezerwa na odpowiedź."""
+    budget = model_context_windows[model] - COMPLETION_TOKENS_RESERVE
+    if max_prompt_tokens:
+        budget = min(budget, max_prompt_tokens)
+    return budget
+
+
+def prepare_conversation_context(messages, max_tokens, model=MODEL):
+    """Przygotowuje kontekst konwersacji z inteligentnym obcinaniem historii.
+
+    Zwraca najdłuższy sufiks historii mieszczący się w `max_tokens`
+    (ostatnia wiadomość jest dołączana zawsze). Liczby tokenów pochodzą
+    z cache w wiadomościach, więc koszt jest liniowy względem okna.
+    """
+    context = []
+
+    # Zawsze dodaj ostatnią wiadomość użytkownika
+    if messages:
+        context.append(messages[-1])
+        token_count = tokens.message_tokens(messages[-1], model)
+
+    # Dodawaj wcześniejsze wiadomości, dopóki nie przekroczysz limitu tokenów
+    for i in range(len(messages) - 2, -1, -1):
+        msg_tokens = tokens.message_tokens(messages[i], model)
+        if token_count + msg_tokens > max_tokens:
+            break
+        context.append(messages[i])
+        token_count += msg_tokens
+
+    context.reverse()
+    return context
+
+
+def prepare_block_context(messages, max_tokens, model=MODEL, block_tokens=CONTEXT_BLOCK_TOKENS):
+    """Kontekst obcinany od początku całymi blokami – stabilny prefiks promptu.
+
+    Historia jest dzielona na bloki po ~`block_tokens` tokenów liczone od
+    pierwszej wiadomości (granice zależą tylko od wcześniejszych wiadomości,
+    więc nie przesuwają się, gdy rozmowa rośnie). Kontekst zaczyna się od
+    pierwszej granicy, od której reszta historii mieści się w `max_tokens`.
+    Początek kontekstu zmienia się więc raz na blok, a nie co turę, i API
+    może użyć cache promptu dla całego wspólnego prefiksu.
+    """
+    counts = [tokens.message_tokens(m, model) for m in messages]
+    total = sum(counts)
+    if total <= max_tokens:
+        return list(messages)
+
+    # blok nie większy niż pół budżetu – po obcięciu zostaje co najmniej połowa okna
+    block_tokens = max(min(block_tokens, max_tokens // 2), 1)
+    before = 0
+    next_boundary = 0
+    for i, count in enumerate(counts):
+        if before >= next_boundary:
+            # wiadomość i zaczyna nowy blok
+            if total - before <= max_tokens:
+                return list(messages[i:])
+            next_boundary = (before // block_tokens + 1) * block_tokens
+        before += count
+    # nawet ostatni blok się nie mieści (bardzo długie wiadomości) – zwykłe obcinanie
+    return prepare_conversation_context(messages, max_tokens, model)
+
+
+def truncate_history(messages, max_tokens, model=MODEL, truncation=CONTEXT_TRUNCATION,
+                     block_tokens=CONTEXT_BLOCK_TOKENS):
+    """Sufiks historii mieszczący się w `max_tokens` wybrany strategią `truncation`."""
+    if truncation == "blocks":
+        return prepare_block_context(messages, max_tokens=max_tokens, model=model, block_tokens=block_tokens)
+    return prepare_conversation_context(messages, max_tokens=max_tokens, model=model)
+
+
+def build_messages(personality, user_prompt, memory, model=MODEL, max_prompt_tokens=MAX_PROMPT_TOKENS,
+                   summary=None, truncation=CONTEXT_TRUNCATION, block_tokens=CONTEXT_BLOCK_TOKENS,
+                   retrieval_index=None, top_k=RETRIEVAL_TOP_K, retrieval_share=RETRIEVAL_BUDGET_SHARE):
+    """Składa listę wiadomości wysyłaną do API (system + kontekst + prompt).
+
+    Prompt systemowy (osobowość) jest wliczany do budżetu kontekstu. Jeśli
+    podano `summary`, trafia ono zaraz po osobowości, a z historii brane są
+    tylko wiadomości, których podsumowanie jeszcze nie obejmuje. Historię
+    za długą na budżet obcina `truncation` ("blocks" z blokami po
+    `block_tokens` albo "sliding", zob. CONTEXT_TRUNCATION).
+
+    Z `retrieval_index` (retrieval.MessageIndex tej konwersacji) obcięta
+    historia dostaje do `retrieval_share` budżetu na `top_k` starszych
+    wiadomości najbardziej związanych z `user_prompt`. Trafiają one tuż
+    przed pytanie, więc nie zmieniają wspólnego prefiksu kolejnych promptów.
+    """
+    # dodaj system message
+    messages = [
+        {
+            "role": "system",
+            "content": personality,
+        },
+    ]
+    budget = context_budget(model, max_prompt_tokens) - tokens.TOKENS_PER_REPLY
+    budget -= tokens.count_tokens(personality, model) + tokens.TOKENS_PER_MESSAGE
+
+    history = memory
+    # podsumowanie nieaktualne (np. historia została obcięta) pomijamy
+    if summary and summary["covered"] <= len(memory):
+        messages.append(history_summary.summary_message(summary))
+        budget -= summary["tokens"]
+        memory = memory[summary["covered"]:]
+
+    # dodaj wiadomość użytkownika jeśli nie jest już w kontekście
+    prompt_in_memory = bool(memory) and memory[-1]["role"] == "user" and memory[-1]["content"] == user_prompt
+    if not prompt_in_memory:
+        budget -= tokens.count_tokens(user_prompt, model) + tokens.TOKENS_PER_MESSAGE
+
+    # Użyj inteligentnego zarządzania kontekstem zamiast sztywnej liczby wiadomości
+    context = truncate_history(memory, budget, model, truncation, block_tokens)
+
+    recalled = None
+    if retrieval_index is not None and top_k and len(context) < len(memory):
+        # część budżetu oddajemy przywołanym wiadomościom; jeśli nic nie pasuje, okno zostaje pełne
+        reserve = int(budget * retrieval_share)
+        with metrics.span("retrieval"):
+            narrowed = truncate_history(memory, budget - reserve, model, truncation, block_tokens)
+            before = len(history) - len(narrowed)
+            recalled = retrieval.recall_message(
+                retrieval_index, history, user_prompt, before, reserve, model, top_k
+            )
+        if recalled:
+            context = narrowed
+
+    # dodaj wszystkie wiadomości z kontekstu
+    for message in context:
+        messages.append({"role": message["role"], "content": message["content"]})
+
+    if recalled:
+        messages.insert(len(messages) - 1 if prompt_in_memory else len(messages), recalled)
+
+    if not prompt_in_memory:
+        messages.append({"role": "user", "content": user_prompt})
+
+    return messages
+
+
+def usage_to_dict(usage):
+    if not usage:
+        return {}
+    result = {
+        "completion_tokens": usage.completion_tokens,
+        "prompt_tokens": usage.prompt_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+    # część promptu obsłużona z cache promptów API (tańsza, zob. costs.message_cost)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is not None:
+        result["cached_tokens"] = cached_tokens
+    return result
+
+
+def complete(client, model, messages):
+    """Pojedyncze zapytanie bez streamingu; zwraca gotową wiadomość asystenta."""
+    started = time.perf_counter()
+    response = client.chat.completions.create(
+        model=model,
+        messages=messages
+    )
+    total = time.perf_counter() - started
+
+    reply = {
+        "role": "assistant",
+        "content": response.choices[0].message.content,
+        "usage": usage_to_dict(response.usage),
+        # bez streamingu pierwszy token widzimy dopiero razem z całą odpowiedzią
+        "timing": {"ttft_s": total, "total_s": total},
+    }
+    metrics.record_api_call(model, reply["timing"], reply["usage"])
+    return reply
+
+
+def stream_reply(client, model, messages, reply, on_open=None, timeout=None):
+    """Generator zwracający kolejne fragmenty odpowiedzi w miarę ich nadejścia.
+
+    Po zakończeniu generatora słownik `reply` zawiera wiadomość asystenta:
+    treść, `usage` (z ostatniego chunka dzięki `include_usage`) oraz czasy
+    `ttft_s` (do pierwszego tokenu) i `total_s`. Jeśli strumień został
+    przerwany (zamknięcie generatora, błąd), `reply` ma to, co zdążyło
+    przyjść, i `"interrupted": True`.
+
+    `on_open(stream)` dostaje otwarty strumień HTTP – można go zamknąć z
+    innego wątku, żeby przerwać zapytanie. `timeout` (sekundy) ogranicza
+    nawiązanie połączenia i każdy odczyt ze strumienia.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    parts = []
+    usage = None
+    completed = False
+
+    options = {"timeout": timeout} if timeout is not None else {}
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **options,
+    )
+    if on_open:
+        on_open(stream)
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(delta)
+                yield delta
+        completed = True
+    finally:
+        if not completed:
+            stream.close()
+        finished = time.perf_counter()
+        reply.update({
+            "role": "assistant",
+            "content": "".join(parts),
+            "usage": usage_to_dict(usage),
+            "timing": {
+                "ttft_s": (first_token_at or finished) - started,
+                "total_s": finished - started,
+            },
+        })
+        if not completed:
+            reply["interrupted"] = True
+        metrics.record_api_call(model, reply["timing"], reply["usage"], interrupted=not completed)
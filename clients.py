@@ -0,0 +1,138 @@
+"""Współdzielony (na proces) cache klientów OpenAI.
+
+Streamlit wykonuje skrypt od nowa przy każdej interakcji, więc tworzenie
+`OpenAI(api_key=...)` na poziomie modułu oznaczało nowy pool połączeń httpx
+(i nowy handshake TLS) przy każdym zapytaniu. Tutaj klient wraz z poolem
+żyje między rerunami i sesjami – jeden na klucz API.
+
+Eksmisja: najdawniej używane klucze ponad CLIENT_CACHE_MAX_KEYS oraz
+klucze nieużywane dłużej niż CLIENT_CACHE_IDLE_TTL sekund są usuwane
+z cache. Klient może mieć jeszcze otwarty strumień (czas użycia zmienia
+tylko get_openai_client, nie trwające generowanie), więc zapytania
+(generation, summary) oznaczają się przez in_use – usunięty klient bez
+trwających zapytań jest zamykany od razu, a z nimi po zakończeniu ostatniego.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import httpx
+from openai import OpenAI
+
+import metrics
+from config import (
+    CLIENT_CACHE_MAX_KEYS,
+    CLIENT_CACHE_IDLE_TTL,
+    CLIENT_MAX_CONNECTIONS,
+    CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+    CLIENT_KEEPALIVE_EXPIRY,
+    CLIENT_CONNECT_TIMEOUT,
+    CLIENT_READ_TIMEOUT,
+)
+
+# skrót klucza -> [klient, czas ostatniego użycia]
+_clients = OrderedDict()
+# id(klient) -> liczba trwających zapytań (in_use)
+_requests = {}
+# id(klient) -> klient usunięty z cache, zamykany po ostatnim zapytaniu
+_retired = {}
+_lock = threading.Lock()
+
+
+def _cache_key(api_key, base_url):
+    # w kluczach cache nie trzymamy jawnego klucza API
+    return hashlib.sha256(f"{base_url}|{api_key}".encode()).hexdigest()
+
+
+def _make_client(api_key, base_url=None):
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=CLIENT_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(CLIENT_READ_TIMEOUT, connect=CLIENT_CONNECT_TIMEOUT),
+    )
+    # ponawianie robi resilience.stream_reply – wbudowane w SDK mnożyłoby próby
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+
+def _evict(now):
+    """Usuwa z cache nieużywane i nadmiarowe klucze (wywoływane pod blokadą).
+
+    Zwraca klientów do zamknięcia (bez trwających zapytań); pozostałych
+    zamknie in_use po ich ostatnim zapytaniu.
+    """
+    evicted = [_clients.pop(key)[0] for key in list(_clients) if now - _clients[key][1] > CLIENT_CACHE_IDLE_TTL]
+    while len(_clients) > CLIENT_CACHE_MAX_KEYS:
+        evicted.append(_clients.popitem(last=False)[1][0])
+    idle = []
+    for client in evicted:
+        if _requests.get(id(client)):
+            _retired[id(client)] = client
+        else:
+            idle.append(client)
+    return idle
+
+
+def get_openai_client(api_key, base_url=None):
+    """Zwraca klienta dla klucza API, tworząc go tylko przy pierwszym użyciu."""
+    key = _cache_key(api_key, base_url)
+    now = time.monotonic()
+    with _lock:
+        if key in _clients:
+            client = _clients[key][0]
+            _clients[key][1] = now
+            _clients.move_to_end(key)
+        else:
+            client = _make_client(api_key, base_url)
+            _clients[key] = [client, now]
+        idle = _evict(now)
+    for evicted in idle:
+        evicted.close()
+    return client
+
+
+@contextmanager
+def in_use(client):
+    """Oznacza trwające zapytanie klienta – eksmisja nie zamknie go w jego trakcie."""
+    with _lock:
+        _requests[id(client)] = _requests.get(id(client), 0) + 1
+    try:
+        yield client
+    finally:
+        with _lock:
+            _requests[id(client)] -= 1
+            retired = None
+            if not _requests[id(client)]:
+                del _requests[id(client)]
+                retired = _retired.pop(id(client), None)
+        if retired is not None:
+            retired.close()
+
+
+def cached_clients_count():
+    with _lock:
+        return len(_clients)
+
+
+def close_all():
+    """Zamyka wszystkich klientów (koniec procesu, benchmarki) – tylko bez trwających zapytań."""
+    with _lock:
+        clients = [client for client, _ in _clients.values()] + list(_retired.values())
+        _clients.clear()
+        _retired.clear()
+    for client in clients:
+        client.close()
+
+
+@metrics.register_collector
+def _client_metrics():
+    with _lock:
+        retired = len(_retired)
+    return [
+        ("chatapp_cached_clients", {}, cached_clients_count()),
+        ("chatapp_retired_clients", {}, retired),
+    ]
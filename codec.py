@@ -0,0 +1,157 @@
+"""Kodowanie plików konwersacji: szybki JSON i opcjonalna kompresja.
+
+- JSON – orjson, jeśli jest zainstalowany (i FAST_JSON = True), w
+  przeciwnym razie standardowy moduł json; oba zapisują UTF-8 bez
+  escapowania polskich znaków, a odczytują też stare pliki,
+- kompresja – STORAGE_COMPRESSION = "gzip" albo "zstd" (pakiet zstandard;
+  bez niego używamy gzip). Format rozpoznajemy po pierwszych bajtach,
+  więc po zmianie ustawienia stare pliki czytają się dalej, a przepisują
+  się w nowym formacie przy kolejnym zapisie.
+
+Skompresowany plik może składać się z wielu ramek/członów (gzip i zstd
+pozwalają je sklejać) – tak dopisujemy do logu wiadomości bez
+przepisywania całego pliku.
+
+COMPRESSION można zmienić w trakcie działania (np. w benchmarkach) –
+funkcje czytają je przy każdym zapisie.
+"""
+import gzip
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - zależność opcjonalna
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zależność opcjonalna
+    zstandard = None
+
+from config import FAST_JSON, STORAGE_COMPRESSION, STORAGE_COMPRESSLEVEL
+from fsutil import atomic_write
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+METHODS = (None, "gzip", "zstd")
+READ_CHUNK = 1 << 16
+
+
+def resolve_compression(method):
+    """Metoda kompresji, której faktycznie użyjemy (zstd bez pakietu -> gzip)."""
+    if method not in METHODS:
+        raise ValueError(f"nieznana metoda kompresji: {method!r}")
+    if method == "zstd" and zstandard is None:
+        return "gzip"
+    return method
+
+
+COMPRESSION = resolve_compression(STORAGE_COMPRESSION)
+USE_ORJSON = FAST_JSON and orjson is not None
+
+
+def dumps(obj):
+    """JSON jako bytes (UTF-8)."""
+    if USE_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps_text(obj):
+    return dumps(obj).decode()
+
+
+def dumps_line(obj):
+    return dumps(obj) + b"\n"
+
+
+def loads(data):
+    """Parsuje JSON z bytes albo str."""
+    if USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def detect(data):
+    """"gzip", "zstd" albo None (zwykły tekst) na podstawie pierwszych bajtów."""
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def compress(data, method, level=STORAGE_COMPRESSLEVEL):
+    if method is None:
+        return data
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=min(level, 9), mtime=0)
+
+
+def _new_decoder(method):
+    if method == "zstd":
+        if zstandard is None:
+            raise ValueError("plik skompresowany zstd – zainstaluj pakiet zstandard")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def decompress(data, tolerant=False):
+    """Rozpakowuje dane w dowolnym obsługiwanym formacie (wiele ramek też).
+
+    Uszkodzone dane to ValueError, tak jak niepoprawny JSON.
+
+    Ramki dekodujemy po kolei, więc z `tolerant=True` ucięta lub uszkodzona
+    końcówka (przerwany zapis) jest pomijana, a wcześniejsze ramki zostają.
+    """
+    method = detect(data)
+    if method is None:
+        return data
+    errors = (zlib.error, zstandard.ZstdError) if zstandard is not None else zlib.error
+    view = memoryview(data)
+    out = []
+    pos = 0
+    while pos < len(data):
+        decoder = _new_decoder(method)
+        frame = []
+        try:
+            # kawałkami – inaczej unused_data kopiowałoby resztę pliku przy każdej ramce
+            while not decoder.eof and pos < len(data):
+                chunk = view[pos:pos + READ_CHUNK]
+                frame.append(decoder.decompress(chunk))
+                pos += len(chunk)
+        except errors as e:
+            if not tolerant:
+                raise ValueError(f"uszkodzone skompresowane dane: {e}") from e
+            break
+        if not decoder.eof:
+            if not tolerant:
+                raise ValueError("skompresowane dane są ucięte")
+            break
+        out.extend(frame)
+        pos -= len(decoder.unused_data)
+        if data[pos:pos + 1] == b"\0":
+            # gzip dopuszcza zera po ostatnim członie
+            break
+    return b"".join(out)
+
+
+def read_bytes(path, tolerant=False):
+    with open(path, "rb") as f:
+        return decompress(f.read(), tolerant)
+
+
+def read_json(path):
+    return loads(read_bytes(path))
+
+
+def encode(data):
+    """Dane do zapisu w bieżącym formacie (COMPRESSION)."""
+    return compress(data, COMPRESSION)
+
+
+def write_json(path, obj):
+    """Atomowo zapisuje obiekt jako JSON w bieżącym formacie."""
+    atomic_write(path, encode(dumps(obj)))
@@ -0,0 +1,351 @@
+"""Archiwum konwersacji – chłodna warstwa magazynu.
+
+Konwersacje nieruszane dłużej niż COLD_AFTER_DAYS są przenoszone z
+magazynu (storage.py) do skompresowanych segmentów:
+
+    db/cold/
+    ├── catalog.sqlite3   (ID -> segment, przesunięcie, długość + nazwa, tagi, liczniki)
+    ├── cold.lock
+    └── segments/
+        ├── 000001.seg    (sklejone ramki – jedna skompresowana konwersacja na ramkę)
+        └── ...
+
+Z magazynu znikają pliki/wiersze konwersacji i wpis w indeksie listy, więc
+listowanie, przydział ID i skany katalogu zależą tylko od konwersacji
+"gorących". Indeks wyszukiwarki zostaje – zarchiwizowane konwersacje dalej
+są w wynikach i można je przywrócić (ramka jest czytana po przesunięciu,
+bez rozpakowywania reszty segmentu).
+
+Segment jest tylko dopisywany; przywrócenie albo usunięcie konwersacji
+zostawia w nim martwą ramkę. Kompaktacja (compact) przepisuje segmenty
+z małym udziałem żywych ramek do nowego segmentu – ramki kopiujemy bez
+ponownej kompresji – i usuwa stare pliki.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import codec
+import costs
+import metrics
+from config import (
+    COLD_AFTER_DAYS,
+    COLD_CHECK_INTERVAL,
+    COLD_COMPACT_MIN_LIVE,
+    COLD_COMPRESSION,
+    COLD_COMPRESSLEVEL,
+    COLD_SEGMENT_MAX_BYTES,
+    FSYNC_WRITES,
+)
+from fsutil import locked
+
+DIRNAME = "cold"
+CATALOG_FILENAME = "catalog.sqlite3"
+SEGMENT_SUFFIX = ".seg"
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT '[]',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL DEFAULT '',
+    archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_by_segment ON conversations (segment);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+_maintenance_lock = threading.Lock()
+_last_maintenance = {}
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def max_id(path):
+    """Największe zarchiwizowane ID w katalogu `path` (0, gdy archiwum nie ma).
+
+    Potrzebne przy odbudowie licznika ID, żeby nowe konwersacje nie
+    dostały ID konwersacji z archiwum.
+    """
+    catalog = Path(path) / CATALOG_FILENAME
+    if not catalog.exists():
+        return 0
+    conn = sqlite3.connect(catalog, timeout=30)
+    try:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class ColdStore:
+    def __init__(self, path, segment_max_bytes=COLD_SEGMENT_MAX_BYTES, compression=COLD_COMPRESSION,
+                 compresslevel=COLD_COMPRESSLEVEL):
+        self.path = Path(path)
+        self.segments_path = self.path / "segments"
+        self.segments_path.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.path / "cold.lock"
+        self.segment_max_bytes = segment_max_bytes
+        self.compression = codec.resolve_compression(compression)
+        self.compresslevel = compresslevel
+        self._local = threading.local()
+        self._conn().executescript(CATALOG_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path / CATALOG_FILENAME, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    #
+    # segmenty
+    #
+    def _segment_path(self, segment):
+        return self.segments_path / f"{segment:06d}{SEGMENT_SUFFIX}"
+
+    def _segment_ids(self):
+        return sorted(int(p.stem) for p in self.segments_path.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def _append_frames(self, segment, frames):
+        """Dopisuje ramki do segmentu; zwraca ich przesunięcia (wywoływane pod blokadą)."""
+        offsets = []
+        with open(self._segment_path(segment), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for frame in frames:
+                offsets.append(offset)
+                f.write(frame)
+                offset += len(frame)
+            f.flush()
+            if FSYNC_WRITES:
+                os.fsync(f.fileno())
+        return offsets
+
+    def _active_segment(self, size):
+        segments = self._segment_ids()
+        if segments and self._segment_path(segments[-1]).stat().st_size + size <= self.segment_max_bytes:
+            return segments[-1]
+        return (segments[-1] if segments else 0) + 1
+
+    def _read_frame(self, segment, offset, length):
+        with open(self._segment_path(segment), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    #
+    # konwersacje
+    #
+    def put(self, conversation, updated_at=None):
+        """Zapisuje konwersację w archiwum (poprzednia kopia staje się martwą ramką)."""
+        frame = codec.compress(codec.dumps(conversation), self.compression, self.compresslevel)
+        totals = conversation.get("totals") or costs.compute_totals(conversation.get("messages", []))
+        with locked(self.lock_path):
+            segment = self._active_segment(len(frame))
+            (offset,) = self._append_frames(segment, [frame])
+            # wpis w katalogu dopiero po zapisie ramki – przerwany zapis zostawia tylko martwe bajty
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO conversations (id, segment, offset, length, name, tags, "
+                    "message_count, cost_usd, updated_at, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        conversation["id"],
+                        segment,
+                        offset,
+                        len(frame),
+                        conversation["name"],
+                        codec.dumps_text(conversation.get("tags", [])),
+                        len(conversation.get("messages", [])),
+                        totals["cost_usd"],
+                        updated_at or "",
+                        _now(),
+                    ),
+                )
+
+    def get(self, conversation_id):
+        """Wczytuje zarchiwizowaną konwersację; FileNotFoundError, gdy jej nie ma."""
+        row = self._conn().execute(
+            "SELECT segment, offset, length FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Brak konwersacji {conversation_id} w archiwum")
+        try:
+            frame = self._read_frame(*row)
+        except FileNotFoundError:
+            # segment przepisany przez kompaktację w innym procesie – bierzemy nowe położenie
+            row = self._conn().execute(
+                "SELECT segment, offset, length FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                raise
+            frame = self._read_frame(*row)
+        return codec.loads(codec.decompress(frame))
+
+    def contains(self, conversation_id):
+        return self._conn().execute(
+            "SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)
+        ).fetchone() is not None
+
+    def remove(self, conversation_id):
+        """Usuwa konwersację z katalogu (ramka zostaje do kompaktacji); zwraca, czy była."""
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+
+    def list_entries(self, limit=None):
+        """Zarchiwizowane konwersacje od ostatnio zarchiwizowanej (pola jak w list_conversations)."""
+        sql = ("SELECT id, name, tags, message_count, updated_at, cost_usd, archived_at FROM conversations "
+               "ORDER BY archived_at DESC, id DESC")
+        rows = self._conn().execute(sql + " LIMIT ?", (limit,)) if limit else self._conn().execute(sql)
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "tags": codec.loads(row[2]),
+                "message_count": row[3],
+                "updated_at": row[4],
+                "cost_usd": row[5],
+                "archived_at": row[6],
+            }
+            for row in rows
+        ]
+
+    def ids(self):
+        return [row[0] for row in self._conn().execute("SELECT id FROM conversations ORDER BY id")]
+
+    #
+    # kompaktacja
+    #
+    def stats(self):
+        """Liczba konwersacji, segmentów oraz bajty na dysku i w żywych ramkach."""
+        conn = self._conn()
+        count, live = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM conversations").fetchone()
+        sizes = [self._segment_path(s).stat().st_size for s in self._segment_ids()]
+        return {"conversations": count, "segments": len(sizes), "bytes": sum(sizes), "live_bytes": live}
+
+    def compact(self, min_live=COLD_COMPACT_MIN_LIVE):
+        """Przepisuje segmenty, w których żywe ramki to mniej niż `min_live` rozmiaru.
+
+        Segmenty bez żywych ramek są po prostu usuwane. Zwraca liczbę
+        przepisanych segmentów i odzyskane bajty.
+        """
+        result = {"segments": 0, "reclaimed_bytes": 0}
+        with locked(self.lock_path):
+            live = dict(self._conn().execute(
+                "SELECT segment, SUM(length) FROM conversations GROUP BY segment"
+            ).fetchall())
+            segments = self._segment_ids()
+            # przepisywane ramki trafiają do nowych segmentów za wszystkimi istniejącymi
+            target = (segments[-1] + 1 if segments else 1), 0
+            for segment in segments:
+                path = self._segment_path(segment)
+                size = path.stat().st_size
+                if size and live.get(segment, 0) / size >= min_live:
+                    continue
+                if live.get(segment):
+                    target = self._rewrite(segment, target)
+                path.unlink()
+                result["segments"] += 1
+                result["reclaimed_bytes"] += size - live.get(segment, 0)
+        return result
+
+    def _rewrite(self, segment, target):
+        """Przenosi żywe ramki segmentu do segmentu `target` = (numer, zapisane bajty).
+
+        Zwraca nowe `target`; wywoływane pod blokadą archiwum.
+        """
+        rows = self._conn().execute(
+            "SELECT id, offset, length FROM conversations WHERE segment = ? ORDER BY offset", (segment,)
+        ).fetchall()
+        target_segment, written = target
+        moved = []
+        with open(self._segment_path(segment), "rb") as source:
+            for conversation_id, offset, length in rows:
+                if written and written + length > self.segment_max_bytes:
+                    target_segment, written = target_segment + 1, 0
+                source.seek(offset)
+                (new_offset,) = self._append_frames(target_segment, [source.read(length)])
+                moved.append((target_segment, new_offset, conversation_id))
+                written += length
+        # stary plik usuwamy dopiero po przepięciu katalogu na nowe położenie
+        with self._transaction() as conn:
+            conn.executemany("UPDATE conversations SET segment = ?, offset = ? WHERE id = ?", moved)
+        return target_segment, written
+
+
+def get_cold_store(path):
+    """Archiwum w katalogu `path` (jedna instancja na proces)."""
+    key = str(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ColdStore(path)
+        return store
+
+
+def idle_cutoff(days=COLD_AFTER_DAYS, now=None):
+    """Znacznik updated_at, przed którym konwersacja jest "nieużywana"."""
+    return ((now or datetime.now()) - timedelta(days=days)).isoformat(timespec="seconds")
+
+
+def _maintain(db, keep_ids):
+    try:
+        archived = db.archive_idle(COLD_AFTER_DAYS, keep_ids=keep_ids)
+        compacted = db.cold.compact()
+        metrics.inc("chatapp_cold_archived_total", len(archived))
+        metrics.inc("chatapp_cold_reclaimed_bytes_total", compacted["reclaimed_bytes"])
+    except (OSError, ValueError, sqlite3.Error):
+        # kolejna próba przy następnym terminie; konwersacje zostają w magazynie
+        pass
+
+
+def maintain_if_due(db, keep_ids=(), interval=COLD_CHECK_INTERVAL):
+    """W tle archiwizuje nieużywane konwersacje i kompaktuje segmenty – najwyżej raz na `interval` s."""
+    if COLD_AFTER_DAYS is None or not interval or db.cold is None:
+        return
+    with _maintenance_lock:
+        now = time.monotonic()
+        last = _last_maintenance.get(id(db))
+        if last is not None and now - last < interval:
+            return
+        _last_maintenance[id(db)] = now
+    threading.Thread(target=_maintain, args=(db, tuple(keep_ids)), name="cold-maintenance", daemon=True).start()
+
+
+@metrics.register_collector
+def _cold_metrics():
+    with _stores_lock:
+        stores = list(_stores.values())
+    values = []
+    for store in stores:
+        stats = store.stats()
+        labels = {"path": str(store.path)}
+        values += [
+            ("chatapp_cold_conversations", labels, stats["conversations"]),
+            ("chatapp_cold_segments", labels, stats["segments"]),
+            ("chatapp_cold_bytes", labels, stats["bytes"]),
+            ("chatapp_cold_live_bytes", labels, stats["live_bytes"]),
+        ]
+    return values
@@ -0,0 +1,179 @@
+from pathlib import Path
+
+
+model_pricings = {
+    "gpt-4o": {
+        "input_tokens": 5.00 / 1_000_000,  # per token
+        "cached_input_tokens": 2.50 / 1_000_000,  # per token (prompt caching)
+        "output_tokens": 15.00 / 1_000_000,  # per token
+    },
+    "gpt-4o-mini": {
+        "input_tokens": 0.150 / 1_000_000,  # per token
+        "cached_input_tokens": 0.075 / 1_000_000,  # per token (prompt caching)
+        "output_tokens": 0.600 / 1_000_000,  # per token
+    }
+}
+# rozmiar okna kontekstu modeli (w tokenach)
+model_context_windows = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+}
+MODEL = "gpt-4o-mini"
+# osobowość nowych konwersacji (także domyślna w trybie wsadowym, zob. batch.py)
+DEFAULT_PERSONALITY = """
+Jesteś ekspertem w Pythonie, NLP oraz w tworzeniu aplikacji opartych na AI. Pomagasz mi w stworzeniu aplikacji o 
+runach nordyckich, która będzie miała następujące funkcje:
+Losowanie runy dnia – wraz z interpretacją, radami i wartościowymi opisami.
+Losowanie układu run – np. krzyż celtycki, układ partnerski.
+Model AI – który będzie interpretował układy run na podstawie źródeł oraz intencji wpisanej przez użytkownika.
+Dodatkowo chcę oddzielić dane (opisy run) od kodu i zarządzać nimi w osobnym pliku, np. JSON lub module Pythona. 
+Kod powinien być czysty, dobrze udokumentowany i łatwy do rozwijania.
+Proszę, abyś:
+Doradzał mi najlepsze praktyki w zarządzaniu danymi i organizacji kodu.
+Pomógł mi napisać funkcje do pobierania, losowania i interpretacji run.
+Wspierał mnie w implementacji prostego modelu NLP do interpretacji układów run.
+Sugestie i poprawki kodu podawał w czytelnej formie i tłumaczył, dlaczego warto je zastosować.
+Jeśli coś można zrobić lepiej, proponuj optymalne rozwiązania. Bądź konkretny, precyzyjny i pomagaj mi rozwijać 
+moje umiejętności w kodowaniu. Możesz zadawać pytania, jeśli coś wymaga doprecyzowania.
+""".strip()
+# tokeny zarezerwowane w oknie kontekstu na odpowiedź modelu
+COMPLETION_TOKENS_RESERVE = 4_096
+# opcjonalny górny limit tokenów promptu (None – całe okno modelu minus rezerwa)
+MAX_PROMPT_TOKENS = None
+# obcinanie historii, gdy nie mieści się w budżecie:
+# "blocks" – od początku odpadają całe bloki po CONTEXT_BLOCK_TOKENS, więc prefiks promptu
+#            jest identyczny przez wiele tur i trafia w cache promptów po stronie API,
+# "sliding" – najdłuższy mieszczący się sufiks (prefiks zmienia się niemal co turę)
+CONTEXT_TRUNCATION = "blocks"
+CONTEXT_BLOCK_TOKENS = 16_000
+# przywoływanie starszych wiadomości podobnych do pytania, gdy historia nie mieści
+# się w budżecie (lokalny indeks BM25, zob. retrieval.py; wymaga numpy)
+RETRIEVAL = True
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_BUDGET_SHARE = 0.2  # część budżetu kontekstu na przywołane wiadomości
+RETRIEVAL_CACHE_SIZE = 32  # indeksy konwersacji trzymane w pamięci procesu
+# kroczące podsumowanie starszej historii (zob. summary.py)
+SUMMARIZE_HISTORY = False
+SUMMARY_MODEL = "gpt-4o-mini"
+# podsumowanie jest rozszerzane, gdy niepodsumowana historia przekroczy tyle tokenów...
+SUMMARY_TRIGGER_TOKENS = 8_000
+# ...a ostatnie tyle tokenów zawsze zostaje w oryginalnej postaci
+SUMMARY_KEEP_RECENT_TOKENS = 4_000
+USD_TO_PLN = 4.05
+# ile ostatnich wiadomości renderujemy i o ile doładowujemy starsze
+RENDER_WINDOW = 30
+RENDER_PAGE_SIZE = 30
+# ile przygotowanych treści wiadomości trzymamy w cache renderowania
+RENDER_CACHE_SIZE = 4_096
+# klienci OpenAI współdzieleni między rerunami (zob. clients.py)
+CLIENT_CACHE_MAX_KEYS = 32
+CLIENT_CACHE_IDLE_TTL = 60 * 60  # sekundy bez użycia, po których klient jest zamykany
+CLIENT_MAX_CONNECTIONS = 20
+CLIENT_MAX_KEEPALIVE_CONNECTIONS = 10
+CLIENT_KEEPALIVE_EXPIRY = 120.0  # sekundy
+CLIENT_CONNECT_TIMEOUT = 10.0
+CLIENT_READ_TIMEOUT = 120.0
+# odpowiedź pokazywana w trakcie generowania token po tokenie (zawsze idzie
+# strumieniem w tle – tylko tak da się ją przerwać przyciskiem "Zatrzymaj")
+STREAM_REPLIES = True
+# ile odpowiedzi naraz może generować jeden proces serwera (reszta czeka w kolejce)
+MAX_CONCURRENT_GENERATIONS = 8
+# co ile sekund sesja odświeża treść generowanej odpowiedzi
+GENERATION_POLL_INTERVAL = 0.1
+# odporność zapytań do API (zob. resilience.py); klient OpenAI sam już nie ponawia
+API_MAX_ATTEMPTS = 3  # prób na model, 1 – bez ponawiania
+API_FIRST_TOKEN_TIMEOUT = 30.0  # sekundy na pierwszy token jednej próby
+API_READ_TIMEOUT = 60.0  # sekundy na połączenie i każdy odczyt ze strumienia
+API_BACKOFF_BASE = 0.5  # sekundy; kolejne opóźnienia rosną dwukrotnie (z losowym rozrzutem)
+API_BACKOFF_MAX = 8.0
+API_RETRY_AFTER_MAX = 30.0  # dłuższego Retry-After nie czekamy
+# zapasowe zapytanie, gdy pierwszy token spóźnia się ponad percentyl ostatnich czasów
+API_HEDGE = False
+API_HEDGE_PERCENTILE = 0.95
+API_HEDGE_DELAY = 3.0  # sekundy, zanim zbierzemy API_HEDGE_MIN_SAMPLES pomiarów
+API_HEDGE_MIN_SAMPLES = 20
+# limit zapytań na klucz API, wspólny dla sesji procesu (zob. ratelimit.py); None – bez limitu
+RATE_LIMIT_RPM = 500
+RATE_LIMIT_TPM = 200_000
+# tokeny odpowiedzi pobierane z limitu z góry (korygowane po faktycznym usage)
+RATE_LIMIT_COMPLETION_ESTIMATE = 1_000
+RATE_LIMIT_MAX_WAIT = 120.0  # sekundy w kolejce, po których zapytanie kończy się błędem
+# dzienny limit kosztu na klucz API w USD, None – bez limitu
+DAILY_COST_LIMIT_USD = None
+# model awaryjny po wyczerpaniu prób (musi mieć cennik w model_pricings)
+API_FALLBACK_MODELS = {
+    "gpt-4o": "gpt-4o-mini",
+}
+
+DB_PATH = Path("db")
+DB_CONVERSATIONS_PATH = DB_PATH / "conversations"
+EXPORTS_PATH = Path("exports")
+# fsync przy każdym atomowym zapisie pliku (trwałość kosztem wydajności)
+FSYNC_WRITES = False
+# magazyn konwersacji: "json" (katalog db/) albo "sqlite" (db/chatapp.sqlite3, zob. storage.py)
+STORAGE_BACKEND = "json"
+SQLITE_PATH = DB_PATH / "chatapp.sqlite3"
+# True – wiadomości dopisywane do logu conversations/<id>.jsonl (nagłówek w <id>.json)
+# False – cała konwersacja (z wiadomościami) przepisywana w <id>.json przy każdym zapisie
+MESSAGE_LOG = True
+# kodowanie plików konwersacji (zob. codec.py): szybki JSON (orjson), jeśli jest zainstalowany
+FAST_JSON = True
+# kompresja plików konwersacji i indeksu: None, "gzip" albo "zstd" (pakiet zstandard,
+# bez niego gzip); odczyt rozpoznaje format sam, więc zmiana nie psuje starych plików
+STORAGE_COMPRESSION = None
+STORAGE_COMPRESSLEVEL = 3  # gzip 1-9, zstd 1-22
+# wczytane konwersacje trzymane w pamięci procesu (zob. conversation_cache.py);
+# limit szacowanego rozmiaru w bajtach, 0 – bez cache
+CONVERSATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# wczytywanie w tle konwersacji widocznych na liście w sidebarze, 0 wątków – bez prefetchu
+CONVERSATION_PREFETCH_WORKERS = 2
+# archiwum konwersacji (zob. cold_storage.py): konwersacje nieruszane dłużej niż COLD_AFTER_DAYS
+# trafiają do skompresowanych segmentów w db/cold/ – poza listą w sidebarze, ale w wyszukiwarce;
+# None – tylko ręczna archiwizacja
+COLD_AFTER_DAYS = 90
+COLD_CHECK_INTERVAL = 24 * 60 * 60  # sekundy między sprawdzeniami w procesie aplikacji
+COLD_COMPRESSION = "zstd"  # bez pakietu zstandard – gzip
+COLD_COMPRESSLEVEL = 9
+COLD_SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# segment, w którym żywe konwersacje zajmują mniej niż tyle, jest przepisywany przy kompaktacji
+COLD_COMPACT_MIN_LIVE = 0.5
+# wyszukiwarka konwersacji (indeks odwrócony, zob. search_index.py)
+SEARCH_INDEX = True
+SEARCH_INDEX_PATH = DB_PATH / "search.sqlite3"
+SEARCH_RESULTS_LIMIT = 20
+# statystyki zużycia i kosztów liczone przy zapisie (zob. analytics.py, strona "Koszty")
+ANALYTICS = True
+ANALYTICS_PATH = DB_PATH / "analytics.sqlite3"
+# archiwa eksportu (.ndjson.gz, zob. archive.py): poziom kompresji gzip 1-9
+ARCHIVE_COMPRESSLEVEL = 6
+# ile ID konwersacji import rezerwuje naraz
+IMPORT_ID_BATCH = 100
+# cache odpowiedzi dla identycznych zapytań (zob. response_cache.py), domyślnie wyłączony
+RESPONSE_CACHE = False
+RESPONSE_CACHE_PATH = DB_PATH / "response_cache"
+RESPONSE_CACHE_MAX_ENTRIES = 1_000
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60  # sekundy
+# metryki i panel diagnostyki w sidebarze (zob. metrics.py), domyślnie wyłączone
+METRICS = False
+# plik z metrykami w formacie Prometheusa (np. dla textfile collectora), None – bez zapisu
+METRICS_EXPORT_PATH = None
+METRICS_EXPORT_INTERVAL = 15  # sekundy między zapisami pliku
+# port lokalnego endpointu http://127.0.0.1:<port>/metrics, None – bez endpointu
+METRICS_PORT = None
+# db/
+# ├── current.json     (domyślna aktualna konwersacja)
+# ├── sessions/        (aktualna konwersacja per użytkownik/sesja, <namespace>.json)
+# ├── index.json       (+ index.journal z ostatnimi zmianami)
+# ├── chatapp.sqlite3  (tylko przy STORAGE_BACKEND = "sqlite")
+# ├── search.sqlite3   (indeks wyszukiwarki)
+# ├── analytics.sqlite3 (sumy tokenów i kosztów per dzień, model, konwersacja)
+# ├── response_cache/  (opcjonalnie, <sha256>.json)
+# ├── cold/            (archiwum: catalog.sqlite3 + segments/<n>.seg)
+# ├── conversations/
+# │   ├── 1.json       (nagłówek: nazwa, osobowość, tagi)
+# │   ├── 1.jsonl      (log wiadomości)
+# │   ├── 2.json
+# │   └── ...
+# ├── exports/
+# │   ├── chatapp_20250410_123045.ndjson.gz
+# │   └── ...
@@ -0,0 +1,193 @@
+"""Cache wczytanych konwersacji w pamięci procesu (wspólny dla sesji).
+
+Przy każdym rerunie aplikacja wczytuje aktualną konwersację, a przełączenie
+konwersacji wczytywało ją dwa razy (przed i po st.rerun). Tutaj wczytana
+konwersacja zostaje w pamięci razem ze znacznikiem wersji z magazynu
+(storage.conversation_version – stat plików albo licznik wersji w SQLite),
+więc niezmieniona konwersacja nie jest ponownie czytana ani parsowana.
+Każdy zapis – z tej czy innej sesji albo procesu – zmienia wersję, a wpis
+jest wtedy wczytywany od nowa.
+
+Cache jest ograniczony szacowanym rozmiarem w bajtach
+(CONVERSATION_CACHE_MAX_BYTES, eksmisja najdawniej używanych). Opcjonalny
+prefetch wczytuje w tle konwersacje widoczne na liście w sidebarze, tak
+żeby "Załaduj" nie czekało na dysk; prefetch nie wypycha wpisów z cache.
+
+Zwracane są kopie (słownik, lista wiadomości i każda wiadomość) – sesja może
+je zmieniać, np. tokens.message_tokens dopisuje do wiadomości "tokens", a
+wersja w magazynie się wtedy nie zmienia. Zagnieżdżonych słowników wiadomości
+(usage, timing, tokens) nie zmieniamy w miejscu, tylko podmieniamy.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import CONVERSATION_CACHE_MAX_BYTES, CONVERSATION_PREFETCH_WORKERS
+
+# narzut na wiadomość w szacowaniu rozmiaru (słownik, role, usage, timing)
+MESSAGE_OVERHEAD_BYTES = 400
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def estimate_size(conversation):
+    """Przybliżony rozmiar konwersacji w pamięci (bajty)."""
+    size = len(conversation.get("chatbot_personality") or "") + MESSAGE_OVERHEAD_BYTES
+    for message in conversation["messages"]:
+        size += len(message.get("content") or "") + MESSAGE_OVERHEAD_BYTES
+    return size
+
+
+def _copy(conversation):
+    return {**conversation, "messages": [dict(m) for m in conversation["messages"]]}
+
+
+class _Entry:
+    def __init__(self, version, conversation, size):
+        self.version = version
+        self.conversation = conversation
+        self.size = size
+
+
+class ConversationCache:
+    def __init__(self, db, max_bytes=CONVERSATION_CACHE_MAX_BYTES, prefetch_workers=CONVERSATION_PREFETCH_WORKERS):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.prefetch_workers = prefetch_workers
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pool = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.prefetched = 0
+
+    def _lookup(self, conversation_id, version):
+        """Świeży wpis albo None (wywoływane pod blokadą)."""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        if entry.version != version:
+            self._drop(conversation_id)
+            self.stale += 1
+            return None
+        self._entries.move_to_end(conversation_id)
+        return entry
+
+    def _drop(self, conversation_id):
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def _store(self, conversation_id, version, conversation, prefetch=False):
+        size = estimate_size(conversation)
+        with self._lock:
+            self._drop(conversation_id)
+            if size > self.max_bytes or (prefetch and self.bytes + size > self.max_bytes):
+                # za duża albo prefetch musiałby wypychać konwersacje, których ktoś używa
+                return
+            self._entries[conversation_id] = _Entry(version, conversation, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+                self.evictions += 1
+
+    def load(self, conversation_id):
+        """Konwersacja z cache, jeśli jej wersja się nie zmieniła, w przeciwnym razie z magazynu."""
+        version = self.db.conversation_version(conversation_id)
+        with self._lock:
+            entry = self._lookup(conversation_id, version) if version is not None else None
+            if entry is not None:
+                self.hits += 1
+                return _copy(entry.conversation)
+            self.misses += 1
+        # wersję bierzemy przed odczytem – zapis w trakcie odczytu da przy
+        # kolejnym load() inną wersję i ponowne wczytanie, a nie stary wpis
+        conversation = self.db.load_conversation(conversation_id)
+        if version is not None:
+            self._store(conversation_id, version, conversation)
+        return _copy(conversation)
+
+    def _prefetch(self, conversation_id):
+        try:
+            version = self.db.conversation_version(conversation_id)
+            if version is None:
+                return
+            with self._lock:
+                if self._lookup(conversation_id, version) is not None:
+                    return
+            self._store(conversation_id, version, self.db.load_conversation(conversation_id), prefetch=True)
+            with self._lock:
+                self.prefetched += 1
+        except (OSError, ValueError):
+            # konwersacja usunięta albo w trakcie zapisu – wczyta się normalnie przy kliknięciu
+            pass
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def prefetch(self, conversation_ids):
+        """Wczytuje konwersacje w tle (pomija te już wczytywane)."""
+        if not self.prefetch_workers or not self.max_bytes:
+            return
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="prefetch")
+            todo = [i for i in conversation_ids if i not in self._pending]
+            self._pending.update(todo)
+        for conversation_id in todo:
+            self._pool.submit(self._prefetch, conversation_id)
+
+    def invalidate(self, conversation_id):
+        with self._lock:
+            self._drop(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "prefetched": self.prefetched,
+            }
+
+
+def get_cache(db):
+    """Cache konwersacji magazynu `db` (jeden na proces)."""
+    with _caches_lock:
+        cache = _caches.get(db)
+        if cache is None:
+            cache = _caches[db] = ConversationCache(db)
+        return cache
+
+
+@metrics.register_collector
+def _conversation_cache_metrics():
+    with _caches_lock:
+        caches = list(_caches.values())
+    values = []
+    for cache in caches:
+        stats = cache.stats()
+        labels = {"backend": type(cache.db).__name__}
+        values += [
+            ("chatapp_conversation_cache_hits", labels, stats["hits"]),
+            ("chatapp_conversation_cache_misses", labels, stats["misses"]),
+            ("chatapp_conversation_cache_stale", labels, stats["stale"]),
+            ("chatapp_conversation_cache_evictions", labels, stats["evictions"]),
+            ("chatapp_conversation_cache_prefetched", labels, stats["prefetched"]),
+            ("chatapp_conversation_cache_entries", labels, stats["entries"]),
+            ("chatapp_conversation_cache_bytes", labels, stats["bytes"]),
+        ]
+    return values
@@ -0,0 +1,226 @@
+"""Indeks konwersacji – lekki manifest zapisany w db/index.json.
+
+Pasek boczny potrzebuje tylko id, nazwy i tagów, więc zamiast przy każdym
+rerunie parsować wszystkie pliki konwersacji (razem z całą historią
+wiadomości) trzymamy ich podsumowanie w jednym małym pliku, aktualizowanym
+przy każdym zapisie.
+
+Zmiany nie przepisują całego index.json: trafiają jako pojedyncze linie do
+dziennika db/index.journal, który jest okresowo wchłaniany do migawki.
+Rekordy dziennika są idempotentne (ustawiają pola), więc ich ponowne
+odtworzenie niczego nie psuje.
+"""
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import codec
+import cold_storage
+import costs
+import message_log
+from fsutil import locked
+
+INDEX_FILENAME = "index.json"
+JOURNAL_FILENAME = "index.journal"
+LOCK_FILENAME = "index.lock"
+# po tylu rekordach dziennik jest wchłaniany do migawki
+JOURNAL_MAX_RECORDS = 500
+
+
+class _CachedIndex:
+    def __init__(self):
+        self.snapshot_mtime_ns = None
+        self.journal_offset = 0
+        self.journal_records = 0
+        self.index = None
+
+
+# cache w pamięci procesu: katalog db -> _CachedIndex
+_index_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _paths(db_path):
+    db_path = Path(db_path)
+    return db_path / INDEX_FILENAME, db_path / JOURNAL_FILENAME, db_path / LOCK_FILENAME
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def make_entry(conversation, updated_at=None):
+    """Buduje wpis indeksu na podstawie pełnej konwersacji."""
+    messages = conversation.get("messages", [])
+    totals = conversation.get("totals") or costs.compute_totals(messages)
+    return {
+        "id": conversation["id"],
+        "name": conversation["name"],
+        "tags": conversation.get("tags", []),
+        "message_count": len(messages),
+        "updated_at": updated_at or _now(),
+        "cost_usd": totals["cost_usd"],
+    }
+
+
+def _apply(index, record):
+    if "next_id" in record:
+        index["next_id"] = max(index["next_id"], record["next_id"])
+    if "entry" in record:
+        entry = record["entry"]
+        index["conversations"][str(entry["id"])] = entry
+        index["next_id"] = max(index["next_id"], entry["id"] + 1)
+    if "removed" in record:
+        index["conversations"].pop(str(record["removed"]), None)
+    if "fields" in record:
+        entry = index["conversations"].get(str(record["id"]))
+        if entry is not None:
+            entry.update(record["fields"])
+
+
+def _write_snapshot(db_path, index):
+    index_path, journal_path, _ = _paths(db_path)
+    codec.write_json(index_path, index)
+    # dziennik jest już w migawce
+    with open(journal_path, "w"):
+        pass
+
+
+def rebuild_index(db_path):
+    """Odbudowuje indeks od zera na podstawie plików w db/conversations.
+
+    Licznik ID nie schodzi poniżej ID zarchiwizowanych konwersacji (db/cold).
+    """
+    entries = {}
+    conversations_path = Path(db_path) / "conversations"
+    with locked(_paths(db_path)[2]):
+        for p in conversations_path.glob("*.json"):
+            conversation = message_log.load_conversation(conversations_path, p.stem)
+            updated_at = datetime.fromtimestamp(p.stat().st_mtime).isoformat(timespec="seconds")
+            entries[str(conversation["id"])] = make_entry(conversation, updated_at)
+
+        index = {
+            "next_id": max(max((int(k) for k in entries), default=0),
+                           cold_storage.max_id(Path(db_path) / cold_storage.DIRNAME)) + 1,
+            "conversations": entries,
+        }
+        _write_snapshot(db_path, index)
+        with _cache_lock:
+            _index_cache.pop(str(db_path), None)
+    return index
+
+
+def _read_snapshot(index_path):
+    index = codec.read_json(index_path)
+    index["next_id"], index["conversations"]
+    return index
+
+
+def load_index(db_path):
+    """Zwraca aktualny indeks: migawkę z cache plus nowe rekordy dziennika.
+
+    Brakujący lub uszkodzony indeks jest odbudowywany z plików konwersacji.
+    """
+    index_path, journal_path, _ = _paths(db_path)
+    with _cache_lock:
+        cached = _index_cache.setdefault(str(db_path), _CachedIndex())
+
+        try:
+            snapshot_mtime_ns = index_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            snapshot_mtime_ns = None
+        try:
+            journal_size = journal_path.stat().st_size
+        except FileNotFoundError:
+            journal_size = 0
+
+        if (
+            cached.index is None
+            or snapshot_mtime_ns != cached.snapshot_mtime_ns
+            or journal_size < cached.journal_offset
+        ):
+            # nowa migawka (np. po kompaktacji w innym procesie) – czytamy od zera
+            try:
+                cached.index = _read_snapshot(index_path)
+            except (FileNotFoundError, ValueError, KeyError, TypeError):
+                cached.index = None
+            cached.snapshot_mtime_ns = snapshot_mtime_ns
+            cached.journal_offset = 0
+            cached.journal_records = 0
+
+        if cached.index is not None and journal_size > cached.journal_offset:
+            with open(journal_path, "rb") as f:
+                f.seek(cached.journal_offset)
+                data = f.read()
+            # bierzemy tylko pełne linie – ostatnia może być w trakcie zapisu
+            complete = data[:data.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    _apply(cached.index, codec.loads(line))
+                    cached.journal_records += 1
+            cached.journal_offset += len(complete)
+        index = cached.index
+
+    if index is None:
+        return rebuild_index(db_path)
+    return index
+
+
+def _append_journal(db_path, record):
+    """Dopisuje rekord do dziennika (wywoływane pod blokadą indeksu)."""
+    _, journal_path, _ = _paths(db_path)
+    line = codec.dumps_line(record)
+    fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+    index = load_index(db_path)
+    if _index_cache[str(db_path)].journal_records >= JOURNAL_MAX_RECORDS:
+        _write_snapshot(db_path, index)
+        with _cache_lock:
+            _index_cache.pop(str(db_path), None)
+
+
+def allocate_id(db_path, count=1):
+    """Rezerwuje `count` kolejnych wolnych ID konwersacji; zwraca pierwsze z nich."""
+    with locked(_paths(db_path)[2]):
+        conversation_id = load_index(db_path)["next_id"]
+        _append_journal(db_path, {"next_id": conversation_id + count})
+    return conversation_id
+
+
+def upsert_entry(db_path, conversation):
+    """Dodaje lub nadpisuje wpis indeksu dla podanej konwersacji."""
+    entry = make_entry(conversation)
+    with locked(_paths(db_path)[2]):
+        load_index(db_path)
+        _append_journal(db_path, {"entry": entry})
+    return entry
+
+
+def update_entry(db_path, conversation_id, **fields):
+    """Aktualizuje wybrane pola wpisu (np. name, tags) bez czytania konwersacji."""
+    fields["updated_at"] = _now()
+    with locked(_paths(db_path)[2]):
+        entry = load_index(db_path)["conversations"].get(str(conversation_id))
+        if entry is None:
+            # wpisu brakuje (np. plik dodany ręcznie) – odbudowujemy indeks
+            entry = rebuild_index(db_path)["conversations"].get(str(conversation_id))
+            if entry is None:
+                return None
+        _append_journal(db_path, {"id": conversation_id, "fields": fields})
+    return dict(entry)
+
+
+def remove_entry(db_path, conversation_id):
+    """Usuwa wpis konwersacji (usuniętej albo przeniesionej do archiwum); next_id się nie cofa."""
+    with locked(_paths(db_path)[2]):
+        load_index(db_path)
+        _append_journal(db_path, {"removed": conversation_id})
+
+
+def list_entries(db_path):
+    return list(load_index(db_path)["conversations"].values())
@@ -0,0 +1,84 @@
+"""Koszty rozmów liczone przyrostowo.
+
+Każda wiadomość asystenta zapisuje model, którym została wygenerowana,
+a nagłówek konwersacji trzyma sumy tokenów i kosztu aktualizowane przy
+dopisywaniu wiadomości. Pasek boczny czyta gotowe sumy zamiast
+przeliczać całą historię, a zmiana MODEL nie przelicza kosztów wstecz.
+"""
+from config import model_pricings, MODEL
+
+
+def empty_totals():
+    return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+
+
+def message_cost(message, default_model=MODEL):
+    """Koszt (USD) pojedynczej wiadomości według cennika jej modelu.
+
+    Wiadomości sprzed zapisywania modelu wyceniamy modelem domyślnym.
+    Tokeny promptu z cache API (`cached_tokens`) mają osobną, niższą cenę.
+    """
+    usage = message.get("usage")
+    if not usage:
+        return 0.0
+    pricing = model_pricings.get(message.get("model", default_model), model_pricings[default_model])
+    cached_tokens = min(usage.get("cached_tokens", 0), usage["prompt_tokens"])
+    return (
+        (usage["prompt_tokens"] - cached_tokens) * pricing["input_tokens"]
+        + cached_tokens * pricing.get("cached_input_tokens", pricing["input_tokens"])
+        + usage["completion_tokens"] * pricing["output_tokens"]
+    )
+
+
+def add_to_totals(totals, messages, default_model=MODEL):
+    """Zwraca nowe sumy powiększone o podane wiadomości."""
+    totals = {**empty_totals(), **(totals or {})}
+    for message in messages:
+        usage = message.get("usage")
+        if not usage:
+            continue
+        totals["prompt_tokens"] += usage["prompt_tokens"]
+        totals["cached_tokens"] += usage.get("cached_tokens", 0)
+        totals["completion_tokens"] += usage["completion_tokens"]
+        totals["cost_usd"] += message_cost(message, default_model)
+    return totals
+
+
+def compute_totals(messages, default_model=MODEL):
+    return add_to_totals(None, messages, default_model)
+
+
+def add_usage(total, usage):
+    """Suma dwóch słowników usage (np. łączne zużycie zapytań podsumowania)."""
+    total = {"prompt_tokens": 0, "completion_tokens": 0, **(total or {})}
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+
+def summary_usage_message(summary, default_model=MODEL):
+    """Łączne zużycie zapytań podsumowania historii (summary["usage"]) jako wiadomość do wyceny."""
+    if not summary or not summary.get("usage"):
+        return None
+    return {"model": summary.get("model", default_model), "usage": summary["usage"]}
+
+
+def conversation_totals(messages, summary=None, default_model=MODEL):
+    """Sumy od zera: wiadomości plus zapytania podsumowania historii.
+
+    Podsumowania nie są wiadomościami, więc przy przeliczaniu (np. po
+    obcięciu historii) ich koszt bierzemy z metadanych podsumowania.
+    """
+    totals = compute_totals(messages, default_model)
+    extra = summary_usage_message(summary, default_model)
+    return add_to_totals(totals, [extra], default_model) if extra else totals
+
+
+def stamp_models(messages, default_model=MODEL):
+    """Dopisuje model do starych wiadomości z usage; zwraca liczbę zmian."""
+    changed = 0
+    for message in messages:
+        if message.get("usage") and "model" not in message:
+            message["model"] = default_model
+            changed += 1
+    return changed
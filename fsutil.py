@@ -0,0 +1,98 @@
+"""Bezpieczne zapisy plików przy wielu sesjach naraz.
+
+- atomic_write – zapis do pliku tymczasowego i `os.replace`, więc czytelnik
+  widzi albo starą, albo nową wersję pliku, nigdy połowę,
+- locked – blokada na klucz (np. jedną konwersację): wątki w procesie
+  kolejkują się na RLock, a procesy na `flock` pliku blokady (tam, gdzie
+  jest fcntl). Sesje pracujące na różnych konwersacjach na siebie nie czekają.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+import metrics
+from config import FSYNC_WRITES
+
+
+def atomic_write(path, data, fsync=FSYNC_WRITES):
+    """Atomowo zastępuje zawartość pliku (str albo bytes)."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if metrics.ENABLED:
+        metrics.inc("chatapp_file_writes_total")
+        metrics.inc("chatapp_file_written_bytes_total", len(data) if isinstance(data, bytes) else len(data.encode()))
+
+
+class _KeyLock:
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.users = 0
+        self.depth = 0
+        self.fd = None
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _flock(lock_path):
+    """Otwiera i blokuje plik blokady; zwraca deskryptor.
+
+    Plik blokady może zostać usunięty przez właściciela blokady (np. przy
+    usuwaniu konwersacji). Kto czekał na flock starego pliku, dostałby
+    blokadę, której nikt inny już nie bierze – sprawdzamy więc po flock,
+    czy pod ścieżką jest nadal ten sam plik, a jeśli nie, próbujemy od nowa.
+    """
+    while True:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        opened = os.fstat(fd)
+        try:
+            current = os.stat(lock_path)
+        except FileNotFoundError:
+            current = None
+        if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+            return fd
+        os.close(fd)
+
+
+@contextmanager
+def locked(lock_path):
+    """Wyłączny dostęp do zasobu opisanego plikiem blokady (reentrant w wątku)."""
+    key = str(lock_path)
+    with _locks_lock:
+        key_lock = _locks.get(key)
+        if key_lock is None:
+            key_lock = _locks[key] = _KeyLock()
+        key_lock.users += 1
+
+    key_lock.rlock.acquire()
+    try:
+        key_lock.depth += 1
+        if key_lock.depth == 1 and fcntl is not None:
+            Path(lock_path).parent.mkdir(parents=True, exist_ok=True)
+            key_lock.fd = _flock(lock_path)
+        yield
+    finally:
+        key_lock.depth -= 1
+        if key_lock.depth == 0 and key_lock.fd is not None:
+            fcntl.flock(key_lock.fd, fcntl.LOCK_UN)
+            os.close(key_lock.fd)
+            key_lock.fd = None
+        key_lock.rlock.release()
+        with _locks_lock:
+            key_lock.users -= 1
+            if key_lock.users == 0:
+                del _locks[key]
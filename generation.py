@@ -0,0 +1,222 @@
+"""Generowanie odpowiedzi w tle, poza rerunem Streamlit.
+
+Zapytanie do API trafia do wspólnej dla procesu puli wątków – naraz
+generuje się najwyżej MAX_CONCURRENT_GENERATIONS odpowiedzi, kolejne
+czekają w kolejce – a sesja trzyma tylko uchwyt zadania (GenerationJob).
+Skrypt odczytuje z niego bieżącą treść, więc sidebar i reszta strony
+działają w trakcie generowania.
+
+Przed zapytaniem zadanie czeka na swoją kolejkę w limiterze klucza API
+(ratelimit.py, status THROTTLED). Zapytanie idzie przez resilience.stream_reply – z limitami czasu,
+ponawianiem i modelem awaryjnym; użyty model i liczba prób trafiają do
+wiadomości.
+
+`cancel()` przerywa zadanie: zamyka strumień HTTP (serwer przestaje
+generować, a my płacić), a to, co zdążyło przyjść, zostaje zapisane jako
+wiadomość z `"interrupted": True`.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import clients
+import metrics
+import ratelimit
+import resilience
+import tokens
+from config import MAX_CONCURRENT_GENERATIONS
+
+QUEUED = "queued"
+THROTTLED = "throttled"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_GENERATIONS, thread_name_prefix="generation")
+_active = 0
+_active_lock = threading.Lock()
+
+
+class GenerationJob:
+    def __init__(self, conversation_id, model, messages, session=None, cancel_event=None):
+        self.conversation_id = conversation_id
+        # sesja dla sprawiedliwej kolejki limitera
+        self.session = session if session is not None else conversation_id
+        self.model = model
+        self.messages = messages
+        self.status = QUEUED
+        self.parts = []
+        self.reply = {}
+        # gotowa wiadomość asystenta (także częściowa) – None, jeśli nic nie przyszło
+        self.message = None
+        # wynik on_finish, np. to, co zwrócił zapis do magazynu
+        self.result = None
+        self.error = None
+        self.future = None
+        # otwarte strumienie HTTP (przy hedgingu mogą być dwa naraz)
+        self._streams = []
+        # wspólne zdarzenie (np. Ctrl-C w trybie wsadowym) anuluje naraz wiele zadań
+        self._cancel = cancel_event if cancel_event is not None else threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Przerywa generowanie (także to jeszcze czekające w kolejce)."""
+        self._cancel.set()
+        for stream in list(self._streams):
+            # zamknięcie odpowiedzi HTTP przerywa czekanie na kolejny chunk
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def wait(self, timeout=None):
+        """Czeka na zakończenie; zwraca True, jeśli zadanie się skończyło."""
+        return self._done.wait(timeout)
+
+    def _set_stream(self, stream):
+        self._streams.append(stream)
+        if self.cancelled:
+            stream.close()
+
+
+def active_generations():
+    """Ile odpowiedzi generuje się teraz w procesie (bez czekających w kolejce)."""
+    return _active
+
+
+@metrics.register_collector
+def _generation_metrics():
+    return [("chatapp_active_generations", {}, active_generations())]
+
+
+def estimate_usage(messages, content, model):
+    """Przybliżone usage przerwanej odpowiedzi (API nie zdążyło go przysłać)."""
+    prompt_tokens = tokens.prompt_tokens(messages, model)
+    completion_tokens = tokens.count_tokens(content, model)
+    return {
+        "completion_tokens": completion_tokens,
+        "prompt_tokens": prompt_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _build_message(job):
+    reply = job.reply
+    if not reply.get("content") and job.status != DONE:
+        return None
+
+    message = {
+        "role": "assistant",
+        "content": reply.get("content", ""),
+        "model": reply.get("model", job.model),
+        "usage": reply.get("usage") or {},
+        "timing": reply.get("timing", {}),
+        # dzień odpowiedzi w statystykach kosztów (analytics.py)
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if reply.get("attempts", 1) > 1 or reply.get("hedged"):
+        message["attempts"] = reply["attempts"]
+    if reply.get("hedged"):
+        message["hedged"] = True
+    if reply.get("interrupted"):
+        message["interrupted"] = True
+        if not message["usage"]:
+            # za przerwaną odpowiedź też płacimy – liczymy koszt szacunkowo
+            message["usage"] = estimate_usage(job.messages, message["content"], message["model"])
+            message["usage_estimated"] = True
+    tokens.message_tokens(message, message["model"])
+    return message
+
+
+def _run(job, client, on_finish):
+    global _active
+    limiter = ratelimit.get_limiter(client)
+    ticket = None
+    try:
+        if not job.cancelled:
+            job.status = THROTTLED
+            estimated = ratelimit.estimate_tokens(job.messages, job.model)
+            ticket = limiter.acquire(job.session, estimated, job.model, cancel_event=job._cancel)
+        if ticket is not None:
+            job.status = RUNNING
+            with _active_lock:
+                _active += 1
+            try:
+                # klient usunięty w tym czasie z cache zostanie zamknięty dopiero po tym zapytaniu
+                with clients.in_use(client):
+                    stream = resilience.stream_reply(
+                        client, job.model, job.messages, job.reply, on_open=job._set_stream, cancel_event=job._cancel
+                    )
+                    try:
+                        for delta in stream:
+                            job.parts.append(delta)
+                            if job.cancelled:
+                                break
+                    finally:
+                        stream.close()
+            finally:
+                with _active_lock:
+                    _active -= 1
+    except Exception as e:
+        # błąd po anulowaniu to zwykle skutek zamknięcia strumienia
+        if not job.cancelled:
+            job.error = e
+
+    if job.cancelled:
+        # strumień zamknięty z zewnątrz potrafi skończyć się bez błędu
+        job.reply["interrupted"] = True
+        job.status = CANCELLED
+    elif job.error is not None:
+        job.status = FAILED
+    else:
+        job.status = DONE
+
+    try:
+        job.message = _build_message(job)
+        if ticket is not None:
+            message = job.message or {}
+            limiter.settle(ticket, message.get("usage"), job.reply.get("attempts", 1), message.get("model"))
+        if on_finish:
+            job.result = on_finish(job)
+    except Exception as e:
+        job.error = job.error or e
+    finally:
+        job._done.set()
+
+
+def start_generation(client, conversation_id, model, messages, on_finish=None, session=None):
+    """Zleca wygenerowanie odpowiedzi w tle i zwraca uchwyt zadania.
+
+    `on_finish(job)` wywoływane jest w wątku roboczym po zakończeniu (także
+    po anulowaniu) – tam zapisujemy odpowiedź, nawet jeśli użytkownik
+    zamknął już kartę. Nie może korzystać z `st.session_state`. `session`
+    identyfikuje sesję w kolejce limitera (domyślnie konwersacja).
+    """
+    job = GenerationJob(conversation_id, model, messages, session)
+    job.future = _executor.submit(_run, job, client, on_finish)
+    return job
+
+
+def generate(client, conversation_id, model, messages, on_finish=None, session=None, cancel_event=None):
+    """Generuje odpowiedź w bieżącym wątku (np. w trybie wsadowym); zwraca zakończone zadanie.
+
+    Przechodzi tę samą drogę co `start_generation`: limiter, ponawianie,
+    budowa wiadomości i `on_finish`. Ustawienie `cancel_event` przerywa
+    czekanie w limiterze, na pierwszy token i strumień (po kolejnym fragmencie).
+    """
+    job = GenerationJob(conversation_id, model, messages, session, cancel_event)
+    _run(job, client, on_finish)
+    return job
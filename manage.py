@@ -0,0 +1,384 @@
+"""Narzędzia administracyjne dla bazy konwersacji (bez Streamlit).
+
+Użycie:
+    python manage.py rebuild-index
+    python manage.py compact [ID ...]
+    python manage.py backfill-costs
+    python manage.py migrate-sqlite [--target db/chatapp.sqlite3]
+    python manage.py rebuild-search
+    python manage.py search "zapytanie" [--tag TAG ...]
+    python manage.py export [--tag TAG ...] [--output exports/backup.ndjson.gz]
+    python manage.py import exports/backup.ndjson.gz
+    python manage.py archive [--days 90] [ID ...]
+    python manage.py restore ID [ID ...]
+    python manage.py archived
+    python manage.py delete ID [ID ...]
+    python manage.py compact-archive
+    python manage.py usage [--days 30 | --since 2026-01-01 --until 2026-01-31] [--by day|model|tag|conversation]
+    python manage.py rebuild-analytics
+    python manage.py batch pytania.jsonl --output wyniki.jsonl [--concurrency 8] [--save]
+
+rebuild-index i compact dotyczą magazynu JSON; pozostałe polecenia
+działają na backendzie wybranym w STORAGE_BACKEND. batch bierze klucz API
+z OPENAI_API_KEY (albo --api-key).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import analytics
+import archive
+import batch
+import clients
+import conversation_index
+import costs
+import message_log
+import ratelimit
+import storage
+from config import (
+    DB_PATH,
+    DB_CONVERSATIONS_PATH,
+    EXPORTS_PATH,
+    SQLITE_PATH,
+    SEARCH_RESULTS_LIMIT,
+    DEFAULT_PERSONALITY,
+    MODEL,
+    MAX_CONCURRENT_GENERATIONS,
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    COLD_AFTER_DAYS,
+    COLD_COMPACT_MIN_LIVE,
+)
+
+
+def cmd_rebuild_index(args):
+    index = conversation_index.rebuild_index(DB_PATH)
+    print(f"Odbudowano indeks: {len(index['conversations'])} konwersacji, next_id={index['next_id']}")
+
+
+def cmd_compact(args):
+    conversation_ids = args.ids or [p.stem for p in DB_CONVERSATIONS_PATH.glob("*.json")]
+    for conversation_id in conversation_ids:
+        message_log.migrate_to_log(DB_CONVERSATIONS_PATH, conversation_id)
+        header = message_log.compact(DB_CONVERSATIONS_PATH, conversation_id)
+        print(f"{conversation_id}: {header['message_count']} wiadomości")
+
+
+def cmd_backfill_costs(args):
+    """Jednorazowo dopisuje model do starych wiadomości i sumy kosztów do metadanych."""
+    db = storage.get_storage()
+    for conversation_id in db.conversation_ids():
+        conversation = db.load_conversation(conversation_id)
+        stamped = costs.stamp_models(conversation["messages"])
+        totals = costs.compute_totals(conversation["messages"])
+        if stamped:
+            conversation["totals"] = totals
+            db.save_conversation(conversation)
+        else:
+            db.update_conversation(conversation_id, totals=totals)
+        print(f"{conversation_id}: ${totals['cost_usd']:.4f} ({stamped} wiadomości z dopisanym modelem)")
+
+
+def cmd_migrate_sqlite(args):
+    """Kopiuje wszystkie konwersacje z katalogu db/ do bazy SQLite."""
+    source = storage.JsonStorage(DB_PATH)
+    target = storage.SqliteStorage(args.target)
+    conversation_ids = source.conversation_ids()
+    for conversation_id in conversation_ids:
+        target.save_conversation(source.load_conversation(conversation_id))
+
+    current_id = source.get_current_id()
+    if current_id is not None:
+        target.set_current_id(current_id)
+    print(f"Przeniesiono {len(conversation_ids)} konwersacji do {args.target}.")
+    print('Ustaw STORAGE_BACKEND = "sqlite" w config.py, aby z niej korzystać.')
+
+
+def cmd_rebuild_search(args):
+    db = storage.get_storage()
+    if db.search_index is None:
+        print("Wyszukiwarka jest wyłączona (SEARCH_INDEX = False).")
+        return
+    count = db.rebuild_search_index()
+    print(f"Zaindeksowano {count} konwersacji w {db.search_index.path}")
+
+
+def cmd_search(args):
+    db = storage.get_storage()
+    if db.search_index is None:
+        print("Wyszukiwarka jest wyłączona (SEARCH_INDEX = False).")
+        return
+    started = time.perf_counter()
+    hits = db.search_index.search(args.query, tags=args.tag, limit=args.limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    for hit in hits:
+        tags = " ".join(f"#{tag}" for tag in hit["tags"])
+        print(f"{hit['id']:>6}  {hit['score']:6.2f}  {hit['name']} {tags}")
+        if hit["snippet"]:
+            print(f"        {hit['snippet']}")
+    print(f"{len(hits)} wyników w {elapsed:.1f} ms")
+
+
+def _print_progress(text):
+    sys.stderr.write(f"\r{text}")
+    sys.stderr.flush()
+
+
+def cmd_export(args):
+    db = storage.get_storage()
+    conversation_ids = archive.select_conversations(db, args.tag)
+    output = args.output
+    if output is None:
+        EXPORTS_PATH.mkdir(parents=True, exist_ok=True)
+        output = EXPORTS_PATH / f"chatapp_all_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson.gz"
+    stats = archive.export_archive_file(
+        db, output, conversation_ids, progress=lambda done, total: _print_progress(f"{done}/{total}")
+    )
+    print(f"\nWyeksportowano {stats['conversations']} konwersacji ({stats['messages']} wiadomości) do {output}")
+
+
+def cmd_import(args):
+    db = storage.get_storage()
+
+    def progress(read_bytes, total_bytes, stats):
+        _print_progress(f"{read_bytes * 100 // max(total_bytes, 1)}% – {stats['conversations']} konwersacji")
+
+    with open(args.path, "rb") as f:
+        stats = archive.import_file(db, f, total_bytes=os.fstat(f.fileno()).st_size, progress=progress)
+    print(
+        f"\nZaimportowano {stats['conversations']} konwersacji ({stats['messages']} wiadomości), "
+        f"pominięto {stats['skipped']}"
+    )
+    for error in stats["errors"]:
+        print(f"  {error}")
+    if not stats["complete"]:
+        print("Archiwum było ucięte – zaimportowano tylko kompletne konwersacje.")
+
+
+def cmd_archive(args):
+    db = storage.get_storage()
+    if args.ids:
+        for conversation_id in args.ids:
+            db.archive_conversation(conversation_id)
+        archived = args.ids
+    else:
+        archived = db.archive_idle(args.days)
+    print(f"Zarchiwizowano {len(archived)} konwersacji: {' '.join(map(str, archived))}")
+
+
+def cmd_restore(args):
+    db = storage.get_storage()
+    for conversation_id in args.ids:
+        conversation = db.restore_conversation(conversation_id)
+        print(f"{conversation_id}: przywrócono {conversation['name']!r} ({len(conversation['messages'])} wiadomości)")
+
+
+def cmd_archived(args):
+    entries = storage.get_storage().cold.list_entries()
+    for entry in entries:
+        tags = " ".join(f"#{tag}" for tag in entry["tags"])
+        print(f"{entry['id']:>6}  {entry['archived_at']}  {entry['message_count']:>5} wiad.  {entry['name']} {tags}")
+    print(f"{len(entries)} konwersacji w archiwum")
+
+
+def cmd_delete(args):
+    db = storage.get_storage()
+    for conversation_id in args.ids:
+        deleted = db.delete_conversation(conversation_id)
+        print(f"{conversation_id}: {'usunięto' if deleted else 'nie ma takiej konwersacji'}")
+
+
+def cmd_compact_archive(args):
+    db = storage.get_storage()
+    before = db.cold.stats()
+    result = db.cold.compact(args.min_live)
+    after = db.cold.stats()
+    print(
+        f"Archiwum: przepisano/usunięto {result['segments']} segmentów, odzyskano {result['reclaimed_bytes']} B "
+        f"({before['bytes']} -> {after['bytes']} B, {after['conversations']} konwersacji)"
+    )
+    reclaimed = db.reclaim_space()
+    if reclaimed:
+        print(f"Magazyn: odzyskano {reclaimed} B")
+
+
+def _no_analytics(db):
+    if db.analytics is None:
+        print("Statystyki są wyłączone (ANALYTICS = False).")
+        return True
+    return False
+
+
+def _format_usage(row):
+    latency = f"{row['avg_latency_s']:.1f} s" if row["avg_latency_s"] is not None else "–"
+    return (
+        f"{row['requests']:>7}  {row['prompt_tokens']:>12}  {row['cached_tokens']:>9}  "
+        f"{row['completion_tokens']:>11}  {'$' + format(row['cost_usd'], '.4f'):>10}  "
+        f"{format(row['cost_pln'], '.2f') + ' zł':>12}  {latency:>8}"
+    )
+
+
+def cmd_usage(args):
+    db = storage.get_storage()
+    if _no_analytics(db):
+        return
+    since, until = analytics.period(args.days, args.since, args.until)
+    started = time.perf_counter()
+    rows = db.analytics.breakdown(args.by, since, until, model=args.model, tag=args.tag, limit=args.limit)
+    total = db.analytics.summary(since, until, model=args.model, tag=args.tag)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{args.by:<24}  zapytań  tokeny prom.    z cache  tokeny odp.   koszt USD     koszt PLN  śr. czas")
+    for row in rows:
+        key = f"{row['key']} {row['name']}" if args.by == "conversation" else str(row["key"])
+        print(f"{key[:24]:<24}  {_format_usage(row)}")
+    print(f"{'razem':<24}  {_format_usage(total)}")
+    print(f"Zakres: {since or 'początek'} – {until or 'dziś'}; {len(rows)} wierszy w {elapsed:.1f} ms")
+
+
+def cmd_rebuild_analytics(args):
+    db = storage.get_storage()
+    if _no_analytics(db):
+        return
+    count = db.rebuild_analytics()
+    print(f"Przeliczono statystyki {count} konwersacji w {db.analytics.path}")
+
+
+def cmd_batch(args):
+    api_key = args.api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        sys.exit("Podaj klucz API w OPENAI_API_KEY albo --api-key")
+    try:
+        items = batch.load_items(args.input)
+    except batch.BatchError as e:
+        sys.exit(f"Błąd pliku wejściowego: {e}")
+
+    personality = DEFAULT_PERSONALITY
+    if args.personality_file:
+        with open(args.personality_file, "r", encoding="utf-8") as f:
+            personality = f.read().strip()
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    client = clients.get_openai_client(api_key, args.base_url)
+    ratelimit.get_limiter(client).configure(rpm=args.rpm, tpm=args.tpm)
+
+    def progress(record, done, total):
+        error = f" – {record['error']}" if record.get("error") else ""
+        _print_progress(f"{done}/{total} {record['id']}: {record['status']}{error}\033[K")
+
+    summary = batch.run_batch(
+        client,
+        items,
+        output,
+        personality=personality,
+        model=args.model,
+        concurrency=args.concurrency,
+        db=storage.get_storage() if args.save else None,
+        run_name=args.run_name or f"batch {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+        progress=progress,
+    )
+    latencies = sorted(summary["latencies"])
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else 0
+    print(
+        f"\nGotowe: {summary['ok']} ok, {summary['errors']} błędów, {summary['skipped']} pominiętych "
+        f"(już w {output}) w {summary['elapsed_s']:.1f} s"
+    )
+    print(
+        f"Tokeny: {summary['prompt_tokens']} promptu, {summary['completion_tokens']} odpowiedzi; "
+        f"koszt ${summary['cost_usd']:.4f}; czas elementu p50 {p50:.1f} s, p95 {p95:.1f} s"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Zarządzanie bazą konwersacji")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("rebuild-index", help="odbuduj db/index.json z plików konwersacji")
+    p.set_defaults(func=cmd_rebuild_index)
+
+    p = subparsers.add_parser("compact", help="przenieś wiadomości do logu i usuń z niego martwe rekordy "
+                                                "(pliki zapisują się w formacie STORAGE_COMPRESSION)")
+    p.add_argument("ids", nargs="*", help="ID konwersacji (domyślnie wszystkie)")
+    p.set_defaults(func=cmd_compact)
+
+    p = subparsers.add_parser("backfill-costs", help="dopisz model i sumy kosztów do istniejących konwersacji")
+    p.set_defaults(func=cmd_backfill_costs)
+
+    p = subparsers.add_parser("migrate-sqlite", help="przenieś konwersacje z katalogu db/ do SQLite")
+    p.add_argument("--target", default=SQLITE_PATH, help="ścieżka bazy SQLite")
+    p.set_defaults(func=cmd_migrate_sqlite)
+
+    p = subparsers.add_parser("rebuild-search", help="zbuduj od nowa indeks wyszukiwarki")
+    p.set_defaults(func=cmd_rebuild_search)
+
+    p = subparsers.add_parser("search", help="szukaj w konwersacjach")
+    p.add_argument("query", nargs="?", default="")
+    p.add_argument("--tag", action="append", default=[], help="filtr tagu (można powtórzyć)")
+    p.add_argument("--limit", type=int, default=SEARCH_RESULTS_LIMIT)
+    p.set_defaults(func=cmd_search)
+
+    p = subparsers.add_parser("export", help="eksportuj konwersacje do archiwum .ndjson.gz")
+    p.add_argument("--tag", action="append", default=[], help="tylko konwersacje z tagiem (można powtórzyć)")
+    p.add_argument("--output", help="ścieżka archiwum (domyślnie exports/chatapp_all_<czas>.ndjson.gz)")
+    p.set_defaults(func=cmd_export)
+
+    p = subparsers.add_parser("import", help="importuj archiwum .ndjson.gz albo konwersację .json")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_import)
+
+    p = subparsers.add_parser("archive", help="przenieś konwersacje do archiwum (db/cold)")
+    p.add_argument("ids", nargs="*", type=int, help="ID konwersacji (domyślnie nieużywane od --days dni)")
+    p.add_argument("--days", type=int, default=COLD_AFTER_DAYS or 90)
+    p.set_defaults(func=cmd_archive)
+
+    p = subparsers.add_parser("restore", help="przywróć konwersacje z archiwum")
+    p.add_argument("ids", nargs="+", type=int)
+    p.set_defaults(func=cmd_restore)
+
+    p = subparsers.add_parser("archived", help="lista zarchiwizowanych konwersacji")
+    p.set_defaults(func=cmd_archived)
+
+    p = subparsers.add_parser("delete", help="usuń konwersacje na stałe (także z archiwum i wyszukiwarki)")
+    p.add_argument("ids", nargs="+", type=int)
+    p.set_defaults(func=cmd_delete)
+
+    p = subparsers.add_parser("compact-archive", help="przepisz segmenty archiwum z martwymi danymi "
+                                                        "i odzyskaj miejsce w magazynie")
+    p.add_argument("--min-live", type=float, default=COLD_COMPACT_MIN_LIVE,
+                   help="przepisuj segmenty, w których żywe dane to mniej niż ta część")
+    p.set_defaults(func=cmd_compact_archive)
+
+    p = subparsers.add_parser("usage", help="zużycie tokenów i koszty z podziałem na dzień, model, tag albo konwersację")
+    p.add_argument("--by", choices=analytics.DIMENSIONS, default="day")
+    p.add_argument("--days", type=int, help="ostatnie N dni (z dzisiejszym)")
+    p.add_argument("--since", help="od dnia RRRR-MM-DD")
+    p.add_argument("--until", help="do dnia RRRR-MM-DD (włącznie)")
+    p.add_argument("--model", help="tylko ten model")
+    p.add_argument("--tag", help="tylko konwersacje z tym tagiem")
+    p.add_argument("--limit", type=int, help="najwyżej tyle wierszy")
+    p.set_defaults(func=cmd_usage)
+
+    p = subparsers.add_parser("rebuild-analytics", help="przelicz statystyki od zera z historii konwersacji")
+    p.set_defaults(func=cmd_rebuild_analytics)
+
+    p = subparsers.add_parser("batch", help="przepuść plik JSONL z pytaniami przez osobowość (bez UI)")
+    p.add_argument("input", help="plik JSONL: {\"id\", \"prompt\"} albo {\"id\", \"turns\": [...]}")
+    p.add_argument("--output", help="plik wyników JSONL (domyślnie <input>.results.jsonl); wznawia przebieg")
+    p.add_argument("--personality-file", help="plik z osobowością (domyślnie DEFAULT_PERSONALITY)")
+    p.add_argument("--model", default=MODEL)
+    p.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_GENERATIONS)
+    p.add_argument("--rpm", type=int, default=RATE_LIMIT_RPM, help="limit zapytań na minutę")
+    p.add_argument("--tpm", type=int, default=RATE_LIMIT_TPM, help="limit tokenów na minutę")
+    p.add_argument("--save", action="store_true", help="zapisz każdy element jako konwersację w db/")
+    p.add_argument("--run-name", help="nazwa przebiegu (tag zapisanych konwersacji)")
+    p.add_argument("--api-key")
+    p.add_argument("--base-url", help="inny adres API, np. serwer testowy z benchmarks/stub_openai.py")
+    p.set_defaults(func=cmd_batch)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
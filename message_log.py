@@ -0,0 +1,261 @@
+"""Przechowywanie wiadomości w trybie "tylko dopisywanie".
+
+Konwersacja w trybie logu to dwa pliki:
+
+    conversations/1.json   – mały nagłówek (nazwa, osobowość, tagi, liczniki)
+    conversations/1.jsonl  – log wiadomości, jedna wiadomość na linię
+
+Nowa wiadomość to jedna dopisana linia, więc koszt zapisu nie rośnie wraz
+z długością historii. Nagłówek bez klucza "messages" oznacza tryb logu;
+stare pliki (z "messages" w nagłówku) są nadal czytane i migrowane przy
+pierwszym dopisaniu.
+
+Oba pliki kodowane są przez codec.py (szybki JSON, opcjonalna kompresja).
+Skompresowany log to ciąg ramek – każde dopisanie to jedna nowa ramka;
+długość pliku po ostatnim udanym dopisaniu trzymamy w nagłówku
+("log_size"), więc uciętą ramkę po przerwanym zapisie obcinamy przed
+kolejnym dopisaniem. Log w innym formacie niż ustawiony jest przy
+dopisaniu przepisywany raz w całości.
+"""
+import os
+from pathlib import Path
+
+import codec
+from fsutil import atomic_write, locked
+
+# rekord specjalny obcinający historię do podanej liczby wiadomości
+TRUNCATE_OP = "truncate"
+# kompaktujemy log, gdy martwych rekordów jest więcej niż żywych wiadomości
+# (i jest ich co najmniej COMPACT_MIN_GARBAGE)
+COMPACT_MIN_GARBAGE = 50
+# pola nagłówka, których nie ma w samej konwersacji
+HEADER_ONLY_FIELDS = ("message_count", "log_records", "log_size")
+
+
+def header_path(conversations_path, conversation_id):
+    return Path(conversations_path) / f"{conversation_id}.json"
+
+
+def log_path(conversations_path, conversation_id):
+    return Path(conversations_path) / f"{conversation_id}.jsonl"
+
+
+def conversation_lock(conversations_path, conversation_id):
+    """Blokada jednej konwersacji – inne konwersacje zapisują się równolegle."""
+    return locked(Path(conversations_path) / ".locks" / f"{conversation_id}.lock")
+
+
+def is_log_mode(header):
+    return "messages" not in header
+
+
+def read_header(conversations_path, conversation_id):
+    return codec.read_json(header_path(conversations_path, conversation_id))
+
+
+def write_header(conversations_path, conversation_id, header):
+    codec.write_json(header_path(conversations_path, conversation_id), header)
+
+
+def update_header(conversations_path, conversation_id, **fields):
+    """Aktualizuje pola nagłówka – w trybie logu nie dotyka wiadomości."""
+    with conversation_lock(conversations_path, conversation_id):
+        header = read_header(conversations_path, conversation_id)
+        header.update(fields)
+        write_header(conversations_path, conversation_id, header)
+    return header
+
+
+def iter_log(conversations_path, conversation_id):
+    """Strumieniowo czyta rekordy logu; pomija uciętą ostatnią linię (ramkę)."""
+    path = log_path(conversations_path, conversation_id)
+    if not path.exists():
+        return
+    with open(path, "rb") as f:
+        if codec.detect(f.read(4)):
+            f.seek(0)
+            lines = codec.decompress(f.read(), tolerant=True).splitlines()
+        else:
+            f.seek(0)
+            lines = f
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield codec.loads(line)
+            except ValueError:
+                # niedokończony zapis (np. przerwany proces) – kompaktacja go usunie
+                continue
+
+
+def read_messages(conversations_path, conversation_id):
+    """Odtwarza listę wiadomości, odtwarzając log od początku."""
+    messages = []
+    for record in iter_log(conversations_path, conversation_id):
+        if record.get("_op") == TRUNCATE_OP:
+            del messages[record["count"]:]
+        else:
+            messages.append(record)
+    return messages
+
+
+def load_conversation(conversations_path, conversation_id):
+    """Wczytuje pełną konwersację (nagłówek + wiadomości) w obu formatach."""
+    header = read_header(conversations_path, conversation_id)
+    if not is_log_mode(header):
+        return header
+
+    conversation = {k: v for k, v in header.items() if k not in HEADER_ONLY_FIELDS}
+    conversation["messages"] = read_messages(conversations_path, conversation_id)
+    return conversation
+
+
+def _encode_log(records):
+    return codec.encode(b"".join(codec.dumps_line(r) for r in records))
+
+
+def _write_log(conversations_path, conversation_id, records, header):
+    data = _encode_log(records)
+    atomic_write(log_path(conversations_path, conversation_id), data)
+    _set_log_size(header, len(data))
+
+
+def _set_log_size(header, size):
+    if codec.COMPRESSION:
+        header["log_size"] = size
+    else:
+        header.pop("log_size", None)
+
+
+def _append_records(conversations_path, conversation_id, records, header):
+    path = log_path(conversations_path, conversation_id)
+    size = path.stat().st_size if path.exists() else 0
+    log_format = None
+    if size:
+        with open(path, "rb") as f:
+            log_format = codec.detect(f.read(4))
+
+    if size and log_format != codec.COMPRESSION:
+        # log zapisany w innym formacie (zmiana STORAGE_COMPRESSION) – przepisujemy go
+        existing = list(iter_log(conversations_path, conversation_id))
+        _write_log(conversations_path, conversation_id, existing + records, header)
+        return
+
+    if log_format:
+        # ramka uciętego zapisu psułaby kolejne – wracamy do ostatniego udanego
+        known_size = header.get("log_size")
+        if known_size is not None and known_size < size:
+            os.truncate(path, known_size)
+            size = known_size
+    data = _encode_log(records)
+    if size and not log_format:
+        # jeśli poprzedni zapis został ucięty, zaczynamy od nowej linii
+        with open(path, "rb") as f:
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+
+    with open(path, "ab") as f:
+        f.write(data)
+    _set_log_size(header, size + len(data))
+
+
+def write_conversation(conversations_path, conversation, log_mode=True):
+    """Zapisuje całą konwersację od zera (nowa konwersacja, import)."""
+    conversation_id = conversation["id"]
+    if not log_mode:
+        with conversation_lock(conversations_path, conversation_id):
+            write_header(conversations_path, conversation_id, conversation)
+        return
+
+    messages = conversation.get("messages", [])
+    header = {k: v for k, v in conversation.items() if k != "messages"}
+    header["message_count"] = len(messages)
+    header["log_records"] = len(messages)
+
+    with conversation_lock(conversations_path, conversation_id):
+        _write_log(conversations_path, conversation_id, messages, header)
+        write_header(conversations_path, conversation_id, header)
+
+
+def migrate_to_log(conversations_path, conversation_id):
+    """Przenosi wiadomości ze starego pliku JSON do logu."""
+    with conversation_lock(conversations_path, conversation_id):
+        conversation = read_header(conversations_path, conversation_id)
+        if not is_log_mode(conversation):
+            write_conversation(conversations_path, conversation, log_mode=True)
+            conversation = read_header(conversations_path, conversation_id)
+    return conversation
+
+
+def append_messages(conversations_path, conversation_id, messages, keep=None, on_header=None):
+    """Dopisuje wiadomości do logu.
+
+    `keep` – jeśli podane i mniejsze niż liczba zapisanych wiadomości,
+    historia jest najpierw obcinana do `keep` wiadomości (rekord truncate).
+    `on_header(header, truncated)` może zmienić nagłówek (np. sumy
+    kosztów) pod tą samą blokadą i w tym samym zapisie.
+    Zwraca zaktualizowany nagłówek.
+    """
+    with conversation_lock(conversations_path, conversation_id):
+        header = migrate_to_log(conversations_path, conversation_id)
+
+        records = []
+        message_count = header.get("message_count", 0)
+        truncated = keep is not None and keep < message_count
+        if truncated:
+            records.append({"_op": TRUNCATE_OP, "count": keep})
+            message_count = keep
+        records.extend(messages)
+        if not records:
+            return header
+
+        _append_records(conversations_path, conversation_id, records, header)
+
+        header["message_count"] = message_count + len(messages)
+        header["log_records"] = header.get("log_records", 0) + len(records)
+        if on_header:
+            on_header(header, truncated)
+        write_header(conversations_path, conversation_id, header)
+
+        if needs_compaction(header):
+            header = compact(conversations_path, conversation_id)
+    return header
+
+
+def needs_compaction(header):
+    garbage = header.get("log_records", 0) - header.get("message_count", 0)
+    return garbage >= COMPACT_MIN_GARBAGE and garbage > header.get("message_count", 0)
+
+
+def compact(conversations_path, conversation_id):
+    """Przepisuje log tak, by zawierał tylko żywe wiadomości."""
+    with conversation_lock(conversations_path, conversation_id):
+        messages = read_messages(conversations_path, conversation_id)
+        header = read_header(conversations_path, conversation_id)
+
+        _write_log(conversations_path, conversation_id, messages, header)
+
+        header["message_count"] = len(messages)
+        header["log_records"] = len(messages)
+        write_header(conversations_path, conversation_id, header)
+    return header
+
+
+def delete_conversation(conversations_path, conversation_id):
+    """Usuwa pliki konwersacji (nagłówek, log i plik blokady); zwraca, czy istniała."""
+    with conversation_lock(conversations_path, conversation_id):
+        existed = False
+        for path in (header_path(conversations_path, conversation_id), log_path(conversations_path, conversation_id)):
+            try:
+                path.unlink()
+                existed = True
+            except FileNotFoundError:
+                pass
+        # blokada nie jest już potrzebna – inaczej .locks rósłby z każdą usuniętą konwersacją;
+        # usuwamy ją, trzymając flock, a czekający na stary plik biorą nowy (fsutil._flock)
+        try:
+            (Path(conversations_path) / ".locks" / f"{conversation_id}.lock").unlink()
+        except FileNotFoundError:
+            pass
+    return existed
@@ -0,0 +1,283 @@
+"""Lekka instrumentacja: spany rerunu, histogramy i liczniki.
+
+- span("history_render") – czas fazy rerunu; trafia do histogramu
+  chatapp_span_seconds i do listy spanów bieżącego rerunu (panel
+  diagnostyki w sidebarze pokazuje poprzedni rerun),
+- observe() / inc() – histogramy i liczniki z etykietami,
+- register_collector() – wartości liczone dopiero przy eksporcie (np.
+  statystyki cache),
+- render_prometheus() – format tekstowy Prometheusa; zapis do pliku
+  (METRICS_EXPORT_PATH) albo endpoint http://127.0.0.1:METRICS_PORT/metrics.
+
+Przy METRICS = False wszystkie funkcje wracają od razu, a span() zwraca
+wspólny pusty context manager – narzut to jedno wywołanie funkcji.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS, METRICS_EXPORT_PATH, METRICS_EXPORT_INTERVAL, METRICS_PORT
+
+ENABLED = METRICS
+
+# granice kubełków w sekundach – od szybkich operacji dyskowych do długich odpowiedzi API
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 300)
+
+HELP = {
+    "chatapp_span_seconds": "Czas faz rerunu aplikacji",
+    "chatapp_api_ttfb_seconds": "Czas do pierwszego tokenu odpowiedzi API",
+    "chatapp_api_total_seconds": "Całkowity czas zapytania do API",
+    "chatapp_api_tokens_per_second": "Tempo generowania tokenów odpowiedzi",
+    "chatapp_api_requests_total": "Zapytania do API",
+    "chatapp_summary_total": "Podsumowania historii w tle (status: ok, error)",
+    "chatapp_api_tokens_total": "Tokeny zużyte w zapytaniach do API (cached – część promptu z cache API)",
+    "chatapp_api_retries_total": "Ponowione zapytania do API",
+    "chatapp_api_hedges_total": "Zapasowe (hedged) zapytania do API",
+    "chatapp_api_fallbacks_total": "Przejścia na model awaryjny",
+    "chatapp_ratelimit_wait_seconds": "Czas oczekiwania w kolejce limitu API",
+    "chatapp_ratelimit_queue_depth": "Zapytania czekające na limit API",
+    "chatapp_ratelimit_oldest_wait_seconds": "Najdłuższe bieżące oczekiwanie na limit API",
+    "chatapp_ratelimit_spent_today_usd": "Koszt zapytań od północy (USD)",
+    "chatapp_file_writes_total": "Atomowe zapisy plików",
+    "chatapp_file_written_bytes_total": "Bajty zapisane atomowo na dysk",
+    "chatapp_response_cache_total": "Trafienia i chybienia cache odpowiedzi",
+    "chatapp_render_cache_hits": "Trafienia cache renderowania markdown",
+    "chatapp_render_cache_misses": "Chybienia cache renderowania markdown",
+    "chatapp_render_cache_entries": "Wpisy w cache renderowania markdown",
+    "chatapp_cached_clients": "Klienci OpenAI w cache procesu",
+    "chatapp_retired_clients": "Klienci usunięci z cache, czekający na koniec trwających zapytań",
+    "chatapp_conversation_cache_hits": "Trafienia cache konwersacji",
+    "chatapp_conversation_cache_misses": "Chybienia cache konwersacji (odczyt z magazynu)",
+    "chatapp_conversation_cache_stale": "Wpisy cache konwersacji unieważnione zmianą wersji",
+    "chatapp_conversation_cache_evictions": "Konwersacje wypchnięte z cache przez limit rozmiaru",
+    "chatapp_conversation_cache_prefetched": "Konwersacje wczytane w tle (prefetch)",
+    "chatapp_conversation_cache_entries": "Konwersacje w cache procesu",
+    "chatapp_conversation_cache_bytes": "Szacowany rozmiar konwersacji w cache (bajty)",
+    "chatapp_retrieval_indexes": "Indeksy przywoływania wiadomości w pamięci procesu",
+    "chatapp_retrieval_indexed_messages": "Wiadomości w indeksach przywoływania",
+    "chatapp_retrieval_index_bytes": "Rozmiar tablic indeksów przywoływania (bajty)",
+    "chatapp_cold_conversations": "Konwersacje w archiwum",
+    "chatapp_cold_segments": "Segmenty archiwum",
+    "chatapp_cold_bytes": "Rozmiar segmentów archiwum (bajty)",
+    "chatapp_cold_live_bytes": "Bajty żywych konwersacji w segmentach archiwum",
+    "chatapp_cold_archived_total": "Konwersacje zarchiwizowane automatycznie",
+    "chatapp_cold_reclaimed_bytes_total": "Bajty odzyskane kompaktacją archiwum",
+    "chatapp_active_generations": "Odpowiedzi generowane teraz w procesie",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+_local = threading.local()
+_last_export = 0.0
+_server = None
+_noop = nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Przybliżony kwantyl – górna granica kubełka, w którym wypada."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+
+@contextmanager
+def _span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe("chatapp_span_seconds", elapsed, span=name)
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append((name, elapsed * 1000))
+
+
+def span(name):
+    """Context manager mierzący fazę `name` (pusty, gdy metryki są wyłączone)."""
+    if not ENABLED:
+        return _noop
+    return _span(name)
+
+
+def begin_rerun():
+    """Zaczyna zbieranie spanów rerunu w tym wątku; zwraca listę (nazwa, ms).
+
+    Lista jest uzupełniana w miejscu, więc zostaje kompletna także wtedy,
+    gdy rerun kończy się przez st.rerun() albo st.stop().
+    """
+    spans = []
+    if ENABLED:
+        _local.spans = spans
+    return spans
+
+
+def record_api_call(model, timing, usage, interrupted=False):
+    """Histogramy czasu i tempa tokenów dla jednego zapytania do API."""
+    if not ENABLED:
+        return
+    status = "interrupted" if interrupted else "ok"
+    inc("chatapp_api_requests_total", model=model, status=status)
+    observe("chatapp_api_ttfb_seconds", timing["ttft_s"], model=model)
+    observe("chatapp_api_total_seconds", timing["total_s"], model=model)
+    completion_tokens = (usage or {}).get("completion_tokens", 0)
+    for kind in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+        inc("chatapp_api_tokens_total", (usage or {}).get(kind, 0), model=model, kind=kind.split("_")[0])
+    generating = timing["total_s"] - timing["ttft_s"]
+    if completion_tokens and generating > 0:
+        observe("chatapp_api_tokens_per_second", completion_tokens / generating, buckets=RATE_BUCKETS, model=model)
+
+
+def register_collector(fn):
+    """`fn()` zwraca listę (nazwa, etykiety, wartość) – gauge liczone przy eksporcie."""
+    _collectors.append(fn)
+    return fn
+
+
+def snapshot():
+    """Kopia liczników i histogramów do panelu diagnostyki."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: {
+                "count": h.count,
+                "sum": h.sum,
+                "p50": h.quantile(0.5),
+                "p95": h.quantile(0.95),
+            }
+            for key, h in _histograms.items()
+        }
+    gauges = {}
+    for collector in _collectors:
+        for name, labels, value in collector():
+            gauges[_key(name, labels)] = value
+    return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _header(lines, seen, name, kind):
+    if name in seen:
+        return
+    seen.add(name)
+    if name in HELP:
+        lines.append(f"# HELP {name} {HELP[name]}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def render_prometheus():
+    """Wszystkie metryki w formacie tekstowym Prometheusa."""
+    lines = []
+    seen = set()
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            _header(lines, seen, name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), h in sorted(_histograms.items()):
+            _header(lines, seen, name, "histogram")
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {h.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {h.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {h.count}")
+    for collector in _collectors:
+        for name, labels, value in collector():
+            _header(lines, seen, name, "gauge")
+            lines.append(f"{name}{_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def export_if_due(path=METRICS_EXPORT_PATH, interval=METRICS_EXPORT_INTERVAL):
+    """Zapisuje metryki do pliku (dla node_exporter textfile), najwyżej co `interval` s."""
+    global _last_export
+    if not ENABLED or not path:
+        return
+    now = time.monotonic()
+    if now - _last_export < interval:
+        return
+    _last_export = now
+    from fsutil import atomic_write
+    atomic_write(path, render_prometheus())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(port=METRICS_PORT, host="127.0.0.1"):
+    """Uruchamia (raz na proces) endpoint /metrics na lokalnym porcie."""
+    global _server
+    if not ENABLED or not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+    return _server
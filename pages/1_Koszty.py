@@ -0,0 +1,85 @@
+"""Strona "Koszty": zużycie tokenów i wydatki ze wszystkich konwersacji.
+
+Czyta gotowe sumy z analytics.py (aktualizowane przy każdym zapisie),
+więc nie wczytuje żadnej konwersacji.
+"""
+from datetime import date, timedelta
+
+import streamlit as st
+
+import analytics
+import storage
+from config import STORAGE_BACKEND, USD_TO_PLN
+
+PERIODS = {"7 dni": 7, "30 dni": 30, "90 dni": 90, "Od początku": None}
+
+
+def _usage_table(rows, label):
+    return [
+        {
+            label: row["key"] if label != "Konwersacja" else f"{row['key']}. {row['name']}",
+            "Zapytania": row["requests"],
+            "Tokeny promptu": row["prompt_tokens"],
+            "Z cache": row["cached_tokens"],
+            "Tokeny odpowiedzi": row["completion_tokens"],
+            "Koszt (USD)": round(row["cost_usd"], 4),
+            "Koszt (PLN)": round(row["cost_pln"], 2),
+            "Śr. czas (s)": round(row["avg_latency_s"], 2) if row["avg_latency_s"] is not None else None,
+        }
+        for row in rows
+    ]
+
+
+st.title("Koszty")
+db = storage.get_storage(STORAGE_BACKEND)
+if db.analytics is None:
+    st.info("Statystyki są wyłączone (ANALYTICS = False w config.py).")
+    st.stop()
+store = db.analytics
+
+col1, col2, col3 = st.columns([3, 2, 2])
+with col1:
+    period = st.radio("Okres", list(PERIODS), index=1, horizontal=True)
+with col2:
+    model = st.selectbox("Model", ["Wszystkie", *store.models()])
+with col3:
+    tag = st.selectbox("Tag", ["Wszystkie", *store.tags()])
+since, until = analytics.period(PERIODS[period])
+filters = {
+    "since": since,
+    "until": until,
+    "model": None if model == "Wszystkie" else model,
+    "tag": None if tag == "Wszystkie" else tag,
+}
+
+total = store.summary(**filters)
+c0, c1, c2, c3 = st.columns(4)
+c0.metric("Koszt (USD)", f"${total['cost_usd']:.4f}")
+c1.metric("Koszt (PLN)", f"{total['cost_pln']:.2f}")
+c2.metric("Zapytania", total["requests"])
+c3.metric("Śr. czas odpowiedzi", f"{total['avg_latency_s']:.1f} s" if total["avg_latency_s"] is not None else "–")
+st.caption(
+    f"Tokeny: {total['prompt_tokens']} promptu (w tym {total['cached_tokens']} z cache API), "
+    f"{total['completion_tokens']} odpowiedzi. Kurs: 1 USD = {USD_TO_PLN} PLN."
+)
+
+days = store.breakdown("day", **filters)
+if not days:
+    st.info("Brak odpowiedzi w wybranym okresie.")
+    st.stop()
+spent = {row["key"]: row["cost_usd"] for row in days}
+keys = list(spent)
+if since:
+    # dni bez zapytań też na wykresie
+    first = date.fromisoformat(since)
+    keys = [(first + timedelta(days=i)).isoformat() for i in range((date.today() - first).days + 1)]
+st.subheader("Koszt dziennie (USD)")
+st.bar_chart({"Dzień": keys, "Koszt (USD)": [spent.get(key, 0.0) for key in keys]}, x="Dzień", y="Koszt (USD)")
+
+st.subheader("Modele")
+st.dataframe(_usage_table(store.breakdown("model", **filters), "Model"), hide_index=True)
+st.subheader("Tagi")
+st.caption("Konwersacja z kilkoma tagami liczy się w każdym z nich; tagi według stanu obecnego.")
+st.dataframe(_usage_table(store.breakdown("tag", **filters), "Tag"), hide_index=True)
+st.subheader("Najdroższe konwersacje")
+st.dataframe(_usage_table(store.breakdown("conversation", limit=20, **filters), "Konwersacja"), hide_index=True)
@@ -0,0 +1,284 @@
+"""Limiter zapytań i tokenów do API – wspólny dla procesu, osobny na klucz API.
+
+Każdy klucz ma dwa kubełki tokenów (token bucket): zapytań na minutę
+(RATE_LIMIT_RPM) i tokenów na minutę (RATE_LIMIT_TPM). Zapytanie pobiera
+z góry 1 zapytanie i szacowaną liczbę tokenów – prompt liczony tak samo jak
+przy budowie kontekstu (tokens.prompt_tokens) plus przewidywana długość
+odpowiedzi – a po odpowiedzi różnica jest korygowana według `usage`.
+
+Gdy limitu brakuje, zapytanie czeka w kolejce zamiast dostać 429.
+Kolejka jest sprawiedliwa między sesjami: każda sesja ma własną kolejkę
+FIFO, a kolejne zapytania wychodzą po jednym z każdej sesji na zmianę,
+więc jedna sesja z serią zapytań nie blokuje pozostałych.
+
+Opcjonalny dzienny limit kosztu (DAILY_COST_LIMIT_USD, cennik z
+model_pricings) odrzuca zapytania po jego wyczerpaniu – do północy.
+Stan jest w pamięci procesu. Limiter klucza nieużywanego dłużej niż
+CLIENT_CACHE_IDLE_TTL (jak klient w clients.py) jest usuwany, gdy nie ma
+czekających ani niezakończonych zapytań, kubełki są pełne i nic dziś nie
+wydano – nowy limiter zaczyna wtedy od tego samego stanu.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date
+
+import costs
+import metrics
+import tokens
+from config import (
+    CLIENT_CACHE_IDLE_TTL,
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    RATE_LIMIT_COMPLETION_ESTIMATE,
+    RATE_LIMIT_MAX_WAIT,
+    DAILY_COST_LIMIT_USD,
+)
+
+# co ile sekund czekający sprawdzają anulowanie i swoją kolejkę
+POLL_INTERVAL = 0.1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    """Dzienny limit kosztu dla klucza API jest wyczerpany."""
+
+
+class RateLimitTimeout(Exception):
+    """Zapytanie czekało w kolejce dłużej niż RATE_LIMIT_MAX_WAIT."""
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute or 0)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Ile sekund do uzbierania `amount` (większe niż pojemność – do pełna)."""
+        if not self.capacity:
+            return 0.0
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) * 60 / self.capacity
+
+    def take(self, amount):
+        # może zejść poniżej zera (dług) – korekta po faktycznym usage
+        if self.capacity:
+            self.level -= amount
+
+
+class Ticket:
+    def __init__(self, session, tokens, model, waited_s):
+        self.session = session
+        self.tokens = tokens
+        self.model = model
+        self.waited_s = waited_s
+
+
+class _Waiter:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.started = time.monotonic()
+
+
+def estimate_tokens(messages, model, completion_estimate=RATE_LIMIT_COMPLETION_ESTIMATE):
+    """Tokeny pobierane z limitu przed zapytaniem: prompt + przewidywana odpowiedź."""
+    return tokens.prompt_tokens(messages, model) + completion_estimate
+
+
+def estimate_cost(estimated_tokens, model, completion_estimate=RATE_LIMIT_COMPLETION_ESTIMATE):
+    completion = min(completion_estimate, estimated_tokens)
+    return costs.message_cost({
+        "model": model,
+        "usage": {"prompt_tokens": estimated_tokens - completion, "completion_tokens": completion},
+    })
+
+
+class RateLimiter:
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, daily_cost_limit=DAILY_COST_LIMIT_USD,
+                 max_wait=RATE_LIMIT_MAX_WAIT):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.daily_cost_limit = daily_cost_limit
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        # sesja -> kolejka FIFO czekających; pierwsza sesja jest obsługiwana teraz
+        self._queues = OrderedDict()
+        self._day = date.today()
+        self._spent = 0.0
+        # przydzielone, jeszcze nierozliczone zapytania (acquire bez settle)
+        self._open = 0
+        self.used = time.monotonic()
+        self.granted = 0
+        self.total_wait_s = 0.0
+        self.last_wait_s = 0.0
+
+    def configure(self, rpm=None, tpm=None):
+        """Zmienia limity klucza (np. z opcji trybu wsadowego); pełne kubełki."""
+        with self._cond:
+            self.requests = _Bucket(rpm)
+            self.tokens = _Bucket(tpm)
+            self._cond.notify_all()
+
+    def _head(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _remove(self, session, waiter):
+        queue = self._queues[session]
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[session]
+        self._cond.notify_all()
+
+    def _roll_day(self):
+        today = date.today()
+        if today != self._day:
+            self._day, self._spent = today, 0.0
+
+    def acquire(self, session, estimated_tokens, model, cancel_event=None):
+        """Czeka na swoją kolejkę i limit; zwraca Ticket albo None po anulowaniu."""
+        with self._cond:
+            self._roll_day()
+            if self.daily_cost_limit is not None:
+                if self._spent + estimate_cost(estimated_tokens, model) > self.daily_cost_limit:
+                    raise BudgetExceeded(
+                        f"dzienny limit kosztu ${self.daily_cost_limit:.2f} wyczerpany "
+                        f"(wydano ${self._spent:.4f})"
+                    )
+
+            waiter = _Waiter(estimated_tokens)
+            self._queues.setdefault(session, deque()).append(waiter)
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    self._remove(session, waiter)
+                    return None
+
+                now = time.monotonic()
+                delay = POLL_INTERVAL
+                if self._head() is waiter:
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    delay = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                    if delay <= 0:
+                        break
+                if now - waiter.started + delay > self.max_wait:
+                    self._remove(session, waiter)
+                    raise RateLimitTimeout(f"limit zapytań API – kolejka dłuższa niż {self.max_wait:g} s")
+                self._cond.wait(min(delay, POLL_INTERVAL))
+
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+            self._remove(session, waiter)
+            if session in self._queues:
+                # kolejne zapytanie tej sesji dopiero po innych sesjach
+                self._queues.move_to_end(session)
+            self.used = time.monotonic()
+            waited = self.used - waiter.started
+            self._open += 1
+            self.granted += 1
+            self.total_wait_s += waited
+            self.last_wait_s = waited
+        metrics.observe("chatapp_ratelimit_wait_seconds", waited)
+        return Ticket(session, estimated_tokens, model, waited)
+
+    def settle(self, ticket, usage=None, requests=1, model=None):
+        """Koryguje limit i koszt dnia według faktycznego `usage` (i liczby zapytań)."""
+        model = model or ticket.model
+        with self._cond:
+            if usage:
+                self.tokens.take(usage.get("total_tokens", 0) - ticket.tokens)
+                self._roll_day()
+                self._spent += costs.message_cost({"usage": usage, "model": model})
+            # ponowienia i zapytania zapasowe też liczą się do RPM
+            self.requests.take(max(requests - 1, 0))
+            self._open -= 1
+            self.used = time.monotonic()
+            self._cond.notify_all()
+
+    def is_idle(self, now, idle_ttl):
+        """Czy limiter można usunąć bez utraty stanu (zob. opis modułu)."""
+        with self._cond:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self._roll_day()
+            return (
+                now - self.used > idle_ttl
+                and not self._queues
+                and not self._open
+                and not self._spent
+                and self.requests.level >= (self.requests.capacity or 0)
+                and self.tokens.level >= (self.tokens.capacity or 0)
+            )
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self._roll_day()
+            waiters = [w for queue in self._queues.values() for w in queue]
+            return {
+                "queue_depth": len(waiters),
+                "waiting_sessions": len(self._queues),
+                "oldest_wait_s": max((now - w.started for w in waiters), default=0.0),
+                "last_wait_s": self.last_wait_s,
+                "avg_wait_s": self.total_wait_s / self.granted if self.granted else 0.0,
+                "granted": self.granted,
+                "requests_available": self.requests.level if self.requests.capacity else None,
+                "tokens_available": self.tokens.level if self.tokens.capacity else None,
+                "spent_today_usd": self._spent,
+                "daily_cost_limit_usd": self.daily_cost_limit,
+            }
+
+
+def _key(client):
+    # w kluczach nie trzymamy jawnego klucza API
+    return hashlib.sha256(f"{client.base_url}|{client.api_key}".encode()).hexdigest()
+
+
+def _evict(now):
+    """Usuwa bezczynne limitery (wywoływane pod blokadą)."""
+    for key, limiter in list(_limiters.items()):
+        # najpierw tani test bez blokady limitera
+        if now - limiter.used > CLIENT_CACHE_IDLE_TTL and limiter.is_idle(now, CLIENT_CACHE_IDLE_TTL):
+            del _limiters[key]
+
+
+def get_limiter(client):
+    """Limiter klucza API klienta (jeden na proces)."""
+    key = _key(client)
+    now = time.monotonic()
+    with _limiters_lock:
+        _evict(now)
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter()
+        # pobrany limiter nie zniknie przed acquire wywołującego
+        limiter.used = now
+        return limiter
+
+
+@metrics.register_collector
+def _limiter_metrics():
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    values = []
+    for key, limiter in limiters:
+        stats = limiter.stats()
+        labels = {"key": key[:8]}
+        values += [
+            ("chatapp_ratelimit_queue_depth", labels, stats["queue_depth"]),
+            ("chatapp_ratelimit_oldest_wait_seconds", labels, stats["oldest_wait_s"]),
+            ("chatapp_ratelimit_spent_today_usd", labels, stats["spent_today_usd"]),
+        ]
+    return values
@@ -0,0 +1,37 @@
+"""Przygotowanie treści wiadomości do wyświetlenia w czacie.
+
+Wynik jest cache'owany po treści wiadomości, więc przy kolejnych rerunach
+niezmienione wiadomości nie są ponownie przetwarzane.
+"""
+from functools import lru_cache
+
+import metrics
+from config import RENDER_CACHE_SIZE
+
+CODE_FENCE = "```"
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_markdown(content):
+    """Normalizuje markdown wiadomości (końce linii, niedomknięte bloki kodu)."""
+    text = content.replace("\r\n", "\n")
+    # ucięta odpowiedź z otwartym blokiem kodu "połknęłaby" resztę strony
+    fences = sum(1 for line in text.split("\n") if line.lstrip().startswith(CODE_FENCE))
+    if fences % 2:
+        text += "\n" + CODE_FENCE
+    return text
+
+
+@metrics.register_collector
+def _cache_metrics():
+    info = render_markdown.cache_info()
+    return [
+        ("chatapp_render_cache_hits", {}, info.hits),
+        ("chatapp_render_cache_misses", {}, info.misses),
+        ("chatapp_render_cache_entries", {}, info.currsize),
+    ]
+
+
+def visible_range(message_count, window):
+    """Indeks pierwszej wyświetlanej wiadomości przy oknie `window` ostatnich."""
+    return max(message_count - window, 0)
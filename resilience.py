@@ -0,0 +1,308 @@
+"""Ponawianie, limity czasu, zapytania zapasowe (hedging) i model awaryjny.
+
+`stream_reply` działa jak `chatbot.stream_reply`, ale pojedyncze zapytanie
+do API zastępuje polityką (RetryPolicy):
+
+- limit czasu próby – `first_token_timeout` na pierwszy token i
+  `read_timeout` na połączenie oraz każdy kolejny odczyt ze strumienia,
+- ponawianie błędów przejściowych (429, 408/409, 5xx, zerwane połączenie,
+  timeout) z wykładniczym opóźnieniem z losowym rozrzutem (full jitter),
+  a przy 429/503 z nagłówkiem Retry-After – nie krócej, niż każe serwer,
+- hedging (opcjonalnie) – gdy pierwszy token nie przyszedł w czasie
+  typowym dla `hedge_percentile` ostatnich zapytań, wysyłamy drugie
+  równoległe; wygrywa szybsze, przegrane jest zamykane,
+- model awaryjny – po wyczerpaniu prób (albo 404 modelu) przechodzimy na
+  kolejny model z `fallback_models`, np. gpt-4o -> gpt-4o-mini.
+
+Ponawiamy tylko do pierwszego tokenu: gdy użytkownik widzi już część
+odpowiedzi, zerwany strumień kończy się odpowiedzią przerwaną, a nie
+drugą, inną wersją. W `reply` zapisywany jest użyty model, liczba prób
+i to, czy wygrało zapytanie zapasowe.
+"""
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+
+import chatbot
+import metrics
+from config import (
+    API_MAX_ATTEMPTS,
+    API_FIRST_TOKEN_TIMEOUT,
+    API_READ_TIMEOUT,
+    API_BACKOFF_BASE,
+    API_BACKOFF_MAX,
+    API_RETRY_AFTER_MAX,
+    API_HEDGE,
+    API_HEDGE_PERCENTILE,
+    API_HEDGE_DELAY,
+    API_HEDGE_MIN_SAMPLES,
+    API_FALLBACK_MODELS,
+    MAX_CONCURRENT_GENERATIONS,
+)
+
+RETRY = "retry"
+FALLBACK = "fallback"
+FATAL = "fatal"
+
+RETRYABLE_STATUSES = (408, 409, 429)
+# co ile sekund czekanie na pierwszy token sprawdza anulowanie (i start próby z kolejki puli)
+CANCEL_POLL_INTERVAL = 0.1
+# ile ostatnich czasów do pierwszego tokenu pamiętamy (na model) do progu hedgingu
+LATENCY_WINDOW = 200
+
+# próby czekające na pierwszy token (po dwie na generowaną odpowiedź przy hedgingu)
+_attempts = ThreadPoolExecutor(max_workers=2 * MAX_CONCURRENT_GENERATIONS, thread_name_prefix="api-attempt")
+_latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+_latencies_lock = threading.Lock()
+
+
+class FirstTokenTimeout(Exception):
+    """Pierwszy token nie przyszedł w `first_token_timeout` sekund."""
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=API_MAX_ATTEMPTS, first_token_timeout=API_FIRST_TOKEN_TIMEOUT,
+                 read_timeout=API_READ_TIMEOUT, backoff_base=API_BACKOFF_BASE, backoff_max=API_BACKOFF_MAX,
+                 retry_after_max=API_RETRY_AFTER_MAX, hedge=API_HEDGE, hedge_percentile=API_HEDGE_PERCENTILE,
+                 hedge_delay=API_HEDGE_DELAY, hedge_min_samples=API_HEDGE_MIN_SAMPLES,
+                 fallback_models=API_FALLBACK_MODELS, rng=None):
+        self.max_attempts = max_attempts
+        self.first_token_timeout = first_token_timeout
+        self.read_timeout = read_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.fallback_models = fallback_models or {}
+        self.rng = rng or random.Random()
+
+    def models(self, model):
+        """Model i kolejne modele awaryjne (bez powtórzeń)."""
+        chain = [model]
+        while self.fallback_models.get(chain[-1]) and self.fallback_models[chain[-1]] not in chain:
+            chain.append(self.fallback_models[chain[-1]])
+        return chain
+
+    def backoff(self, attempt, error):
+        """Opóźnienie przed próbą `attempt + 1` (full jitter, co najmniej Retry-After)."""
+        delay = self.rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.retry_after_max))
+        return delay
+
+    def hedge_after(self, model):
+        """Po ilu sekundach bez pierwszego tokenu wysłać zapytanie zapasowe."""
+        with _latencies_lock:
+            samples = sorted(_latencies[model])
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_delay
+        return samples[min(int(len(samples) * self.hedge_percentile), len(samples) - 1)]
+
+
+def classify(error):
+    """RETRY, FALLBACK (spróbuj innego modelu) albo FATAL (nie ponawiaj)."""
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code in RETRYABLE_STATUSES or error.status_code >= 500:
+            return RETRY
+        if error.status_code == 404:
+            return FALLBACK
+        return FATAL
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, FirstTokenTimeout)):
+        return RETRY
+    return FATAL
+
+
+def retry_after_seconds(error):
+    """Wartość nagłówka Retry-After (sekundy albo data HTTP), jeśli serwer go podał."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def record_first_token(model, seconds):
+    with _latencies_lock:
+        _latencies[model].append(seconds)
+
+
+class _Attempt:
+    """Jedno zapytanie do API czekające (w puli `_attempts`) na pierwszy token."""
+
+    def __init__(self, client, model, messages, policy, on_open, hedged=False):
+        self.model = model
+        self.hedged = hedged
+        self.reply = {}
+        # ustawiane, gdy wątek puli faktycznie zaczyna zapytanie – czas w kolejce się nie liczy
+        self.started = None
+        self._stream = None
+        self._aborted = False
+        self._on_open = on_open
+        self.generator = chatbot.stream_reply(
+            client, model, messages, self.reply, on_open=self._set_stream, timeout=policy.read_timeout
+        )
+        self.future = _attempts.submit(self._first)
+
+    def _first(self):
+        self.started = time.perf_counter()
+        return next(self.generator, None)
+
+    def _set_stream(self, stream):
+        self._stream = stream
+        if self._on_open:
+            self._on_open(stream)
+        if self._aborted:
+            stream.close()
+
+    def abort(self):
+        """Przerywa próbę; generator sprzątamy, gdy wątek puli go odda."""
+        self._aborted = True
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+        self.future.add_done_callback(lambda _: self.generator.close())
+
+
+def _first_token(client, model, messages, policy, on_open, cancel_event):
+    """Czeka na pierwszy token (z ewentualnym hedgingiem); zwraca (próbę, token, liczba zapytań).
+
+    Limit czasu i próg hedgingu liczą się od startu pierwszej próby w puli
+    `_attempts` – czekanie w jej kolejce (np. batch z dużym --concurrency)
+    nie kończy się fałszywym FirstTokenTimeout.
+    """
+    primary = _Attempt(client, model, messages, policy, on_open)
+    pending = [primary]
+    deadline = hedge_at = None
+    requests = 1
+    error = None
+
+    while pending:
+        now = time.perf_counter()
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if deadline is None and primary.started is not None:
+            deadline = primary.started + policy.first_token_timeout
+            hedge_at = primary.started + policy.hedge_after(model) if policy.hedge else None
+        if deadline is not None and now >= deadline:
+            error = FirstTokenTimeout(f"brak pierwszego tokenu po {policy.first_token_timeout:g} s")
+            break
+        if hedge_at is not None and now >= hedge_at:
+            hedge_at = None
+            pending.append(_Attempt(client, model, messages, policy, on_open, hedged=True))
+            requests += 1
+            metrics.inc("chatapp_api_hedges_total", model=model)
+            continue
+
+        if deadline is None:
+            # próba czeka jeszcze w kolejce puli
+            timeout = CANCEL_POLL_INTERVAL
+        else:
+            timeout = min(deadline, hedge_at or deadline) - now
+            if cancel_event is not None:
+                timeout = min(timeout, CANCEL_POLL_INTERVAL)
+        done, _ = wait([a.future for a in pending], timeout=timeout, return_when=FIRST_COMPLETED)
+        for attempt in [a for a in pending if a.future in done]:
+            pending.remove(attempt)
+            try:
+                first = attempt.future.result()
+            except Exception as e:
+                attempt.generator.close()
+                # przy hedgingu błąd jednej próby nie kończy drugiej
+                error = e
+                continue
+            for loser in pending:
+                loser.abort()
+            record_first_token(model, time.perf_counter() - attempt.started)
+            return attempt, first, requests
+
+    for attempt in pending:
+        attempt.abort()
+    if error is None:
+        error = FirstTokenTimeout("zapytanie przerwane")
+    error.requests = requests
+    raise error
+
+
+def stream_reply(client, model, messages, reply, on_open=None, cancel_event=None, policy=None):
+    """Generator fragmentów odpowiedzi z ponawianiem, hedgingiem i modelem awaryjnym.
+
+    Po zakończeniu `reply` zawiera to samo co w `chatbot.stream_reply` oraz
+    `model` (faktycznie użyty), `attempts` (wysłane zapytania) i `hedged`.
+    `cancel_event` przerywa też czekanie między próbami.
+    """
+    policy = policy or RetryPolicy()
+    started = time.perf_counter()
+    requests = 0
+    error = None
+    for model_index, current_model in enumerate(policy.models(model)):
+        if model_index:
+            metrics.inc("chatapp_api_fallbacks_total", model=current_model)
+        for attempt_no in range(1, policy.max_attempts + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise error or FirstTokenTimeout("zapytanie przerwane")
+            try:
+                attempt, first, sent = _first_token(client, current_model, messages, policy, on_open, cancel_event)
+            except Exception as e:
+                error = e
+                requests += getattr(e, "requests", 1)
+                kind = classify(e)
+                if kind == FATAL or (cancel_event is not None and cancel_event.is_set()):
+                    raise
+                if kind == FALLBACK or attempt_no == policy.max_attempts:
+                    break
+                metrics.inc("chatapp_api_retries_total", model=current_model)
+                delay = policy.backoff(attempt_no, e)
+                if cancel_event is not None:
+                    cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            requests += sent
+            first_token_at = time.perf_counter()
+            try:
+                if first is not None:
+                    yield first
+                    yield from attempt.generator
+            finally:
+                attempt.generator.close()
+                finished = time.perf_counter()
+                reply.update(attempt.reply)
+                reply.update({
+                    "model": current_model,
+                    "attempts": requests,
+                    "hedged": attempt.hedged,
+                    "timing": {
+                        "ttft_s": (first_token_at if first is not None else finished) - started,
+                        "total_s": finished - started,
+                    },
+                })
+            return
+    raise error
@@ -0,0 +1,131 @@
+"""Cache odpowiedzi dla identycznych zapytań.
+
+Kluczem jest skrót SHA-256 z (modelu, pełnej listy wiadomości wysyłanej do
+API) – czyli promptu systemowego i kontekstu zbudowanego przez
+prepare_conversation_context. Każdy wpis to osobny plik JSON w katalogu
+cache; kolejność LRU odtwarzamy z czasów modyfikacji plików (trafienie
+"dotyka" plik), więc przetrwa restart procesu.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import metrics
+from fsutil import atomic_write
+
+# wspólne instancje dla procesu: ścieżka katalogu -> ResponseCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_key(model, messages):
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path, max_entries, ttl):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # klucz -> czas utworzenia wpisu; od najdawniej do najświeżej użytego
+        self._entries = None
+
+    def _load_entries(self):
+        if self._entries is not None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.path.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        self._entries = OrderedDict()
+        for p in files:
+            try:
+                with open(p, "r") as f:
+                    self._entries[p.stem] = json.loads(f.read())["created"]
+            except (OSError, ValueError, KeyError):
+                p.unlink(missing_ok=True)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        (self.path / f"{key}.json").unlink(missing_ok=True)
+
+    def get(self, model, messages):
+        """Zwraca zapamiętaną odpowiedź (oznaczoną jako z cache) albo None."""
+        key = cache_key(model, messages)
+        with self._lock:
+            self._load_entries()
+            created = self._entries.get(key)
+            if created is not None and time.time() - created > self.ttl:
+                self._remove(key)
+                created = None
+            if created is None:
+                self.misses += 1
+                metrics.inc("chatapp_response_cache_total", result="miss")
+                return None
+
+            entry_path = self.path / f"{key}.json"
+            try:
+                with open(entry_path, "r") as f:
+                    entry = json.loads(f.read())
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                metrics.inc("chatapp_response_cache_total", result="miss")
+                return None
+
+            self.hits += 1
+            metrics.inc("chatapp_response_cache_total", result="hit")
+            self._entries.move_to_end(key)
+            os.utime(entry_path)
+
+        return {
+            "role": "assistant",
+            "content": entry["content"],
+            # odpowiedź z cache nic nie kosztuje
+            "usage": {"completion_tokens": 0, "prompt_tokens": 0, "total_tokens": 0},
+            "cached": True,
+        }
+
+    def put(self, model, messages, reply):
+        key = cache_key(model, messages)
+        entry = {
+            "created": time.time(),
+            "model": model,
+            "content": reply["content"],
+            "usage": reply.get("usage", {}),
+        }
+        with self._lock:
+            self._load_entries()
+            atomic_write(self.path / f"{key}.json", json.dumps(entry))
+            self._entries[key] = entry["created"]
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries or ()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def get_response_cache(path, max_entries, ttl):
+    """Zwraca wspólną dla procesu instancję cache dla danego katalogu."""
+    with _caches_lock:
+        cache = _caches.get(str(path))
+        if cache is None:
+            cache = _caches[str(path)] = ResponseCache(path, max_entries, ttl)
+        return cache
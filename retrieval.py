@@ -0,0 +1,235 @@
+"""Przywoływanie starszych wiadomości konwersacji podobnych do nowego pytania.
+
+Okno kontekstu (chatbot.prepare_conversation_context / prepare_block_context)
+bierze tylko ostatnie wiadomości, więc w długiej rozmowie model "zapomina"
+kod i ustalenia z jej początku. Tutaj każda konwersacja ma lokalny indeks
+wiadomości (bez zewnętrznych embeddingów): słowa wiadomości – te same co
+w wyszukiwarce (search_index.terms, polska normalizacja i stemming) – są
+haszowane do HASH_BITS-bitowych identyfikatorów cech, a trafność wiadomości
+dla pytania to BM25 po wspólnych cechach.
+
+Indeks to rzadka macierz wiadomości × cechy w tablicach NumPy (pozycja
+wiadomości, cecha, liczba wystąpień) plus częstości dokumentowe cech.
+Nowe wiadomości są dopisywane na końcu tablic (MessageIndex.sync dokłada
+tylko to, czego jeszcze nie ma), więc po każdej zapisanej wiadomości
+aktualizacja kosztuje tyle, co jej długość. Zapytanie to jeden przebieg
+wektorowy po wszystkich wpisach – bez pętli w Pythonie po wiadomościach.
+
+Indeksy żyją w pamięci procesu (RETRIEVAL_CACHE_SIZE ostatnio używanych
+konwersacji); po restarcie budują się od nowa przy pierwszym pytaniu.
+Bez zainstalowanego numpy przywoływanie jest wyłączone.
+"""
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import metrics
+import tokens
+from config import MODEL, RETRIEVAL_CACHE_SIZE, RETRIEVAL_TOP_K
+from search_index import BM25_B, BM25_K1, STOPWORDS, WORD_RE, _idf, normalize, stem
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - zależność opcjonalna
+    np = None
+
+# 2^20 cech – kolizje haszy w obrębie jednej konwersacji są pomijalne
+HASH_BITS = 20
+HASH_MASK = (1 << HASH_BITS) - 1
+# słowa z policzoną cechą (normalizacja i stemming to większość kosztu budowy indeksu)
+FEATURE_CACHE_SIZE = 100_000
+# początkowa pojemność tablic wpisów (rośnie dwukrotnie)
+INITIAL_CAPACITY = 4_096
+RECALL_HEADER = "Wcześniejsze fragmenty tej rozmowy związane z pytaniem (spoza ostatnich wiadomości):"
+ROLE_LABELS = {"user": "użytkownik", "assistant": "asystent", "system": "system"}
+# zapas na etykietę "[rola, wiadomość N]" i odstępy przy każdej przywołanej wiadomości
+LABEL_TOKENS = 12
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+@lru_cache(maxsize=FEATURE_CACHE_SIZE)
+def _feature(word):
+    """Stabilny (niezależny od procesu) identyfikator cechy słowa; None dla słów pomijanych."""
+    word = normalize(word)
+    if word in STOPWORDS:
+        return None
+    return zlib.crc32(stem(word).encode()) & HASH_MASK
+
+
+def text_features(text):
+    """Cechy słów tekstu (z powtórzeniami) – odpowiednik search_index.terms.
+
+    Normalizacja i stemming idą przez cache słów, a nie przez cały tekst.
+    """
+    return [f for f in map(_feature, WORD_RE.findall(text.lower())) if f is not None]
+
+
+def _fingerprint(message):
+    return message.get("role"), zlib.crc32((message.get("content") or "").encode())
+
+
+class MessageIndex:
+    """Indeks BM25 wiadomości jednej konwersacji (pozycje jak w liście wiadomości)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.postings = 0
+        self.lengths = np.zeros(INITIAL_CAPACITY // 16, dtype=np.float32)
+        self._docs = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._features = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._tfs = np.zeros(INITIAL_CAPACITY, dtype=np.float32)
+        self._df = Counter()
+        self._total_length = 0
+        # pierwsza i ostatnia zaindeksowana wiadomość – wykrycie podmienionej historii
+        self._first = self._last = None
+
+    @property
+    def nbytes(self):
+        return self.lengths.nbytes + self._docs.nbytes + self._features.nbytes + self._tfs.nbytes
+
+    def _reserve(self, postings, count):
+        if postings > len(self._docs):
+            size = max(postings, 2 * len(self._docs))
+            self._docs = np.resize(self._docs, size)
+            self._features = np.resize(self._features, size)
+            self._tfs = np.resize(self._tfs, size)
+        if count > len(self.lengths):
+            self.lengths = np.resize(self.lengths, max(count, 2 * len(self.lengths)))
+
+    def add(self, messages):
+        """Dopisuje wiadomości na kolejnych pozycjach."""
+        if not messages:
+            return
+        docs, features, tfs, lengths = [], [], [], []
+        for position, message in enumerate(messages, self.count):
+            counts = Counter(text_features(message.get("content") or ""))
+            docs += [position] * len(counts)
+            features += counts.keys()
+            tfs += counts.values()
+            lengths.append(sum(counts.values()))
+            self._df.update(counts.keys())
+
+        start, end = self.postings, self.postings + len(docs)
+        self._reserve(end, self.count + len(messages))
+        self._docs[start:end] = docs
+        self._features[start:end] = features
+        self._tfs[start:end] = tfs
+        self.lengths[self.count:self.count + len(messages)] = lengths
+        self._total_length += sum(lengths)
+        self.postings = end
+        if self._first is None:
+            self._first = _fingerprint(messages[0])
+        self._last = _fingerprint(messages[-1])
+        self.count += len(messages)
+
+    def sync(self, messages):
+        """Doprowadza indeks do stanu `messages`, dokładając tylko nowe wiadomości.
+
+        Gdy historia nie jest przedłużeniem zaindeksowanej (obcięta,
+        zmieniona wiadomość), indeks jest budowany od nowa.
+        """
+        with self._lock:
+            if self.count and (
+                len(messages) < self.count
+                or _fingerprint(messages[0]) != self._first
+                or _fingerprint(messages[self.count - 1]) != self._last
+            ):
+                self.reset()
+            self.add(messages[self.count:])
+
+    def search(self, query, limit, before=None):
+        """Do `limit` pozycji wiadomości najtrafniejszych dla `query` jako [(pozycja, wynik)].
+
+        `before` ogranicza wyniki do wiadomości o pozycjach mniejszych niż
+        podana (np. starszych niż okno ostatnich wiadomości).
+        """
+        wanted = np.unique(np.array(text_features(query), dtype=np.int32))
+        with self._lock:
+            count = self.count if before is None else min(before, self.count)
+            if not count or not len(wanted) or limit <= 0:
+                return []
+            docs = self._docs[:self.postings]
+            features = self._features[:self.postings]
+            # "sort" zamiast domyślnej tablicy wielkości zakresu cech (2^20) – kilkanaście razy szybciej
+            mask = np.isin(features, wanted, kind="sort")
+            mask &= docs < count
+            docs, features, tfs = docs[mask], features[mask], self._tfs[:self.postings][mask]
+            if not len(docs):
+                return []
+            # idf liczone względem całej konwersacji, tak jak w wyszukiwarce
+            idf = np.array([_idf(self._df[int(f)], self.count) for f in wanted], dtype=np.float32)
+            average = self._total_length / self.count or 1.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[docs] / average)
+            weights = idf[np.searchsorted(wanted, features)] * tfs * (BM25_K1 + 1) / (tfs + norm)
+            scores = np.bincount(docs, weights=weights, minlength=count)
+
+        limit = min(limit, int(np.count_nonzero(scores)))
+        if not limit:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(position), float(scores[position])) for position in top]
+
+
+def recall_message(index, messages, query, before, max_tokens, model=MODEL, top_k=RETRIEVAL_TOP_K):
+    """Wiadomość systemowa z najtrafniejszymi wiadomościami sprzed pozycji `before`.
+
+    Indeks jest najpierw uzupełniany o nowe wiadomości z `messages`.
+    Z `top_k` najlepszych trafień brane są te, które mieszczą się
+    w `max_tokens` (w kolejności trafności), a w wiadomości stoją
+    chronologicznie. None, gdy nic nie pasuje albo nic się nie mieści.
+    """
+    index.sync(messages)
+    used = tokens.count_tokens(RECALL_HEADER, model) + tokens.TOKENS_PER_MESSAGE
+    chosen = []
+    for position, _ in index.search(query, top_k, before=before):
+        cost = tokens.message_tokens(messages[position], model) + LABEL_TOKENS
+        if used + cost <= max_tokens:
+            chosen.append(position)
+            used += cost
+    if not chosen:
+        return None
+    parts = [RECALL_HEADER]
+    for position in sorted(chosen):
+        message = messages[position]
+        label = ROLE_LABELS.get(message["role"], message["role"])
+        parts.append(f"[{label}, wiadomość {position + 1}]\n{message['content']}")
+    return {"role": "system", "content": "\n\n".join(parts)}
+
+
+def get_index(key):
+    """Indeks konwersacji `key` w pamięci procesu; None, gdy brak numpy."""
+    if np is None or not RETRIEVAL_CACHE_SIZE:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = MessageIndex()
+            while len(_indexes) > RETRIEVAL_CACHE_SIZE:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+def forget(key):
+    with _indexes_lock:
+        _indexes.pop(key, None)
+
+
+@metrics.register_collector
+def _retrieval_metrics():
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return [
+        ("chatapp_retrieval_indexes", {}, len(indexes)),
+        ("chatapp_retrieval_indexed_messages", {}, sum(i.count for i in indexes)),
+        ("chatapp_retrieval_index_bytes", {}, sum(i.nbytes for i in indexes)),
+    ]
@@ -0,0 +1,387 @@
+"""Wyszukiwanie pełnotekstowe i po tagach we wszystkich konwersacjach.
+
+Indeks odwrócony w osobnej bazie SQLite (domyślnie db/search.sqlite3):
+
+- postings – (słowo, konwersacja) -> liczba wystąpień w wiadomościach (tf),
+  w nazwie i tagach (meta_tf) oraz ostatnia wiadomość ze słowem (z niej
+  budujemy snippet),
+- documents – długość konwersacji w słowach, nazwa, tagi, czas zmiany,
+- messages – treść wiadomości do snippetów,
+- tags – (tag, konwersacja) do filtrowania i facetów.
+
+Magazyn (storage.py) aktualizuje indeks przyrostowo: dopisane wiadomości
+dokładają swoje słowa, zmiana nazwy/tagów przelicza tylko meta_tf. Całość
+przebudowujemy tylko przy obcięciu historii jednej konwersacji albo z CLI:
+    python manage.py rebuild-search
+
+Słowa są normalizowane "po polsku": małe litery, bez znaków diakrytycznych
+(żółw -> zolw) i bez typowych końcówek fleksyjnych (rozmowy, rozmowami ->
+rozmow), więc zapytanie trafia w różne formy wyrazu. Ranking to BM25 po
+konwersacjach; wszystkie słowa zapytania muszą wystąpić (AND).
+"""
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+_DIACRITICS = str.maketrans("ąćęłńóśźż", "acelnoszz")
+WORD_RE = re.compile(r"[^\W_]+")
+# od najdłuższych – obcinamy jedną, najdłuższą pasującą końcówkę
+SUFFIXES = sorted(
+    [
+        "iach", "iami", "owie", "ami", "ach", "ego", "emu", "ymi", "imi", "ych", "ich", "owi",
+        "iem", "iom", "iej", "om", "ow", "em", "ej", "ie", "y", "a", "e", "i", "o", "u",
+    ],
+    key=len,
+    reverse=True,
+)
+MIN_STEM = 3
+STOPWORDS = {
+    "a", "aby", "ale", "bo", "by", "co", "czy", "dla", "do", "i", "jak", "jest", "juz", "ma", "mi", "mnie",
+    "na", "nie", "o", "od", "po", "sie", "ta", "tak", "te", "ten", "to", "w", "z", "za", "ze",
+    "an", "and", "are", "for", "in", "is", "it", "of", "on", "or", "the",
+}
+# ile razy słowo z nazwy/tagów waży więcej niż z treści wiadomości
+META_WEIGHT = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_WIDTH = 160
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    conversation_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    tags TEXT NOT NULL DEFAULT '[]',
+    length INTEGER NOT NULL DEFAULT 0,
+    meta_length INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL DEFAULT 0,
+    meta_tf INTEGER NOT NULL DEFAULT 0,
+    last_position INTEGER,
+    PRIMARY KEY (term, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_by_conversation ON postings (conversation_id);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_by_conversation ON tags (conversation_id);
+"""
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def normalize(text):
+    """Małe litery bez polskich znaków; długość tekstu się nie zmienia."""
+    return text.lower().translate(_DIACRITICS)
+
+
+def stem(word):
+    if not word.isalpha():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text):
+    """Lista znormalizowanych słów tekstu (z powtórzeniami)."""
+    return [stem(w) for w in WORD_RE.findall(normalize(text)) if w not in STOPWORDS]
+
+
+def query_terms(query):
+    return list(dict.fromkeys(terms(query)))
+
+
+def _meta_text(name, tags):
+    return " ".join([name or "", *tags])
+
+
+def _idf(df, doc_count):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def make_snippet(content, wanted, width=SNIPPET_WIDTH):
+    """Fragment wiadomości wokół pierwszego trafienia, słowa z zapytania pogrubione."""
+    normalized = normalize(content)
+    if len(normalized) != len(content):
+        # rzadkie znaki zmieniające długość przy lower() – bez wyróżnień
+        return content[:width]
+
+    matches = [m for m in WORD_RE.finditer(normalized) if stem(m.group()) in wanted]
+    if not matches:
+        return content[:width] + ("…" if len(content) > width else "")
+
+    start = max(matches[0].start() - width // 3, 0)
+    end = min(start + width, len(content))
+    parts = []
+    cursor = start
+    for m in matches:
+        if m.start() < start or m.end() > end:
+            continue
+        parts.append(content[cursor:m.start()])
+        parts.append(f"**{content[m.start():m.end()]}**")
+        cursor = m.end()
+    parts.append(content[cursor:end])
+    snippet = "".join(parts).replace("\n", " ")
+    return ("…" if start else "") + snippet + ("…" if end < len(content) else "")
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # nowy plik – magazyn powinien zbudować indeks z istniejących konwersacji
+        self.created = not self.path.exists()
+        self._local = threading.local()
+        self._conn().executescript(SEARCH_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    #
+    # aktualizacja
+    #
+    def _delete(self, conn, conversation_id):
+        for table in ("documents", "postings", "messages", "tags"):
+            conn.execute(f"DELETE FROM {table} WHERE conversation_id = ?", (conversation_id,))
+
+    def _add_messages(self, conn, conversation_id, start, messages):
+        counts = Counter()
+        last_position = {}
+        rows = []
+        for position, message in enumerate(messages, start):
+            content = message.get("content") or ""
+            if message.get("role") == "system" or not content:
+                continue
+            rows.append((conversation_id, position, content))
+            for term in terms(content):
+                counts[term] += 1
+                last_position[term] = position
+
+        conn.execute("INSERT OR IGNORE INTO documents (conversation_id) VALUES (?)", (conversation_id,))
+        conn.executemany("INSERT OR REPLACE INTO messages (conversation_id, position, content) VALUES (?, ?, ?)", rows)
+        conn.executemany(
+            "INSERT INTO postings (term, conversation_id, tf, last_position) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (term, conversation_id) DO UPDATE SET "
+            "tf = tf + excluded.tf, last_position = excluded.last_position",
+            [(term, conversation_id, count, last_position[term]) for term, count in counts.items()],
+        )
+        conn.execute(
+            "UPDATE documents SET length = length + ?, updated_at = ? WHERE conversation_id = ?",
+            (sum(counts.values()), _now(), conversation_id),
+        )
+
+    def _set_meta(self, conn, conversation_id, name, tags):
+        conn.execute("INSERT OR IGNORE INTO documents (conversation_id) VALUES (?)", (conversation_id,))
+        conn.execute("UPDATE postings SET meta_tf = 0 WHERE conversation_id = ? AND meta_tf > 0", (conversation_id,))
+        counts = Counter(terms(_meta_text(name, tags)))
+        conn.executemany(
+            "INSERT INTO postings (term, conversation_id, meta_tf) VALUES (?, ?, ?) "
+            "ON CONFLICT (term, conversation_id) DO UPDATE SET meta_tf = excluded.meta_tf",
+            [(term, conversation_id, count) for term, count in counts.items()],
+        )
+        conn.execute("DELETE FROM postings WHERE conversation_id = ? AND tf = 0 AND meta_tf = 0", (conversation_id,))
+
+        conn.execute("DELETE FROM tags WHERE conversation_id = ?", (conversation_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO tags (tag, conversation_id) VALUES (?, ?)",
+            [(tag, conversation_id) for tag in tags],
+        )
+        conn.execute(
+            "UPDATE documents SET name = ?, tags = ?, meta_length = ?, updated_at = ? WHERE conversation_id = ?",
+            (name or "", json.dumps(tags, ensure_ascii=False), sum(counts.values()), _now(), conversation_id),
+        )
+
+    def _index(self, conn, conversation, fresh=False):
+        conversation_id = conversation["id"]
+        if not fresh:
+            self._delete(conn, conversation_id)
+        self._add_messages(conn, conversation_id, 0, conversation.get("messages", []))
+        self._set_meta(conn, conversation_id, conversation.get("name"), conversation.get("tags", []))
+
+    def index_conversation(self, conversation):
+        """Indeksuje całą konwersację od nowa."""
+        with self._transaction() as conn:
+            self._index(conn, conversation)
+
+    def add_messages(self, conversation_id, start, messages):
+        """Dokłada wiadomości zapisane od pozycji `start`."""
+        with self._transaction() as conn:
+            self._add_messages(conn, conversation_id, start, messages)
+
+    def update_meta(self, conversation_id, name=None, tags=None):
+        """Przelicza słowa z nazwy i tagów (brakujące pole zostaje bez zmian)."""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT name, tags FROM documents WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            old_name, old_tags = (row[0], json.loads(row[1])) if row else ("", [])
+            self._set_meta(
+                conn,
+                conversation_id,
+                old_name if name is None else name,
+                old_tags if tags is None else tags,
+            )
+
+    def remove(self, conversation_id):
+        with self._transaction() as conn:
+            self._delete(conn, conversation_id)
+
+    def rebuild(self, conversations):
+        """Buduje indeks od zera; zwraca liczbę zaindeksowanych konwersacji."""
+        count = 0
+        with self._transaction() as conn:
+            for table in ("documents", "postings", "messages", "tags"):
+                conn.execute(f"DELETE FROM {table}")
+            for conversation in conversations:
+                self._index(conn, conversation, fresh=True)
+                count += 1
+        self.created = False
+        return count
+
+    #
+    # wyszukiwanie
+    #
+    def _tag_filter(self, tags):
+        sql = " INTERSECT ".join("SELECT conversation_id FROM tags WHERE tag = ?" for _ in tags)
+        return sql, list(tags)
+
+    def search(self, query, tags=(), limit=20):
+        """Konwersacje pasujące do zapytania i wszystkich `tags`, od najlepszej.
+
+        Zwraca listę słowników: id, name, tags, score, snippet (None, gdy
+        słowa są tylko w nazwie/tagach) i position wiadomości ze snippetu.
+        """
+        conn = self._conn()
+        wanted = query_terms(query)
+        tags = list(tags)
+        if not wanted and not tags:
+            return []
+
+        if not wanted:
+            tag_sql, params = self._tag_filter(tags)
+            rows = conn.execute(
+                f"SELECT conversation_id, 0 FROM documents WHERE conversation_id IN ({tag_sql}) "
+                "ORDER BY updated_at DESC, conversation_id DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        else:
+            doc_count, avg_length = conn.execute(
+                "SELECT COUNT(*), AVG(length + meta_length) FROM documents"
+            ).fetchone()
+            dfs = {
+                term: conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+                for term in wanted
+            }
+            if not all(dfs.values()):
+                return []
+
+            values = ", ".join("(?, ?)" for _ in wanted)
+            params = [x for t in wanted for x in (t, _idf(dfs[t], doc_count))]
+            params += [META_WEIGHT, BM25_K1, META_WEIGHT, BM25_K1, BM25_B, BM25_B, avg_length or 1]
+            where = ""
+            if tags:
+                tag_sql, tag_params = self._tag_filter(tags)
+                where = f"WHERE p.conversation_id IN ({tag_sql})"
+                params += tag_params
+            rows = conn.execute(
+                f"""
+                WITH q(term, idf) AS (VALUES {values})
+                SELECT p.conversation_id,
+                       SUM(q.idf * (p.tf + ? * p.meta_tf) * (? + 1)
+                           / ((p.tf + ? * p.meta_tf) + ? * (1 - ? + ? * (d.length + d.meta_length) / ?))) AS score
+                FROM q
+                JOIN postings p ON p.term = q.term
+                JOIN documents d ON d.conversation_id = p.conversation_id
+                {where}
+                GROUP BY p.conversation_id
+                HAVING COUNT(*) = ?
+                ORDER BY score DESC
+                LIMIT ?
+                """,
+                (*params, len(wanted), limit),
+            ).fetchall()
+
+        # snippet z ostatniej wiadomości zawierającej najrzadsze słowo zapytania
+        rarest = min(wanted, key=lambda t: dfs[t]) if wanted else None
+        hits = []
+        for conversation_id, score in rows:
+            name, tags_json = conn.execute(
+                "SELECT name, tags FROM documents WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            hit = {
+                "id": conversation_id,
+                "name": name,
+                "tags": json.loads(tags_json),
+                "score": score,
+                "snippet": None,
+                "position": None,
+            }
+            if rarest:
+                (position,) = conn.execute(
+                    "SELECT last_position FROM postings WHERE term = ? AND conversation_id = ?",
+                    (rarest, conversation_id),
+                ).fetchone()
+                if position is not None:
+                    (content,) = conn.execute(
+                        "SELECT content FROM messages WHERE conversation_id = ? AND position = ?",
+                        (conversation_id, position),
+                    ).fetchone()
+                    hit["snippet"] = make_snippet(content, set(wanted))
+                    hit["position"] = position
+            hits.append(hit)
+        return hits
+
+    def tag_facets(self, conversation_ids=None):
+        """Lista (tag, liczba konwersacji) – dla wszystkich albo podanych konwersacji."""
+        conn = self._conn()
+        if conversation_ids is None:
+            rows = conn.execute("SELECT tag, COUNT(*) FROM tags GROUP BY tag ORDER BY COUNT(*) DESC, tag")
+        else:
+            ids = list(conversation_ids)
+            if not ids:
+                return []
+            rows = conn.execute(
+                f"SELECT tag, COUNT(*) FROM tags WHERE conversation_id IN ({', '.join('?' for _ in ids)}) "
+                "GROUP BY tag ORDER BY COUNT(*) DESC, tag",
+                ids,
+            )
+        return [(tag, count) for tag, count in rows]
+
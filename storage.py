@@ -0,0 +1,793 @@
+"""Magazyn konwersacji – wspólny interfejs i dwie implementacje.
+
+- JsonStorage – dotychczasowy układ katalogu db/ (current.json, index.json,
+  conversations/<id>.json + log <id>.jsonl),
+- SqliteStorage – jedna baza SQLite w trybie WAL z indeksowanymi tabelami
+  konwersacji, wiadomości i tagów.
+
+Backend wybiera STORAGE_BACKEND w config.py; get_storage() zwraca wspólną
+dla procesu instancję. Przejście z katalogu JSON na SQLite:
+    python manage.py migrate-sqlite
+
+Oba backendy mają archiwum nieużywanych konwersacji (cold_storage.py,
+katalog cold/ obok danych): archive_conversation przenosi konwersację
+z magazynu do archiwum, restore_conversation z powrotem.
+"""
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import analytics
+import codec
+import cold_storage
+import conversation_index
+import costs
+import message_log
+import search_index
+from config import (
+    STORAGE_BACKEND, DB_PATH, SQLITE_PATH, MESSAGE_LOG, SEARCH_INDEX, SEARCH_INDEX_PATH, ANALYTICS, ANALYTICS_PATH,
+)
+
+# pola konwersacji przechowywane poza listą wiadomości
+CONVERSATION_FIELDS = ("name", "chatbot_personality", "tags")
+# reclaim_space robi VACUUM, gdy wolne strony to co najmniej taka część pliku SQLite
+SQLITE_VACUUM_MIN_FREE = 0.25
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _with_usage(previous, summary, call):
+    # łączne zużycie liczymy od zapisanego podsumowania – sesja może mieć starsze
+    usage = (previous or {}).get("usage")
+    if call.get("usage"):
+        usage = costs.add_usage(usage, call["usage"])
+    summary = {**summary, "model": call["model"]}
+    if usage:
+        summary["usage"] = usage
+    return summary
+
+
+def _safe_namespace(namespace):
+    # przestrzeń nazw trafia do nazwy pliku / klucza – tylko bezpieczne znaki
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(namespace))[:64]
+
+
+class ConversationStorage:
+    """Interfejs magazynu konwersacji używany przez aplikację i narzędzia CLI."""
+
+    # indeks wyszukiwarki (search_index.SearchIndex) aktualizowany przy zapisach
+    search_index = None
+    # archiwum nieużywanych konwersacji (cold_storage.ColdStore)
+    cold = None
+    # statystyki zużycia i kosztów (analytics.AnalyticsStore) aktualizowane przy zapisach
+    analytics = None
+
+    def get_current_id(self, namespace=None):
+        """ID aktualnej konwersacji użytkownika/sesji `namespace`.
+
+        Bez własnego wskaźnika zwracany jest wskaźnik globalny; None oznacza
+        pustą bazę.
+        """
+        raise NotImplementedError
+
+    def set_current_id(self, conversation_id, namespace=None):
+        raise NotImplementedError
+
+    def current_ids(self):
+        """ID aktualnych konwersacji ze wszystkich wskaźników (domyślnego i per przestrzeń nazw)."""
+        raise NotImplementedError
+
+    def allocate_id(self):
+        """Rezerwuje kolejne wolne ID konwersacji."""
+        return self.allocate_ids(1)[0]
+
+    def allocate_ids(self, count):
+        """Rezerwuje naraz `count` kolejnych ID (np. przy imporcie); zwraca range."""
+        raise NotImplementedError
+
+    def save_conversation(self, conversation):
+        """Zapisuje całą konwersację (z wiadomościami), nadpisując istniejącą."""
+        self._write_conversation(conversation)
+        if self.search_index:
+            self.search_index.index_conversation(conversation)
+        if self.analytics is not None:
+            self.analytics.record_conversation(conversation)
+
+    def _write_conversation(self, conversation):
+        """Zapis konwersacji bez aktualizacji wyszukiwarki."""
+        raise NotImplementedError
+
+    def _delete(self, conversation_id):
+        """Usuwa konwersację z magazynu (bez archiwum i wyszukiwarki); zwraca, czy była."""
+        raise NotImplementedError
+
+    def _conversation_lock(self, conversation_id):
+        """Wyłączny dostęp do konwersacji – wstrzymuje jej zapisy (reentrant w wątku)."""
+        raise NotImplementedError
+
+    def _updated_at(self, conversation_id):
+        """Znacznik ostatniej zmiany konwersacji w magazynie; None – brak konwersacji."""
+        raise NotImplementedError
+
+    def load_conversation(self, conversation_id):
+        raise NotImplementedError
+
+    def conversation_version(self, conversation_id):
+        """Znacznik wersji konwersacji, zmieniany przez każdy zapis (do walidacji
+        cache, zob. conversation_cache.py); None – brak konwersacji."""
+        raise NotImplementedError
+
+    def append_messages(self, conversation_id, messages, keep=None):
+        """Dopisuje wiadomości; `keep` obcina wcześniej historię.
+
+        Sumy tokenów i kosztów są aktualizowane w tej samej operacji.
+        Zwraca {"message_count": ..., "totals": ...}.
+        """
+        raise NotImplementedError
+
+    def update_conversation(self, conversation_id, **fields):
+        """Aktualizuje metadane (nazwa, osobowość, tagi, podsumowanie, sumy...)."""
+        raise NotImplementedError
+
+    def save_summary(self, conversation_id, summary, call):
+        """Zapisuje nowe podsumowanie historii i dolicza jego zapytanie do API.
+
+        `call` to {"model", "usage", "created_at"} zapytania podsumowania –
+        trafia do sum kosztów konwersacji i do statystyk, a łączne zużycie
+        wszystkich podsumowań do summary["usage"]. Zwraca nowe sumy.
+        """
+        totals = self._write_summary(conversation_id, summary, call)
+        if self.analytics is not None and call.get("usage"):
+            self.analytics.record_usage(conversation_id, [call])
+        return totals
+
+    def _write_summary(self, conversation_id, summary, call):
+        raise NotImplementedError
+
+    def list_conversations(self):
+        """Lista wpisów: id, name, tags, message_count, updated_at, cost_usd."""
+        raise NotImplementedError
+
+    def conversation_ids(self):
+        raise NotImplementedError
+
+    def delete_conversation(self, conversation_id):
+        """Usuwa konwersację na stałe – z magazynu, archiwum i wyszukiwarki."""
+        # pod blokadą – równoległe przywrócenie nie zapisze jej z powrotem między usunięciami
+        with self._conversation_lock(conversation_id):
+            deleted = self._delete(conversation_id)
+            if self.cold is not None:
+                deleted = self.cold.remove(conversation_id) or deleted
+        if self.search_index is not None:
+            self.search_index.remove(conversation_id)
+        return deleted
+
+    def archive_conversation(self, conversation_id, updated_at=None):
+        """Przenosi konwersację do archiwum; w wyszukiwarce zostaje.
+
+        Z `updated_at` (archiwizacja nieużywanych) konwersacja zmieniona
+        od tego czasu zostaje w magazynie. Zwraca, czy trafiła do archiwum.
+        """
+        # pod blokadą konwersacji – zapis z innej sesji nie wpadnie między odczyt a usunięcie
+        with self._conversation_lock(conversation_id):
+            current = self._updated_at(conversation_id)
+            if updated_at is not None and current != updated_at:
+                return False
+            # najpierw zapis w archiwum – po przerwaniu konwersacja jest w obu miejscach, a nie w żadnym
+            self.cold.put(self.load_conversation(conversation_id), current)
+            self._delete(conversation_id)
+        return True
+
+    def restore_conversation(self, conversation_id):
+        """Przywraca konwersację z archiwum do magazynu i ją zwraca.
+
+        Przywróconą w międzyczasie przez inną sesję zwraca z magazynu;
+        usuniętą – FileNotFoundError.
+        """
+        with self._conversation_lock(conversation_id):
+            if not self.cold.contains(conversation_id):
+                return self.load_conversation(conversation_id)
+            conversation = self.cold.get(conversation_id)
+            self._write_conversation(conversation)
+            self.cold.remove(conversation_id)
+        return conversation
+
+    def is_archived(self, conversation_id):
+        return self.cold is not None and self.cold.contains(conversation_id)
+
+    def archive_idle(self, days, keep_ids=()):
+        """Archiwizuje konwersacje niezmieniane od `days` dni (poza `keep_ids`
+        i aktualnymi konwersacjami wszystkich użytkowników/sesji); zwraca ich ID."""
+        cutoff = cold_storage.idle_cutoff(days)
+        keep = {*keep_ids, *self.current_ids()}
+        archived = []
+        for entry in self.list_conversations():
+            if entry["id"] in keep or not entry.get("updated_at") or entry["updated_at"] >= cutoff:
+                continue
+            if self.archive_conversation(entry["id"], entry["updated_at"]):
+                archived.append(entry["id"])
+        return archived
+
+    def reclaim_space(self):
+        """Oddaje systemowi miejsce po usuniętych danych; zwraca odzyskane bajty."""
+        return 0
+
+    def _all_conversations(self):
+        """Wszystkie konwersacje (także z archiwum) jako pary (konwersacja, updated_at)."""
+        hot = {entry["id"]: entry.get("updated_at") for entry in self.list_conversations()}
+        for conversation_id, updated_at in hot.items():
+            yield self.load_conversation(conversation_id), updated_at
+        if self.cold is not None:
+            # po przerwanej archiwizacji konwersacja może być w obu miejscach – liczy się magazyn
+            for entry in self.cold.list_entries():
+                if entry["id"] not in hot:
+                    yield self.cold.get(entry["id"]), entry["updated_at"]
+
+    def rebuild_search_index(self):
+        """Buduje indeks wyszukiwarki od zera ze wszystkich konwersacji (także z archiwum)."""
+        return self.search_index.rebuild(conversation for conversation, _ in self._all_conversations())
+
+    def rebuild_analytics(self):
+        """Liczy statystyki od zera z historii wszystkich konwersacji (także z archiwum).
+
+        Odpowiedzi bez "created_at" trafiają na dzień ostatniej zmiany
+        konwersacji; wydatki z usuniętych konwersacji i obciętej historii
+        przepadają.
+        """
+        return self.analytics.rebuild(
+            (conversation, updated_at or None) for conversation, updated_at in self._all_conversations()
+        )
+
+    def _index_appended(self, conversation_id, messages, keep, message_count):
+        if self.analytics is not None:
+            self.analytics.record_messages(conversation_id, message_count - len(messages), messages, keep)
+        if self.search_index is None:
+            return
+        if keep is not None:
+            # historia mogła zostać obcięta – indeksujemy konwersację od nowa
+            self.search_index.index_conversation(self.load_conversation(conversation_id))
+        else:
+            self.search_index.add_messages(conversation_id, message_count - len(messages), messages)
+
+    def _index_fields(self, conversation_id, fields):
+        if self.analytics is not None and ("name" in fields or "tags" in fields):
+            self.analytics.update_meta(conversation_id, name=fields.get("name"), tags=fields.get("tags"))
+        if self.search_index is not None and ("name" in fields or "tags" in fields):
+            self.search_index.update_meta(conversation_id, name=fields.get("name"), tags=fields.get("tags"))
+
+
+class JsonStorage(ConversationStorage):
+    def __init__(self, db_path, message_log_mode=MESSAGE_LOG, search_path=None, analytics_path=None):
+        self.db_path = Path(db_path)
+        self.conversations_path = self.db_path / "conversations"
+        self.message_log_mode = message_log_mode
+        self.conversations_path.mkdir(parents=True, exist_ok=True)
+        # ścieżka wskaźnika -> ((i-węzeł, mtime), ID konwersacji)
+        self._pointers = {}
+        if search_path:
+            self.search_index = search_index.SearchIndex(search_path)
+        if analytics_path:
+            self.analytics = analytics.get_analytics(analytics_path)
+        # ten sam katalog, z którego conversation_index bierze ID zarchiwizowanych konwersacji
+        self.cold = cold_storage.get_cold_store(self.db_path / cold_storage.DIRNAME)
+
+    def _current_path(self, namespace):
+        if namespace is None:
+            return self.db_path / "current.json"
+        # każdy użytkownik/sesja ma własny wskaźnik aktualnej konwersacji
+        return self.db_path / "sessions" / f"{_safe_namespace(namespace)}.json"
+
+    def _read_pointer(self, path):
+        # wskaźnik czytany przy każdym rerunie – parsujemy go tylko po zmianie pliku
+        stat = path.stat()
+        version = stat.st_ino, stat.st_mtime_ns
+        cached = self._pointers.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        conversation_id = codec.read_json(path)["current_conversation_id"]
+        self._pointers[path] = (version, conversation_id)
+        return conversation_id
+
+    def get_current_id(self, namespace=None):
+        for path in (self._current_path(namespace), self._current_path(None)):
+            try:
+                return self._read_pointer(path)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def set_current_id(self, conversation_id, namespace=None):
+        paths = [self._current_path(namespace)]
+        if namespace is not None and not self._current_path(None).exists():
+            # pierwsza konwersacja w bazie staje się też domyślną dla nowych sesji
+            paths.append(self._current_path(None))
+        for path in paths:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            codec.write_json(path, {"current_conversation_id": conversation_id})
+
+    def current_ids(self):
+        ids = set()
+        for path in (self._current_path(None), *(self.db_path / "sessions").glob("*.json")):
+            try:
+                ids.add(self._read_pointer(path))
+            except (FileNotFoundError, ValueError, KeyError):
+                continue
+        return ids
+
+    def allocate_ids(self, count):
+        # kolejne wolne ID bierzemy z indeksu zamiast skanować katalog
+        first = conversation_index.allocate_id(self.db_path, count)
+        return range(first, first + count)
+
+    def _write_conversation(self, conversation):
+        message_log.write_conversation(self.conversations_path, conversation, log_mode=self.message_log_mode)
+        conversation_index.upsert_entry(self.db_path, conversation)
+
+    def _delete(self, conversation_id):
+        deleted = message_log.delete_conversation(self.conversations_path, conversation_id)
+        conversation_index.remove_entry(self.db_path, conversation_id)
+        return deleted
+
+    def _conversation_lock(self, conversation_id):
+        return message_log.conversation_lock(self.conversations_path, conversation_id)
+
+    def _updated_at(self, conversation_id):
+        entry = conversation_index.load_index(self.db_path)["conversations"].get(str(conversation_id))
+        return entry and entry.get("updated_at")
+
+    def load_conversation(self, conversation_id):
+        return message_log.load_conversation(self.conversations_path, conversation_id)
+
+    def conversation_version(self, conversation_id):
+        # nagłówek jest przy każdym zapisie zastępowany nowym plikiem (nowy i-węzeł),
+        # a log tylko rośnie albo jest przepisywany razem z nagłówkiem
+        try:
+            header = message_log.header_path(self.conversations_path, conversation_id).stat()
+        except FileNotFoundError:
+            return None
+        try:
+            log_size = message_log.log_path(self.conversations_path, conversation_id).stat().st_size
+        except FileNotFoundError:
+            log_size = None
+        return header.st_ino, header.st_mtime_ns, header.st_size, log_size
+
+    def append_messages(self, conversation_id, messages, keep=None):
+        def update_totals(header, truncated):
+            if truncated or "totals" not in header:
+                # historia skrócona albo stary plik bez sum – liczymy od zera
+                header["totals"] = costs.conversation_totals(
+                    message_log.read_messages(self.conversations_path, conversation_id), header.get("summary")
+                )
+            else:
+                header["totals"] = costs.add_to_totals(header["totals"], messages)
+
+        if self.message_log_mode:
+            # dopisujemy tylko nowe wiadomości do logu
+            header = message_log.append_messages(
+                self.conversations_path, conversation_id, messages, keep=keep, on_header=update_totals
+            )
+            message_count = header.get("message_count", 0)
+            totals = header.get("totals") or costs.empty_totals()
+        else:
+            with message_log.conversation_lock(self.conversations_path, conversation_id):
+                conversation = message_log.read_header(self.conversations_path, conversation_id)
+                history = conversation.get("messages", [])
+                truncated = keep is not None and keep < len(history)
+                if truncated:
+                    history = history[:keep]
+                conversation["messages"] = history + list(messages)
+                if truncated or "totals" not in conversation:
+                    conversation["totals"] = costs.conversation_totals(
+                        conversation["messages"], conversation.get("summary")
+                    )
+                else:
+                    conversation["totals"] = costs.add_to_totals(conversation["totals"], messages)
+                message_log.write_header(self.conversations_path, conversation_id, conversation)
+            message_count = len(conversation["messages"])
+            totals = conversation["totals"]
+
+        conversation_index.update_entry(
+            self.db_path, conversation_id, message_count=message_count, cost_usd=totals["cost_usd"]
+        )
+        self._index_appended(conversation_id, messages, keep, message_count)
+        return {"message_count": message_count, "totals": totals}
+
+    def update_conversation(self, conversation_id, **fields):
+        message_log.update_header(self.conversations_path, conversation_id, **fields)
+
+        entry_fields = {k: v for k, v in fields.items() if k in ("name", "tags")}
+        if "totals" in fields:
+            entry_fields["cost_usd"] = fields["totals"]["cost_usd"]
+        if entry_fields:
+            conversation_index.update_entry(self.db_path, conversation_id, **entry_fields)
+        self._index_fields(conversation_id, fields)
+
+    def _write_summary(self, conversation_id, summary, call):
+        with message_log.conversation_lock(self.conversations_path, conversation_id):
+            header = message_log.read_header(self.conversations_path, conversation_id)
+            header["summary"] = _with_usage(header.get("summary"), summary, call)
+            if "totals" in header:
+                header["totals"] = costs.add_to_totals(header["totals"], [call])
+            else:
+                messages = message_log.load_conversation(self.conversations_path, conversation_id)["messages"]
+                header["totals"] = costs.conversation_totals(messages, header["summary"])
+            message_log.write_header(self.conversations_path, conversation_id, header)
+        conversation_index.update_entry(self.db_path, conversation_id, cost_usd=header["totals"]["cost_usd"])
+        return header["totals"]
+
+    def list_conversations(self):
+        # czytamy tylko manifest, a nie wszystkie pliki konwersacji
+        return conversation_index.list_entries(self.db_path)
+
+    def conversation_ids(self):
+        return sorted(int(p.stem) for p in self.conversations_path.glob("*.json"))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    chatbot_personality TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT '[]',
+    meta TEXT NOT NULL DEFAULT '{}',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversation_tags (
+    conversation_id INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (conversation_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversation_tags_by_tag ON conversation_tags (tag);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SqliteStorage(ConversationStorage):
+    def __init__(self, path, search_path=None, analytics_path=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # połączenie na wątek – Streamlit obsługuje sesje w osobnych wątkach
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SQLITE_SCHEMA)
+        if "version" not in [row[1] for row in conn.execute("PRAGMA table_info(conversations)")]:
+            # baza sprzed licznika wersji (cache konwersacji)
+            conn.execute("ALTER TABLE conversations ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if search_path:
+            self.search_index = search_index.SearchIndex(search_path)
+        if analytics_path:
+            self.analytics = analytics.get_analytics(analytics_path)
+        self.cold = cold_storage.get_cold_store(self.path.parent / cold_storage.DIRNAME)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        if conn.in_transaction:
+            # zagnieżdżona operacja (np. usunięcie przy archiwizacji) – w ramach zewnętrznej transakcji
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _get_setting(self, conn, key):
+        row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, conn, key, value):
+        conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    def _current_key(self, namespace):
+        if namespace is None:
+            return "current_conversation_id"
+        return f"current_conversation_id:{_safe_namespace(namespace)}"
+
+    def get_current_id(self, namespace=None):
+        conn = self._conn()
+        value = self._get_setting(conn, self._current_key(namespace))
+        if value is None and namespace is not None:
+            value = self._get_setting(conn, self._current_key(None))
+        return int(value) if value is not None else None
+
+    def current_ids(self):
+        rows = self._conn().execute(
+            "SELECT value FROM settings WHERE key = ? OR key LIKE ?",
+            (self._current_key(None), self._current_key(None) + ":%"),
+        )
+        return {int(value) for (value,) in rows}
+
+    def set_current_id(self, conversation_id, namespace=None):
+        with self._transaction() as conn:
+            self._set_setting(conn, self._current_key(namespace), conversation_id)
+            if namespace is not None and self._get_setting(conn, self._current_key(None)) is None:
+                # pierwsza konwersacja w bazie staje się też domyślną dla nowych sesji
+                self._set_setting(conn, self._current_key(None), conversation_id)
+
+    def allocate_ids(self, count):
+        with self._transaction() as conn:
+            next_id = self._get_setting(conn, "next_id")
+            if next_id is None:
+                (last_id,) = conn.execute("SELECT COALESCE(MAX(id), 0) FROM conversations").fetchone()
+                next_id = max(last_id, cold_storage.max_id(self.cold.path)) + 1
+            first = int(next_id)
+            self._set_setting(conn, "next_id", first + count)
+        return range(first, first + count)
+
+    def _write_tags(self, conn, conversation_id, tags):
+        conn.execute("DELETE FROM conversation_tags WHERE conversation_id = ?", (conversation_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO conversation_tags (conversation_id, tag) VALUES (?, ?)",
+            [(conversation_id, tag) for tag in tags],
+        )
+
+    def _write_conversation(self, conversation):
+        conversation_id = conversation["id"]
+        messages = conversation.get("messages", [])
+        meta = {k: v for k, v in conversation.items() if k not in ("id", "messages", *CONVERSATION_FIELDS)}
+        tags = conversation.get("tags", [])
+        cost_usd = (conversation.get("totals") or {}).get("cost_usd", 0)
+
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations "
+                "(id, name, chatbot_personality, tags, meta, message_count, cost_usd, updated_at, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, "
+                "COALESCE((SELECT version FROM conversations WHERE id = ?), 0) + 1)",
+                (
+                    conversation_id,
+                    conversation["name"],
+                    conversation["chatbot_personality"],
+                    codec.dumps_text(tags),
+                    codec.dumps_text(meta),
+                    len(messages),
+                    cost_usd,
+                    _now(),
+                    conversation_id,
+                ),
+            )
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, position, data) VALUES (?, ?, ?)",
+                [(conversation_id, i, codec.dumps_text(m)) for i, m in enumerate(messages)],
+            )
+            self._write_tags(conn, conversation_id, tags)
+
+            next_id = self._get_setting(conn, "next_id")
+            if next_id is None or int(next_id) <= conversation_id:
+                self._set_setting(conn, "next_id", conversation_id + 1)
+
+    def _delete(self, conversation_id):
+        with self._transaction() as conn:
+            deleted = conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM conversation_tags WHERE conversation_id = ?", (conversation_id,))
+            # next_id w settings zostaje – usunięte ID nie wrócą do obiegu
+        return deleted
+
+    def _conversation_lock(self, conversation_id):
+        # BEGIN IMMEDIATE trzyma blokadę zapisu bazy do końca operacji
+        return self._transaction()
+
+    def _updated_at(self, conversation_id):
+        row = self._conn().execute("SELECT updated_at FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def reclaim_space(self):
+        # usunięte wiersze zostawiają wolne strony w pliku – VACUUM, gdy to ponad ćwierć bazy
+        conn = self._conn()
+        (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+        (pages,) = conn.execute("PRAGMA page_count").fetchone()
+        (page_size,) = conn.execute("PRAGMA page_size").fetchone()
+        if not pages or free / pages < SQLITE_VACUUM_MIN_FREE:
+            return 0
+        conn.execute("VACUUM")
+        return free * page_size
+
+    def load_conversation(self, conversation_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT id, name, chatbot_personality, tags, meta FROM conversations WHERE id = ?",
+            (conversation_id,),
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Brak konwersacji {conversation_id}")
+
+        conversation = {
+            **codec.loads(row[4]),
+            "id": row[0],
+            "name": row[1],
+            "chatbot_personality": row[2],
+            "tags": codec.loads(row[3]),
+        }
+        conversation["messages"] = [
+            codec.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM messages WHERE conversation_id = ? ORDER BY position",
+                (conversation_id,),
+            )
+        ]
+        return conversation
+
+    def conversation_version(self, conversation_id):
+        row = self._conn().execute("SELECT version FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def append_messages(self, conversation_id, messages, keep=None):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT message_count, meta FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                # jak JsonStorage – konwersacja usunięta albo zarchiwizowana w innej sesji
+                raise FileNotFoundError(f"Brak konwersacji {conversation_id}")
+            message_count, meta = row[0], codec.loads(row[1])
+            truncated = keep is not None and keep < message_count
+            if truncated:
+                conn.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND position >= ?",
+                    (conversation_id, keep),
+                )
+                message_count = keep
+
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, position, data) VALUES (?, ?, ?)",
+                [(conversation_id, message_count + i, codec.dumps_text(m)) for i, m in enumerate(messages)],
+            )
+            message_count += len(messages)
+
+            if truncated or "totals" not in meta:
+                # historia skrócona albo brak sum – liczymy od zera
+                meta["totals"] = self._compute_totals(conn, conversation_id, meta.get("summary"))
+            else:
+                meta["totals"] = costs.add_to_totals(meta["totals"], messages)
+
+            conn.execute(
+                "UPDATE conversations SET message_count = ?, meta = ?, cost_usd = ?, updated_at = ?, "
+                "version = version + 1 WHERE id = ?",
+                (message_count, codec.dumps_text(meta), meta["totals"]["cost_usd"], _now(), conversation_id),
+            )
+        self._index_appended(conversation_id, messages, keep, message_count)
+        return {"message_count": message_count, "totals": meta["totals"]}
+
+    def _compute_totals(self, conn, conversation_id, summary):
+        return costs.conversation_totals(
+            [
+                codec.loads(data)
+                for (data,) in conn.execute(
+                    "SELECT data FROM messages WHERE conversation_id = ? ORDER BY position", (conversation_id,)
+                )
+            ],
+            summary,
+        )
+
+    def _update_fields(self, conn, conversation_id, fields):
+        row = conn.execute("SELECT meta FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Brak konwersacji {conversation_id}")
+        for column in ("name", "chatbot_personality"):
+            if column in fields:
+                conn.execute(
+                    f"UPDATE conversations SET {column} = ? WHERE id = ?",
+                    (fields[column], conversation_id),
+                )
+        if "tags" in fields:
+            conn.execute(
+                "UPDATE conversations SET tags = ? WHERE id = ?",
+                (codec.dumps_text(fields["tags"]), conversation_id),
+            )
+            self._write_tags(conn, conversation_id, fields["tags"])
+
+        meta_fields = {k: v for k, v in fields.items() if k not in CONVERSATION_FIELDS}
+        if meta_fields:
+            meta = {**codec.loads(row[0]), **meta_fields}
+            conn.execute("UPDATE conversations SET meta = ? WHERE id = ?", (codec.dumps_text(meta), conversation_id))
+        if "totals" in fields:
+            conn.execute(
+                "UPDATE conversations SET cost_usd = ? WHERE id = ?",
+                (fields["totals"]["cost_usd"], conversation_id),
+            )
+        conn.execute(
+            "UPDATE conversations SET updated_at = ?, version = version + 1 WHERE id = ?",
+            (_now(), conversation_id),
+        )
+
+    def update_conversation(self, conversation_id, **fields):
+        with self._transaction() as conn:
+            self._update_fields(conn, conversation_id, fields)
+        self._index_fields(conversation_id, fields)
+
+    def _write_summary(self, conversation_id, summary, call):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT meta FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"Brak konwersacji {conversation_id}")
+            meta = codec.loads(row[0])
+            meta["summary"] = _with_usage(meta.get("summary"), summary, call)
+            if "totals" in meta:
+                meta["totals"] = costs.add_to_totals(meta["totals"], [call])
+            else:
+                meta["totals"] = self._compute_totals(conn, conversation_id, meta["summary"])
+            conn.execute(
+                "UPDATE conversations SET meta = ?, cost_usd = ?, updated_at = ?, version = version + 1 WHERE id = ?",
+                (codec.dumps_text(meta), meta["totals"]["cost_usd"], _now(), conversation_id),
+            )
+        return meta["totals"]
+
+    def list_conversations(self):
+        return [
+            {
+                "id": row[0],
+                "name": row[1],
+                "tags": codec.loads(row[2]),
+                "message_count": row[3],
+                "updated_at": row[4],
+                "cost_usd": row[5],
+            }
+            for row in self._conn().execute(
+                "SELECT id, name, tags, message_count, updated_at, cost_usd FROM conversations ORDER BY id"
+            )
+        ]
+
+    def conversation_ids(self):
+        return [row[0] for row in self._conn().execute("SELECT id FROM conversations ORDER BY id")]
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(backend=STORAGE_BACKEND):
+    """Zwraca wspólną dla procesu instancję wybranego magazynu."""
+    with _storages_lock:
+        storage = _storages.get(backend)
+        if storage is None:
+            search_path = SEARCH_INDEX_PATH if SEARCH_INDEX else None
+            analytics_path = ANALYTICS_PATH if ANALYTICS else None
+            if backend == "json":
+                storage = JsonStorage(DB_PATH, search_path=search_path, analytics_path=analytics_path)
+            elif backend == "sqlite":
+                storage = SqliteStorage(SQLITE_PATH, search_path=search_path, analytics_path=analytics_path)
+            else:
+                raise ValueError(f"Nieznany backend magazynu: {backend}")
+            if storage.search_index is not None and storage.search_index.created:
+                # pierwsze uruchomienie z wyszukiwarką – indeksujemy istniejące konwersacje
+                storage.rebuild_search_index()
+            if storage.analytics is not None and storage.analytics.created:
+                # tak samo statystyki – z historii zapisanych odpowiedzi
+                storage.rebuild_analytics()
+            _storages[backend] = storage
+        return storage
@@ -0,0 +1,168 @@
+"""Kroczące podsumowanie starszej części rozmowy.
+
+Gdy niepodsumowana historia przekracza SUMMARY_TRIGGER_TOKENS, najstarsze
+wiadomości są w tle (poza ścieżką odpowiedzi) dopisywane do istniejącego
+podsumowania, które trafia do metadanych konwersacji:
+
+    "summary": {
+        "text": "...",
+        "covered": 120,          # ile pierwszych wiadomości obejmuje
+        "covered_tokens": 48000, # ile tokenów miały te wiadomości
+        "tokens": 900,           # ile tokenów ma samo podsumowanie
+        "model": "gpt-4o-mini",  # model ostatniego zapytania podsumowania
+        "usage": {...},          # łączne zużycie wszystkich zapytań podsumowania
+    }
+
+Kontekst wysyłany do modelu to wtedy: system + podsumowanie + wiadomości
+od indeksu `covered`, więc rozmiar promptu nie rośnie z długością rozmowy.
+
+Za zapytania podsumowania płacimy jak za odpowiedzi – ich koszt trafia do
+sum konwersacji, dziennego limitu kosztu i statystyk (storage.save_summary).
+Błędy zadań w tle liczy metryka chatapp_summary_total{status="error"},
+a ostatni błąd danej konwersacji zwraca last_error (do następnego udanego
+podsumowania).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import clients
+import metrics
+import ratelimit
+import tokens
+from config import SUMMARY_MODEL, SUMMARY_TRIGGER_TOKENS, SUMMARY_KEEP_RECENT_TOKENS
+
+SUMMARY_PROMPT = """
+Prowadzisz zwięzłe, narastające podsumowanie rozmowy programisty z asystentem.
+Dopisz do dotychczasowego podsumowania najważniejsze nowe informacje z podanych
+wiadomości: ustalenia, decyzje, wymagania, nazwy plików i funkcji oraz istotne
+fragmenty kodu. Nie powtarzaj tego, co już jest w podsumowaniu. Zwróć pełne,
+zaktualizowane podsumowanie (bez wstępów).
+""".strip()
+
+# jedno podsumowanie naraz na konwersację, wspólna pula dla procesu
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+_in_progress = set()
+_lock = threading.Lock()
+# ostatni błąd podsumowania w tle per (magazyn, konwersacja); udane podsumowanie go usuwa
+_errors = {}
+
+
+def last_error(storage, conversation_id):
+    """Opis błędu ostatniego podsumowania konwersacji w tle albo None."""
+    return _errors.get((id(storage), conversation_id))
+
+
+def summary_message(summary):
+    """Wiadomość systemowa wstrzykiwana zaraz po osobowości."""
+    return {
+        "role": "system",
+        "content": f"Podsumowanie wcześniejszej części rozmowy:\n{summary['text']}",
+    }
+
+
+def tokens_saved(summary):
+    """Ile tokenów promptu oszczędza podsumowanie względem pełnej historii."""
+    if not summary:
+        return 0
+    return max(summary["covered_tokens"] - summary["tokens"], 0)
+
+
+def pick_fold_range(messages, summary, model, trigger_tokens=SUMMARY_TRIGGER_TOKENS,
+                    keep_recent_tokens=SUMMARY_KEEP_RECENT_TOKENS):
+    """Zwraca (start, end) wiadomości do dopisania do podsumowania albo None.
+
+    Zostawiamy niepodsumowane ostatnie `keep_recent_tokens` tokenów, a
+    podsumowanie rozszerzamy dopiero, gdy reszta przekroczy `trigger_tokens`.
+    """
+    start = summary["covered"] if summary else 0
+    pending = [tokens.message_tokens(m, model) for m in messages[start:]]
+    if sum(pending) <= trigger_tokens:
+        return None
+
+    # idziemy od końca, aż uzbieramy okno ostatnich wiadomości
+    recent = 0
+    end = len(messages)
+    for count in reversed(pending):
+        if recent + count > keep_recent_tokens:
+            break
+        recent += count
+        end -= 1
+
+    if end <= start:
+        return None
+    return start, end
+
+
+def extend_summary(client, summary, messages, start, end, model=SUMMARY_MODEL, usage=None):
+    """Dopisuje wiadomości [start:end] do podsumowania (jedno zapytanie do API).
+
+    Jeśli podano słownik `usage`, trafia do niego zużycie tokenów zapytania.
+    """
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages[start:end])
+    previous = summary["text"] if summary else "(brak)"
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Dotychczasowe podsumowanie:\n{previous}\n\nNowe wiadomości:\n{transcript}"},
+        ],
+    )
+    text = response.choices[0].message.content
+    if usage is not None and response.usage:
+        usage.update({
+            "completion_tokens": response.usage.completion_tokens,
+            "prompt_tokens": response.usage.prompt_tokens,
+            "total_tokens": response.usage.total_tokens,
+        })
+    covered_tokens = (summary["covered_tokens"] if summary else 0) + sum(
+        tokens.message_tokens(m, model) for m in messages[start:end]
+    )
+    return {
+        "text": text,
+        "covered": end,
+        "covered_tokens": covered_tokens,
+        "tokens": tokens.count_tokens(text, model) + tokens.TOKENS_PER_MESSAGE,
+    }
+
+
+def _run(client, storage, conversation_id, summary, messages, start, end):
+    key = (id(storage), conversation_id)
+    try:
+        # podsumowania dzielą limit klucza API z odpowiedziami, we własnej kolejce sesji
+        limiter = ratelimit.get_limiter(client)
+        estimated = ratelimit.estimate_tokens(messages[start:end], SUMMARY_MODEL)
+        ticket = limiter.acquire("summary", estimated, SUMMARY_MODEL)
+        usage = {}
+        try:
+            with clients.in_use(client):
+                new_summary = extend_summary(client, summary, messages, start, end, usage=usage)
+        finally:
+            limiter.settle(ticket, usage)
+        call = {"model": SUMMARY_MODEL, "usage": usage, "created_at": datetime.now().isoformat(timespec="seconds")}
+        storage.save_summary(conversation_id, new_summary, call)
+        metrics.inc("chatapp_summary_total", status="ok")
+        _errors.pop(key, None)
+    except Exception as e:
+        # nikt nie czyta wyniku Future – błąd zostaje w metryce i w _errors
+        metrics.inc("chatapp_summary_total", status="error")
+        _errors[key] = f"{type(e).__name__}: {e}"
+    finally:
+        with _lock:
+            _in_progress.discard(key)
+
+
+def schedule_summary(client, storage, conversation_id, summary, messages, model):
+    """Jeśli trzeba, zleca w tle rozszerzenie podsumowania. Zwraca Future lub None."""
+    fold = pick_fold_range(messages, summary, model)
+    if fold is None:
+        return None
+
+    key = (id(storage), conversation_id)
+    with _lock:
+        if key in _in_progress:
+            return None
+        _in_progress.add(key)
+
+    # kopia listy – sesja może dalej dopisywać wiadomości
+    return _executor.submit(_run, client, storage, conversation_id, summary, list(messages), *fold)
@@ -0,0 +1,75 @@
+"""Liczenie tokenów wiadomości tokenizerem zgodnym z modelem (tiktoken).
+
+Liczba tokenów każdej wiadomości jest liczona raz i zapisywana w samej
+wiadomości pod kluczem "tokens" ({nazwa kodowania: liczba}), więc kolejne
+budowy kontekstu jej nie przeliczają. Nowe wiadomości są liczone przed
+zapisem, więc liczba trafia do magazynu razem z nimi; starszym (sprzed
+liczenia) dopisujemy ją tylko w pamięci – nie przepisujemy dla niej całej
+historii. Bez tiktoken (albo gdy nie da się wczytać kodowania, np. plik
+nie jest w cache, a nie ma sieci) używamy zachowawczego przybliżenia na
+podstawie długości tekstu.
+"""
+import logging
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - zależność opcjonalna
+    tiktoken = None
+
+# kodowanie używane przez modele z rodziny gpt-4o
+DEFAULT_ENCODING = "o200k_base"
+# narzut formatu czatu na każdą wiadomość (rola, separatory) oraz na start odpowiedzi
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+# przybliżenie bez tiktoken: polski tekst i kod to ok. 3 znaki na token
+APPROX_CHARS_PER_TOKEN = 3
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        # tiktoken pobiera plik kodowania przy pierwszym użyciu – bez sieci zostaje przybliżenie
+        log.warning("Nie udało się wczytać kodowania tiktoken dla %s (%r), liczę w przybliżeniu", model, e)
+        return None
+
+
+def encoding_name(model):
+    encoding = get_encoding(model)
+    return encoding.name if encoding is not None else "approx"
+
+
+def count_tokens(text, model):
+    """Zwraca liczbę tokenów tekstu dla danego modelu."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message, model):
+    """Liczba tokenów wiadomości (z narzutem formatu), liczona raz i
+    zapamiętywana w `message["tokens"]`."""
+    name = encoding_name(model)
+    cached = message.get("tokens")
+    if cached and name in cached:
+        return cached[name]
+
+    count = count_tokens(message["content"], model) + TOKENS_PER_MESSAGE
+    message["tokens"] = {**(cached or {}), name: count}
+    return count
+
+
+def prompt_tokens(messages, model):
+    """Tokeny promptu z listy wiadomości – tak jak liczy je API (z narzutem odpowiedzi)."""
+    return sum(message_tokens(m, model) for m in messages) + TOKENS_PER_REPLY